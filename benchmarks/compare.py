@@ -0,0 +1,58 @@
+"""Сравнение двух отчетов benchmarks/run_benchmarks.py.
+
+Запуск из корня проекта:
+    python -m benchmarks.compare old.json new.json --threshold 0.2
+Код возврата 1 означает, что какая-то операция замедлилась больше,
+чем на threshold (по ops/s).
+"""
+import argparse
+import json
+import sys
+from typing import Union
+
+
+def compare(old: dict, new: dict, threshold: float = 0.2) -> tuple[list[str], bool]:
+    """Функция принимает три параметра:
+    - old, new: отчеты до и после изменения;
+    - threshold: допустимая доля замедления.
+    Функция возвращает строки сравнения для операций, которые есть
+    в обоих отчетах, и признак того, что найдено замедление.
+    """
+    old_results = {
+        (result['scale'], result['operation']): result for result in old['results']
+        }
+    lines = []
+    regressed = False
+    for result in new['results']:
+        previous = old_results.get((result['scale'], result['operation']))
+        if previous is None or not previous['ops_per_sec']:
+            continue
+        ratio = result['ops_per_sec'] / previous['ops_per_sec']
+        mark = ''
+        if ratio < 1 - threshold:
+            mark = ' REGRESSION'
+            regressed = True
+        lines.append(
+            f'{result["scale"]:>8} {result["operation"]:<20} '
+            f'{previous["ops_per_sec"]:>10.1f} -> {result["ops_per_sec"]:>10.1f} '
+            f'ops/s ({ratio:.2f}x), p99 {previous["p99_ms"]:.3f} -> '
+            f'{result["p99_ms"]:.3f} ms{mark}'
+            )
+    return lines, regressed
+
+
+def main(argv: Union[list[str], None] = None) -> int:
+    """Функция сравнивает два отчета и печатает результат."""
+    parser = argparse.ArgumentParser(description='Сравнение отчетов бенчмарков')
+    parser.add_argument('old')
+    parser.add_argument('new')
+    parser.add_argument('--threshold', type=float, default=0.2)
+    args = parser.parse_args(argv)
+    with open(args.old, 'r') as file_old, open(args.new, 'r') as file_new:
+        lines, regressed = compare(json.load(file_old), json.load(file_new), args.threshold)
+    print('\n'.join(lines))
+    return 1 if regressed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,91 @@
+"""Генераторы синтетических данных для бенчмарков CarService.
+
+Все данные детерминированы: vin автомобиля с номером i вычисляется
+по i, поэтому для выборки случайных автомобилей не нужно хранить
+в памяти список всех vin даже на миллионе записей.
+"""
+import random
+from datetime import datetime, timedelta
+from decimal import Decimal
+from typing import Iterator
+
+from models import Car, CarStatus, Model, Sale
+
+# символы, допустимые в vin (без I, O и Q)
+VIN_ALPHABET = 'ABCDEFGHJKLMNPRSTUVWXYZ0123456789'
+VIN_LENGTH = 17
+# взаимно простой с 33 ** 17 множитель: разные номера дают разные vin
+VIN_MULTIPLIER = 1_000_000_007
+
+BRANDS = ['Kia', 'Mazda', 'Nissan', 'Renault', 'Lada', 'Toyota', 'Skoda', 'Hyundai']
+START_DATE = datetime(2024, 1, 1)
+
+
+def make_vin(number: int, seed: int = 0) -> str:
+    """Функция принимает два параметра:
+    - number: номер автомобиля;
+    - seed: зерно генерации.
+    Функция возвращает vin автомобиля с номером number.
+    Разные номера при одном seed дают разные vin.
+    """
+    value = (number * VIN_MULTIPLIER + seed) % len(VIN_ALPHABET) ** VIN_LENGTH
+    symbols = []
+    for _ in range(VIN_LENGTH):
+        value, position = divmod(value, len(VIN_ALPHABET))
+        symbols.append(VIN_ALPHABET[position])
+    return ''.join(symbols)
+
+
+def generate_models(count: int) -> list[Model]:
+    """Функция возвращает count моделей с id от 1 до count."""
+    return [
+        Model(id=model_id, name=f'Model-{model_id}', brand=BRANDS[model_id % len(BRANDS)])
+        for model_id in range(1, count + 1)
+        ]
+
+
+def make_car(number: int, models_count: int, seed: int = 0) -> Car:
+    """Функция принимает три параметра:
+    - number: номер автомобиля;
+    - models_count: количество моделей;
+    - seed: зерно генерации.
+    Функция возвращает автомобиль с номером number.
+    """
+    rnd = random.Random(number * 31 + seed)
+    return Car(
+        vin=make_vin(number, seed),
+        model=rnd.randint(1, models_count),
+        price=Decimal(rnd.randint(100_000, 500_000)).scaleb(-2),
+        date_start=START_DATE + timedelta(days=rnd.randint(0, 365)),
+        status=CarStatus.reserve if rnd.random() < 0.05 else CarStatus.available,
+        )
+
+
+def generate_cars(
+        start: int,
+        count: int,
+        models_count: int,
+        seed: int = 0
+        ) -> Iterator[Car]:
+    """Функция по одному возвращает автомобили с номерами
+    от start до start + count.
+    """
+    for number in range(start, start + count):
+        yield make_car(number, models_count, seed)
+
+
+def make_sale(number: int, vin: str, seed: int = 0) -> Sale:
+    """Функция принимает три параметра:
+    - number: номер продажи;
+    - vin: vin проданного автомобиля;
+    - seed: зерно генерации.
+    Функция возвращает продажу автомобиля vin.
+    """
+    rnd = random.Random(number * 17 + seed)
+    sales_date = START_DATE + timedelta(days=rnd.randint(0, 600))
+    return Sale(
+        sales_number=f'{sales_date:%Y%m%d}#{vin}',
+        car_vin=vin,
+        sales_date=sales_date,
+        cost=Decimal(rnd.randint(100_000, 500_000)).scaleb(-2),
+        )
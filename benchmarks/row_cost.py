@@ -0,0 +1,102 @@
+"""Сравнение стоимости построения строк результата при чтении.
+
+Один и тот же набор автомобилей читается разными способами: с проверкой
+полей pydantic, без проверки (trusted_reads) и в виде легких записей
+CarRecord. Для каждого способа считается время на одну строку, чтобы
+видеть, сколько из него приходится на построение моделей, а не на чтение.
+
+Запуск из корня проекта (каталог src должен быть в PYTHONPATH):
+    python -m benchmarks.row_cost --cars 100000 --output row_cost.json
+"""
+import argparse
+import json
+import sys
+import tempfile
+import time
+from typing import Callable, Union
+
+from benchmarks.generators import generate_cars, generate_models, make_vin
+from benchmarks.run_benchmarks import LOAD_BATCH, get_commit
+from bibip_car_service import CarService
+from models import CarStatus, FileForObject
+
+MODELS_COUNT = 100
+
+
+def best_time(func: Callable, repeats: int) -> float:
+    """Функция принимает два параметра:
+    - func: замеряемая функция без аргументов;
+    - repeats: количество повторов.
+    Функция возвращает наименьшее время вызова func в наносекундах.
+    """
+    best = None
+    for _ in range(repeats):
+        started = time.perf_counter_ns()
+        func()
+        elapsed = time.perf_counter_ns() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def measure_row_cost(root_directory_path: str, cars_count: int, repeats: int = 3) -> list[dict]:
+    """Функция принимает три параметра:
+    - root_directory_path: пустой каталог для БД;
+    - cars_count: количество автомобилей;
+    - repeats: количество повторов каждого замера.
+    Функция возвращает время на одну строку для каждого способа чтения.
+    """
+    service = CarService(root_directory_path)
+    trusted = CarService(root_directory_path, trusted_reads=True)
+    service.add_models(generate_models(MODELS_COUNT))
+    for start in range(0, cars_count, LOAD_BATCH):
+        service.add_cars(generate_cars(start, min(LOAD_BATCH, cars_count - start), MODELS_COUNT))
+    rows = len(service.get_cars(CarStatus.available))
+    vins = [make_vin(number) for number in range(min(cars_count, 10_000))]
+    cars = service._get_store(FileForObject.car)
+
+    def read_values():
+        for ind in service._load_status_index()[CarStatus.available]:
+            cars.values(cars.read(ind))
+
+    cases = [
+        ('values_only', rows, read_values),
+        ('get_cars', rows, lambda: service.get_cars(CarStatus.available)),
+        ('get_cars_trusted', rows, lambda: trusted.get_cars(CarStatus.available)),
+        ('get_car_records', rows, lambda: trusted.get_car_records(CarStatus.available)),
+        ('get_car_info', len(vins), lambda: [service.get_car_info(vin) for vin in vins]),
+        ('get_car_info_trusted', len(vins), lambda: [trusted.get_car_info(vin) for vin in vins]),
+    ]
+    results = []
+    for name, count, func in cases:
+        elapsed = best_time(func, repeats)
+        results.append({
+            'cars': cars_count,
+            'read': name,
+            'rows': count,
+            'ns_per_row': elapsed / count if count else 0.0,
+        })
+    service.close()
+    trusted.close()
+    return results
+
+
+def main(argv: Union[list[str], None] = None) -> int:
+    """Функция разбирает аргументы командной строки, выполняет замеры
+    и записывает отчет в JSON.
+    """
+    parser = argparse.ArgumentParser(description='Стоимость строки при чтении')
+    parser.add_argument('--cars', type=int, default=100_000)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--output', default='row_cost.json')
+    args = parser.parse_args(argv)
+    with tempfile.TemporaryDirectory() as root_directory_path:
+        results = measure_row_cost(root_directory_path + '/', args.cars, args.repeats)
+    with open(args.output, 'w') as file_output:
+        json.dump({'commit': get_commit(), 'results': results}, file_output, indent=2)
+    for result in results:
+        print(f'{result["read"]:<22} {result["rows"]:>8} rows {result["ns_per_row"]:>10.0f} ns/row')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,369 @@
+"""Бенчмарки операций CarService на синтетических данных.
+
+Для каждого масштаба (количества автомобилей) создается новая БД
+во временном каталоге, в нее загружаются модели и автомобили, после чего
+по очереди замеряются операции CarService. Для каждой операции
+сохраняются количество операций в секунду, задержки p50 и p99, байты,
+прочитанные и записанные процессом (по /proc/self/io), и пиковый объем
+памяти процесса. Результаты пишутся в JSON, чтобы сравнивать их между
+коммитами (см. benchmarks/compare.py).
+
+Запуск из корня проекта (каталог src должен быть в PYTHONPATH):
+    python -m benchmarks.run_benchmarks --scale 1k 10k --output bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+from typing import Callable, Iterable, Union
+
+from benchmarks.generators import (
+    START_DATE, generate_cars, generate_models, make_car, make_sale, make_vin
+    )
+from bibip_car_service import CarService
+from models import CarStatus
+
+SCALES = {
+    '1k': 1_000,
+    '10k': 10_000,
+    '100k': 100_000,
+    '1M': 1_000_000,
+}
+
+# сколько автомобилей добавляется за один вызов add_cars при загрузке
+LOAD_BATCH = 10_000
+# сколько vin запрашивается за один вызов get_car_infos
+LOOKUP_BATCH = 100
+
+
+def parse_scale(scale: str) -> int:
+    """Функция принимает один параметр:
+    - scale: масштаб в виде '1k', '10k', '100k', '1M' или числа.
+    Функция возвращает количество автомобилей.
+    """
+    if scale in SCALES:
+        return SCALES[scale]
+    return int(scale)
+
+
+def read_io_counters() -> dict:
+    """Функция возвращает счетчики ввода-вывода процесса из /proc/self/io:
+    rchar и wchar - байты, переданные вызовами read и write (включая
+    кэш страниц), read_bytes и write_bytes - байты, дошедшие до диска.
+    Либо возвращает пустой словарь, если /proc/self/io недоступен.
+    """
+    try:
+        with open('/proc/self/io', 'r') as file_io:
+            return {
+                name: int(value)
+                for name, value in (line.split(':') for line in file_io)
+                }
+    except OSError:
+        return {}
+
+
+def get_peak_rss_kb() -> int:
+    """Функция возвращает пиковый объем памяти процесса в килобайтах."""
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # на macOS ru_maxrss измеряется в байтах, на Linux - в килобайтах
+    if sys.platform == 'darwin':
+        peak_rss //= 1024
+    return peak_rss
+
+
+def percentile(latencies: list[int], fraction: float) -> float:
+    """Функция принимает два параметра:
+    - latencies: отсортированные задержки в наносекундах;
+    - fraction: доля от 0 до 1.
+    Функция возвращает перцентиль задержки в миллисекундах
+    (метод ближайшего ранга).
+    """
+    if not latencies:
+        return 0.0
+    position = min(len(latencies) - 1, max(0, round(fraction * len(latencies)) - 1))
+    return latencies[position] / 1_000_000
+
+
+def measure(
+        scale: int,
+        operation: str,
+        func: Callable,
+        calls: Iterable[tuple]
+        ) -> dict:
+    """Функция принимает четыре параметра:
+    - scale: количество автомобилей в БД;
+    - operation: название операции;
+    - func: замеряемая функция;
+    - calls: аргументы для каждого вызова func.
+    Функция вызывает func для всех аргументов и возвращает результат
+    замера в виде словаря.
+    """
+    latencies = []
+    io_before = read_io_counters()
+    started = time.perf_counter_ns()
+    for args in calls:
+        call_started = time.perf_counter_ns()
+        func(*args)
+        latencies.append(time.perf_counter_ns() - call_started)
+    elapsed = time.perf_counter_ns() - started
+    io_after = read_io_counters()
+    latencies.sort()
+    result = {
+        'scale': scale,
+        'operation': operation,
+        'ops': len(latencies),
+        'seconds': elapsed / 1_000_000_000,
+        'ops_per_sec': len(latencies) * 1_000_000_000 / elapsed if elapsed else 0.0,
+        'p50_ms': percentile(latencies, 0.5),
+        'p99_ms': percentile(latencies, 0.99),
+        'peak_rss_kb': get_peak_rss_kb(),
+    }
+    for name in ('rchar', 'wchar', 'read_bytes', 'write_bytes'):
+        if name in io_before and name in io_after:
+            result[name] = io_after[name] - io_before[name]
+        else:
+            result[name] = None
+    return result
+
+
+def run_scale(
+        root_directory_path: str,
+        scale: int,
+        samples: int,
+        repeats: int,
+        models_count: Union[int, None] = None,
+        seed: int = 0,
+        **service_options
+        ) -> list[dict]:
+    """Функция принимает параметры:
+    - root_directory_path: пустой каталог для БД;
+    - scale: количество автомобилей, загружаемых перед замерами;
+    - samples: количество вызовов для точечных операций (add_car,
+      sell_car, get_car_info, update_vin, revert_sale), для get_car_infos -
+      количество vin, запрашиваемых по LOOKUP_BATCH за вызов;
+    - repeats: количество вызовов для get_cars, top_models_by_sales
+      и top_models за 30 дней
+      (для find_cars - вдвое больше: по дате и по цене);
+    - models_count: количество моделей (по умолчанию scale // 100);
+    - seed: зерно генерации данных;
+    - service_options: параметры CarService.
+    Функция возвращает результаты замеров всех операций.
+    """
+    if models_count is None:
+        models_count = max(10, min(10_000, scale // 100))
+    samples = min(samples, scale)
+    rnd = random.Random(seed)
+    service = CarService(root_directory_path, **service_options)
+    results = []
+    try:
+        results.append(measure(
+            scale, 'add_models', service.add_models,
+            [(generate_models(models_count),)]
+            ))
+
+        def load_batches():
+            for start in range(0, scale, LOAD_BATCH):
+                count = min(LOAD_BATCH, scale - start)
+                yield (generate_cars(start, count, models_count, seed),)
+
+        results.append(measure(scale, 'add_cars_bulk', service.add_cars, load_batches()))
+
+        # новые автомобили получают номера после загруженных
+        new_cars = [make_car(scale + number, models_count, seed) for number in range(samples)]
+        results.append(measure(
+            scale, 'add_car', service.add_car, [(car,) for car in new_cars]
+            ))
+
+        # продаются только доступные автомобили из загруженных
+        sold = []
+        for number in rnd.sample(range(scale), min(scale, samples * 2)):
+            if len(sold) == samples:
+                break
+            if make_car(number, models_count, seed).status == CarStatus.available:
+                sold.append(make_sale(number, make_vin(number, seed), seed))
+        results.append(measure(
+            scale, 'sell_car', service.sell_car, [(sale,) for sale in sold]
+            ))
+
+        results.append(measure(
+            scale, 'get_cars', service.get_cars,
+            [(CarStatus.available,)] * repeats
+            ))
+        lookup_vins = [make_vin(number, seed) for number in rnd.sample(range(scale), samples)]
+        results.append(measure(
+            scale, 'get_car_info', service.get_car_info,
+            [(vin,) for vin in lookup_vins]
+            ))
+        results.append(measure(
+            scale, 'get_car_infos', service.get_car_infos,
+            [
+                (lookup_vins[start:start + LOOKUP_BATCH],)
+                for start in range(0, len(lookup_vins), LOOKUP_BATCH)
+                ]
+            ))
+        # диапазоны дат и цен шириной около 1% данных
+        find_args = []
+        for _ in range(repeats):
+            date_from = START_DATE + timedelta(days=rnd.randint(0, 361))
+            price_min = Decimal(rnd.randint(1000, 4960))
+            find_args.append((CarStatus.available, date_from, date_from + timedelta(days=3)))
+            find_args.append((CarStatus.available, None, None, price_min, price_min + 40))
+        results.append(measure(scale, 'find_cars', service.find_cars, find_args))
+        results.append(measure(
+            scale, 'top_models_by_sales', service.top_models_by_sales, [()] * repeats
+            ))
+        # продажи приходятся на 600 дней от START_DATE, окно - 30 дней
+        results.append(measure(
+            scale, 'top_models_30d', service.top_models,
+            [(10, START_DATE + timedelta(days=300), START_DATE + timedelta(days=330))] * repeats
+            ))
+
+        # revert_sale идет до update_vin: номер продажи содержит vin
+        results.append(measure(
+            scale, 'revert_sale', service.revert_sale,
+            [(sale.sales_number,) for sale in sold]
+            ))
+
+        # новые vin берутся из номеров, которые еще не использовались
+        updated = rnd.sample(range(scale), samples)
+        results.append(measure(
+            scale, 'update_vin', service.update_vin,
+            [
+                (make_vin(number, seed), make_vin(scale + samples + position, seed))
+                for position, number in enumerate(updated)
+                ]
+            ))
+    finally:
+        service.close()
+    return results
+
+
+def get_commit() -> Union[str, None]:
+    """Функция возвращает хэш текущего коммита или None вне git."""
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(
+        scales: Iterable[int],
+        samples: int = 1000,
+        repeats: int = 5,
+        directory: Union[str, None] = None,
+        **service_options
+        ) -> dict:
+    """Функция принимает параметры:
+    - scales: количества автомобилей;
+    - samples, repeats: см. run_scale;
+    - directory: каталог для временных БД (по умолчанию системный);
+    - service_options: параметры CarService.
+    Функция выполняет замеры для всех масштабов и возвращает отчет
+    с описанием окружения и результатами.
+    """
+    results = []
+    for scale in scales:
+        with tempfile.TemporaryDirectory(dir=directory) as root_directory_path:
+            results.extend(run_scale(
+                root_directory_path + '/', scale, samples, repeats, **service_options
+                ))
+    return {
+        'commit': get_commit(),
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'options': {'samples': samples, 'repeats': repeats, **service_options},
+        'results': results,
+    }
+
+
+def format_report(report: dict) -> str:
+    """Функция возвращает результаты замеров в виде текстовой таблицы."""
+    lines = [
+        f'{"scale":>8} {"operation":<20} {"ops":>6} {"ops/s":>10} '
+        f'{"p50 ms":>9} {"p99 ms":>9} {"read KB":>10} {"write KB":>10} {"rss KB":>9}'
+        ]
+    for result in report['results']:
+        read_kb = (result['rchar'] or 0) // 1024
+        write_kb = (result['wchar'] or 0) // 1024
+        lines.append(
+            f'{result["scale"]:>8} {result["operation"]:<20} {result["ops"]:>6} '
+            f'{result["ops_per_sec"]:>10.1f} {result["p50_ms"]:>9.3f} '
+            f'{result["p99_ms"]:>9.3f} {read_kb:>10} {write_kb:>10} '
+            f'{result["peak_rss_kb"]:>9}'
+            )
+    return '\n'.join(lines)
+
+
+def main(argv: Union[list[str], None] = None) -> int:
+    """Функция разбирает аргументы командной строки, выполняет замеры
+    и записывает отчет в JSON.
+    """
+    parser = argparse.ArgumentParser(description='Бенчмарки операций CarService')
+    parser.add_argument(
+        '--scale', nargs='+', default=['1k'],
+        help='количества автомобилей: 1k, 10k, 100k, 1M или число'
+        )
+    parser.add_argument('--samples', type=int, default=1000,
+                        help='количество вызовов точечных операций')
+    parser.add_argument('--repeats', type=int, default=5,
+                        help='количество вызовов get_cars и top_models_by_sales')
+    parser.add_argument('--output', default='bench_output.json',
+                        help='файл для отчета в JSON')
+    parser.add_argument('--directory', default=None,
+                        help='каталог для временных БД')
+    parser.add_argument('--disk-index', action='store_true',
+                        help='искать по индексам на диске (index_in_memory=False)')
+    parser.add_argument('--lsm-index', action='store_true', help='индексы LSM')
+    parser.add_argument('--record-format', choices=['text', 'binary'], default='text')
+    parser.add_argument('--wal', action='store_true', help='журнал упреждающей записи')
+    parser.add_argument('--car-info-cache-size', type=int, default=0,
+                        help='размер кэша результатов get_car_info')
+    parser.add_argument('--scan-workers', type=int, default=0,
+                        help='количество процессов для параллельного обхода файлов')
+    parser.add_argument('--parallel-scan-threshold', type=int, default=None,
+                        help='с какого количества записей обходить файлы параллельно')
+    args = parser.parse_args(argv)
+
+    service_options = {'record_format': args.record_format}
+    if args.disk_index:
+        service_options['index_in_memory'] = False
+    if args.lsm_index:
+        service_options['lsm_index'] = True
+    if args.wal:
+        service_options['use_wal'] = True
+    if args.car_info_cache_size:
+        service_options['car_info_cache_size'] = args.car_info_cache_size
+    if args.scan_workers:
+        service_options['scan_workers'] = args.scan_workers
+    if args.parallel_scan_threshold is not None:
+        service_options['parallel_scan_threshold'] = args.parallel_scan_threshold
+    report = run_benchmarks(
+        [parse_scale(scale) for scale in args.scale],
+        samples=args.samples,
+        repeats=args.repeats,
+        directory=args.directory,
+        **service_options
+        )
+    with open(args.output, 'w') as file_output:
+        json.dump(report, file_output, indent=2)
+    print(format_report(report))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,220 @@
+"""Модуль с асинхронным фасадом над CarService.
+
+Все методы CarService работают с файлами блокирующими вызовами, поэтому
+AsyncCarService выполняет их в пуле потоков и не останавливает цикл
+событий. Одинаковые запросы на чтение, пришедшие, пока такой же запрос
+еще выполняется, получают результат этого запроса и не обращаются
+к диску повторно; каждый получает свою копию результата.
+"""
+import asyncio
+import functools
+from concurrent.futures import Executor, ThreadPoolExecutor
+from datetime import datetime
+from decimal import Decimal
+from typing import Iterable, Union
+
+from pydantic import BaseModel
+
+from bibip_car_service import CarService
+from models import Car, CarFullInfo, CarRecord, CarsPage, CarStatus, Model, ModelSaleStats, Sale
+
+
+def _copy_result(result):
+    """Функция возвращает копию результата чтения для одного ожидающего:
+    модели pydantic и списки копируются вместе с вложенными моделями
+    и списками, неизменяемые значения (CarRecord, None) не копируются.
+    """
+    if isinstance(result, list):
+        return [_copy_result(item) for item in result]
+    if isinstance(result, BaseModel):
+        return result.model_copy(update={
+            name: _copy_result(value)
+            for name, value in result
+            if isinstance(value, (list, BaseModel))
+            })
+    return result
+
+
+class AsyncCarService:
+    """Асинхронный фасад над CarService с теми же методами-корутинами."""
+
+    def __init__(
+            self,
+            service: CarService,
+            executor: Union[Executor, None] = None,
+            max_workers: int = 4
+            ) -> None:
+        self.service = service
+        # пул потоков создается фасадом, только если он не передан
+        self._own_executor = executor is None
+        self._executor = executor or ThreadPoolExecutor(
+            max_workers=max_workers,
+            thread_name_prefix='bibip'
+            )
+        # выполняющиеся запросы на чтение: ключ запроса -> future
+        self._in_flight: dict[tuple, asyncio.Future] = {}
+        # номер поколения данных, увеличивается с началом каждого изменения,
+        # чтобы запрос, пришедший после изменения, не получил старый результат
+        self._generation = 0
+
+    async def _run(self, func, *args):
+        """Функция принимает два параметра:
+        - self: экземпляр класса AsyncCarService;
+        - func, args: блокирующая функция и ее аргументы.
+        Функция выполняет func в пуле потоков и возвращает ее результат.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(func, *args))
+
+    async def _write(self, func, *args):
+        """Функция принимает два параметра:
+        - self: экземпляр класса AsyncCarService;
+        - func, args: изменяющий метод CarService и его аргументы.
+        Функция выполняет изменение в пуле потоков. Запросы на чтение,
+        пришедшие после начала изменения, выполняются заново.
+        """
+        self._generation += 1
+        try:
+            return await self._run(func, *args)
+        finally:
+            self._generation += 1
+
+    async def _read(self, key: tuple, func, *args):
+        """Функция принимает три параметра:
+        - self: экземпляр класса AsyncCarService;
+        - key: ключ запроса (название метода и аргументы);
+        - func, args: читающий метод CarService и его аргументы.
+        Функция возвращает копию результата func. Если такой же запрос
+        уже выполняется в текущем поколении данных, ждет его результат
+        вместо повторного чтения с диска.
+        """
+        key = (self._generation, *key)
+        future = self._in_flight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(self._run(func, *args))
+            self._in_flight[key] = future
+            future.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        # отмена одного из ожидающих не отменяет общий запрос, а изменения
+        # результата одним из ожидающих не видны остальным
+        return _copy_result(await asyncio.shield(future))
+
+    async def add_model(self, model: Model) -> Union[Model, None]:
+        """Асинхронный вариант CarService.add_model."""
+        return await self._write(self.service.add_model, model)
+
+    async def add_models(self, models: Iterable[Model]) -> list[Union[Model, None]]:
+        """Асинхронный вариант CarService.add_models."""
+        return await self._write(self.service.add_models, list(models))
+
+    async def add_car(self, car: Car) -> Union[Car, None]:
+        """Асинхронный вариант CarService.add_car."""
+        return await self._write(self.service.add_car, car)
+
+    async def add_cars(self, cars: Iterable[Car]) -> list[Union[Car, None]]:
+        """Асинхронный вариант CarService.add_cars."""
+        return await self._write(self.service.add_cars, list(cars))
+
+    async def sell_car(self, sale: Sale):
+        """Асинхронный вариант CarService.sell_car."""
+        return await self._write(self.service.sell_car, sale)
+
+    async def sell_cars(self, sales: Iterable[Sale]) -> list[Union[Sale, None]]:
+        """Асинхронный вариант CarService.sell_cars."""
+        return await self._write(self.service.sell_cars, list(sales))
+
+    async def update_vin(self, vin: str, new_vin: str):
+        """Асинхронный вариант CarService.update_vin."""
+        return await self._write(self.service.update_vin, vin, new_vin)
+
+    async def revert_sale(self, sales_number: str):
+        """Асинхронный вариант CarService.revert_sale."""
+        return await self._write(self.service.revert_sale, sales_number)
+
+    async def get_cars(self, status: CarStatus) -> list[Car]:
+        """Асинхронный вариант CarService.get_cars."""
+        return await self._read(
+            ('get_cars', status),
+            self.service.get_cars,
+            status
+            )
+
+    async def get_car_records(self, status: CarStatus) -> list[CarRecord]:
+        """Асинхронный вариант CarService.get_car_records."""
+        return await self._read(
+            ('get_car_records', status),
+            self.service.get_car_records,
+            status
+            )
+
+    async def get_cars_page(
+            self,
+            status: Union[CarStatus, None] = None,
+            cursor: Union[str, None] = None,
+            limit: int = 100
+            ) -> CarsPage:
+        """Асинхронный вариант CarService.get_cars_page."""
+        return await self._read(
+            ('get_cars_page', status, cursor, limit),
+            self.service.get_cars_page,
+            status,
+            cursor,
+            limit
+            )
+
+    async def get_car_info(self, vin: str) -> Union[CarFullInfo, None]:
+        """Асинхронный вариант CarService.get_car_info."""
+        return await self._read(('get_car_info', vin), self.service.get_car_info, vin)
+
+    async def get_car_infos(self, vins: Iterable[str]) -> dict[str, Union[CarFullInfo, None]]:
+        """Асинхронный вариант CarService.get_car_infos."""
+        return await self._run(self.service.get_car_infos, list(vins))
+
+    async def find_cars(
+            self,
+            status: Union[CarStatus, None] = None,
+            date_from: Union[datetime, None] = None,
+            date_to: Union[datetime, None] = None,
+            price_min: Union[Decimal, None] = None,
+            price_max: Union[Decimal, None] = None,
+            order_by: Union[str, None] = None,
+            limit: Union[int, None] = None
+            ) -> list[Car]:
+        """Асинхронный вариант CarService.find_cars."""
+        return await self._run(
+            self.service.find_cars,
+            status, date_from, date_to, price_min, price_max, order_by, limit
+            )
+
+    async def top_models_by_sales(self) -> list[ModelSaleStats]:
+        """Асинхронный вариант CarService.top_models_by_sales."""
+        return await self._read(
+            ('top_models_by_sales',),
+            self.service.top_models_by_sales
+            )
+
+    async def top_models(
+            self,
+            n: int = 3,
+            since: Union[datetime, None] = None,
+            until: Union[datetime, None] = None,
+            by: str = 'count'
+            ) -> list[ModelSaleStats]:
+        """Асинхронный вариант CarService.top_models."""
+        return await self._read(
+            ('top_models', n, since, until, by),
+            self.service.top_models,
+            n,
+            since,
+            until,
+            by
+            )
+
+    async def close(self):
+        """Функция принимает один параметр:
+        - self: экземпляр класса AsyncCarService.
+        Функция закрывает CarService и, если пул потоков создан
+        фасадом, останавливает его.
+        """
+        await self._run(self.service.close)
+        if self._own_executor:
+            self._executor.shutdown(wait=True)
@@ -1,14 +1,205 @@
 from models import Car, CarFullInfo, CarStatus, Model, ModelSaleStats, Sale, FileIndexForObject, FileForObject
+from models import CacheStats, CarRecord, CarsPage, OperationStats, construct
+from models import CAR_STATUS_BY_CODE, CAR_STATUS_CODES
 from operator import itemgetter
 from exeptions import ObjectIsNotExists, DuplicateValue
-from typing import Union
-from decimal import Decimal
+from typing import Callable, Iterable, Iterator, Type, Union
 from datetime import datetime
+from decimal import Decimal
+from pydantic import BaseModel
+from contextlib import contextmanager
+import bisect
+import functools
+import heapq
+import os
+import threading
+
+import columnar
+import disk_index
+from columnar import COLUMNAR_DIRECTORY, ColumnarSnapshot
+from instrumentation import ServiceStats, count_open, count_read, count_write, instrumented
+from lru_cache import MISSING, LruCache
+from lsm_index import LsmIndex
+from parallel_scan import (
+    PARALLEL_SCAN_MIN_RECORDS, ParallelScanner, car_status_codes, select_active_sales, select_cars
+    )
+from record_format import BINARY_VERSION, FORMAT_VERSIONS, check_price, get_codecs
+from read_snapshot import ReadSnapshot
+from record_store import RecordStore, RecordView
+from locks import LOCK_ORDER, LockManager
+from wal import WriteAheadLog, fsync_path
+
+
+# файлы, которые заменяются при уплотнении, и отметка о готовности новых файлов
+COMPACTED_FILES = (
+    FileForObject.sale,
+    FileIndexForObject.sale,
+    FileIndexForObject.sale_by_car,
+    FileIndexForObject.sale_date,
+    FileForObject.sale_free_slots,
+)
+COMPACTION_MARKER = '/compact.commit'
+# индексы с номерами строк в файле с продажами
+SALE_INDEXES = (
+    FileIndexForObject.sale,
+    FileIndexForObject.sale_by_car,
+    FileIndexForObject.sale_date,
+)
+
+# журнал упреждающей записи и размер журнала, после которого
+# выполняется контрольная точка
+WAL_FILE = '/wal.log'
+CHECKPOINT_BYTES = 16 * 1024 * 1024
+
+# файлы с записями фиксированного размера
+RECORD_FILES = (FileForObject.model, FileForObject.car, FileForObject.sale)
+
+# индексы автомобилей по диапазонам: тип индекса -> (номер поля
+# в записи об авто, функция, переводящая значение в строку ключа)
+RANGE_INDEXES = {
+    FileIndexForObject.car_date: (3, disk_index.encode_date),
+    FileIndexForObject.car_price: (2, disk_index.encode_price),
+}
+# порядок моделей в top_models: агрегат продаж модели -
+# [количество продаж, выручка, бренд, название модели]
+TOP_MODELS_ORDERS = {
+    'count': itemgetter(0, 1, 2),
+    'revenue': itemgetter(1, 0, 2),
+}
+
+
+def rank_models(
+        sales_stats: dict,
+        n: int,
+        by: str = 'count',
+        with_revenue: bool = True,
+        trusted: bool = False
+        ) -> list[ModelSaleStats]:
+    """Функция принимает пять параметров:
+    - sales_stats: агрегаты продаж по id модели;
+    - n: количество моделей;
+    - by: порядок моделей (ключ TOP_MODELS_ORDERS);
+    - with_revenue: заполнять ли выручку;
+    - trusted: строить ли модели без проверки полей (models.construct).
+    Функция возвращает n первых в порядке by моделей. Ее используют
+    CarService, снимки чтения и ShardedCarService.
+    """
+    top = sorted(
+        sales_stats.values(),
+        key=TOP_MODELS_ORDERS[by],
+        reverse=True)[0:n]
+    build = functools.partial(construct, ModelSaleStats) if trusted else ModelSaleStats
+    return [
+        build(
+            car_model_name=stats[3],
+            brand=stats[2],
+            sales_number=stats[0],
+            revenue=stats[1] if with_revenue else None
+            )
+        for stats in top
+        ]
+
+
+# поля, по которым find_cars упорядочивает результат
+RANGE_ORDERS = {
+    'date_start': FileIndexForObject.car_date,
+    'price': FileIndexForObject.car_price,
+}
+
+# если при пакетном поиске по индексу на диске запрошено не меньше
+# 1/BATCH_SCAN_RATIO его записей, индекс читается одним проходом,
+# иначе каждый идентификатор ищется бинарным поиском
+BATCH_SCAN_RATIO = 64
 
 
 class CarService:
-    def __init__(self, root_directory_path: str) -> None:
+    def __init__(
+            self,
+            root_directory_path: str,
+            index_in_memory: bool = True,
+            reuse_free_slots: bool = False,
+            use_wal: bool = False,
+            checkpoint_bytes: int = CHECKPOINT_BYTES,
+            record_format: str = 'text',
+            lsm_index: bool = False,
+            memtable_limit: int = 1024,
+            max_runs: int = 8,
+            operation_hook: Union[Callable, None] = None,
+            trusted_reads: bool = False,
+            model_cache_size: int = 1024,
+            car_info_cache_size: int = 0,
+            scan_workers: int = 0,
+            parallel_scan_threshold: int = PARALLEL_SCAN_MIN_RECORDS
+            ) -> None:
         self.root_directory_path = root_directory_path
+        # статистика вызовов операций (см. instrumentation.py)
+        self._stats = ServiceStats(operation_hook)
+        # формат, в котором создаются новые файлы с записями ('text'
+        # или 'binary'); существующие файлы читаются в своем формате
+        if record_format not in FORMAT_VERSIONS:
+            raise ValueError(f'Неизвестный формат записей {record_format!r}')
+        self.record_format = record_format
+        # True - индексы загружаются в память и ищутся в кэше,
+        # False - поиск идет по файлам индекса, как при lsm_index
+        self.index_in_memory = index_in_memory
+        # изменения индексов в любом режиме ведутся как LSM-деревья
+        # (см. lsm_index.py): вставки и удаления дописываются в таблицу
+        # в памяти и ее журнал, а основной файл индекса только заменяется
+        # целиком при слиянии. True - поиск тоже идет по LSM-дереву,
+        # а index_in_memory не используется
+        self.lsm_index = lsm_index or not index_in_memory
+        self.memtable_limit = memtable_limit
+        self.max_runs = max_runs
+        self._lsm_indexes: dict[FileIndexForObject, LsmIndex] = {}
+        # True - модели, возвращаемые при чтении, строятся из записей
+        # собственных файлов без проверки полей pydantic
+        self.trusted_reads = trusted_reads
+        # кэш моделей по id: модели не меняются после добавления,
+        # поэтому кэш не устаревает и при записи из других процессов
+        self._model_cache = LruCache(model_cache_size)
+        # кэш результатов get_car_info по vin: сбрасывается при изменениях,
+        # сделанных этим экземпляром, поэтому включать его (размер больше 0)
+        # можно, только если другие процессы не меняют БД
+        self._car_info_cache = LruCache(car_info_cache_size)
+        # пул процессов для обхода больших файлов с записями
+        # (см. parallel_scan.py); при scan_workers меньше 2 или если
+        # записей меньше parallel_scan_threshold, обход идет в этом процессе
+        self._scanner = ParallelScanner(scan_workers, parallel_scan_threshold)
+        # True - новые продажи записываются на место удаленных; места
+        # запоминаются только при этом режиме, остальные освобождает
+        # уплотнение (compact), а rebuild_indexes находит все
+        self.reuse_free_slots = reuse_free_slots
+        # кэш индексов: тип объекта -> (сигнатура файлов LSM-дерева,
+        # ключи, номера строк)
+        self._index_cache: dict[FileIndexForObject, tuple] = {}
+        # индексы, формат файлов которых уже проверен
+        self._checked_indexes: set[FileIndexForObject] = set()
+        # проверено ли, что индексы по дате и цене построены
+        self._range_indexes_checked = False
+        # проверено ли, что индекс продаж по дате построен
+        self._sales_date_index_checked = False
+        # отображенные в память файлы с записями
+        self._stores: dict[FileForObject, RecordStore] = {}
+        # блокировки чтения-записи по типам объектов между потоками
+        # и процессами, работающими с одним каталогом
+        self._locks = LockManager(root_directory_path)
+        with self._locks.locked(write=(FileForObject.sale,)):
+            self._finish_compaction()
+        # кэш агрегатов продаж: (сигнатура файла, id модели -> агрегат)
+        self._sales_stats_cache: Union[tuple, None] = None
+        # кэш индекса статусов: (сигнатура файла, статус -> номера строк)
+        self._status_index_cache: Union[tuple, None] = None
+        # операции из журнала применяются в порядке их номеров
+        self._apply_turn = threading.Condition()
+        self.checkpoint_bytes = checkpoint_bytes
+        self._wal: Union[WriteAheadLog, None] = None
+        wal_path = self.root_directory_path + WAL_FILE
+        # журнал открывает и восстанавливает только экземпляр с use_wal:
+        # он владеет журналом, пока не закрыт (см. wal.py)
+        if use_wal:
+            self._wal = WriteAheadLog(wal_path)
+            self._applied_lsn = self._wal.last_lsn()
+            self._recover()
 
     def _get_position_for_insert_id(
             self,
@@ -67,23 +258,174 @@ class CarService:
                 right = mid - 1
         raise ObjectIsNotExists
 
-    def _get_list_keys(self, all_lines: list, type_of_index: str) -> list:
-        """Функция принимает три параметра:
+    def _get_file_signature(self, path: str) -> Union[tuple, None]:
+        """Функция принимает два параметра:
+        - self: экземпляр класса CarService;
+        - path: полный путь до файла.
+        Функция возвращает сигнатуру файла (inode, размер, время изменения),
+        по которой можно понять, что файл изменил другой процесс.
+        Либо возвращает None, если файл не существует.
+        """
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+    def _get_index_signature(self, object: FileIndexForObject) -> tuple:
+        """Функция принимает два параметра:
+        - self: экземпляр класса CarService;
+        - object: тип объекта.
+        Функция возвращает сигнатуры основного файла индекса, журнала
+        его таблицы в памяти и списка его файлов (см. lsm_index.py).
+        """
+        path = self.root_directory_path + object
+        return tuple(
+            self._get_file_signature(path + suffix)
+            for suffix in ('', '.memtable', '.runs')
+            )
+
+    def _load_index(self, object: FileIndexForObject) -> tuple[list, list]:
+        """Функция принимает два параметра:
+        - self: экземпляр класса CarService;
+        - object: тип объекта, индекс которого нужно загрузить.
+        Функция возвращает отсортированный список идентификаторов
+        и список соответствующих им номеров строк.
+        Файлы индекса читаются только при первом обращении
+        или если их изменил другой процесс, иначе данные берутся из кэша.
+        Если файлов нет, возвращает пустые списки.
+        """
+        signature = self._get_index_signature(object)
+        cached = self._index_cache.get(object)
+        if cached is not None and cached[0] == signature:
+            return cached[1], cached[2]
+        # файлы индекса изменил другой процесс - возможно, он же
+        # уплотнил файл с записями
+        self._get_store(FileForObject.sale).reopen_if_replaced()
+        lsm = self._get_lsm_index(object)
+        if object == FileIndexForObject.sale_by_car and not lsm.exists():
+            return self._rebuild_sales_by_car_index()
+        all_id = []
+        line_numbers = []
+        for key, line_number in lsm.iter_after():
+            all_id.append(key)
+            line_numbers.append(line_number)
+        self._index_cache[object] = (signature, all_id, line_numbers)
+        return all_id, line_numbers
+
+    def _save_index(
+            self,
+            object: FileIndexForObject,
+            all_id: list,
+            line_numbers: list
+            ):
+        """Функция принимает четыре параметра:
+        - self: экземпляр класса CarService;
+        - object: тип объекта, индекс которого нужно сохранить;
+        - all_id: отсортированный список идентификаторов;
+        - line_numbers: номера строк, соответствующие идентификаторам.
+        Функция перезаписывает файл с индексами и обновляет кэш.
+        """
+        path = self.root_directory_path + object
+        # основной файл строится заново, не слитые записи не нужны
+        self._get_lsm_index(object).clear()
+        disk_index.write_entries(path, object, zip(all_id, line_numbers))
+        if not self.lsm_index:
+            self._index_cache[object] = (
+                self._get_index_signature(object),
+                all_id,
+                line_numbers
+                )
+
+    def _prepare_index_file(self, object: FileIndexForObject):
+        """Функция принимает два параметра:
+        - self: экземпляр класса CarService;
+        - object: тип объекта.
+        Функция один раз за время жизни экземпляра проверяет формат
+        файла с индексами и переписывает файл прежнего формата
+        'ключ;строка' в формат фиксированной ширины.
+        """
+        if object in self._checked_indexes:
+            return
+        path = self.root_directory_path + object
+        if (os.path.exists(path)
+                and not disk_index.is_fixed_width(path, object)):
+            disk_index.write_entries(
+                path,
+                object,
+                list(disk_index.read_entries(path, object))
+                )
+        self._checked_indexes.add(object)
+
+    def _get_lsm_index(self, object: FileIndexForObject) -> LsmIndex:
+        """Функция принимает два параметра:
         - self: экземпляр класса CarService;
-        - all_lines: список строк, в начале которых указан индентификатор;
-        - type_of_index: 'str' или 'int' в зависимости от типа индентификатора.
-        Функция из каждой строки списка all_lines извлекает идентификатор,
-        приводит его значение к указанному типу (type_of_index)
-        и возвращает список этих идентификаторов.
+        - object: тип объекта.
+        Функция возвращает индекс объектов этого типа в виде LSM-дерева,
+        один на все время жизни экземпляра.
+        """
+        lsm = self._lsm_indexes.get(object)
+        if lsm is None:
+            self._prepare_index_file(object)
+            lsm = LsmIndex(
+                self.root_directory_path + object,
+                object,
+                self.memtable_limit,
+                self.max_runs
+                )
+            self._lsm_indexes[object] = lsm
+        return lsm
+
+    @instrumented
+    def merge_indexes(self):
+        """Функция принимает один параметр:
+        - self: экземпляр класса CarService.
+        Функция сливает таблицы в памяти и файлы LSM-индексов
+        с основными файлами индексов.
+        """
+        with self._locks.locked(write=LOCK_ORDER):
+            for object in (FileIndexForObject.model, FileIndexForObject.car,
+                           *SALE_INDEXES, *RANGE_INDEXES):
+                self._get_lsm_index(object).merge()
+
+    def _iter_active_sales(self) -> Iterator[tuple]:
+        """Функция принимает один параметр:
+        - self: экземпляр класса CarService.
+        Функция в порядке расположения в файле с продажами возвращает
+        для неудаленных продаж тройки (номер строки с нуля, vin
+        автомобиля, стоимость). Большой файл разбирается в пуле процессов.
+        Вызывающий код держит блокировку продаж на время всего обхода.
+        """
+        sales = self._get_store(FileForObject.sale)
+        if self._scanner.should_scan(len(sales)):
+            for chunk in self._scanner.scan(sales, FileForObject.sale, select_active_sales):
+                yield from chunk
+            return
+        for ind, record in enumerate(sales.iter_records()):
+            sale_info = sales.split(record)
+            if sale_info[4] == b'0':
+                yield ind, sale_info[1].decode(), Decimal(sale_info[3].decode())
+
+    def _rebuild_sales_by_car_index(self) -> tuple[list, list]:
+        """Функция принимает один параметр:
+        - self: экземпляр класса CarService.
+        Функция заново строит индекс продаж по vin автомобиля
+        по файлу с продажами: для каждого авто запоминается
+        последняя неудаленная продажа.
+        Возвращает отсортированный список vin и номера строк продаж.
+        Если файла с продажами нет, возвращает пустые списки.
         """
-        all_indexes = []
-        for line in all_lines:
-            if type_of_index == 'int':
-                all_indexes.append(int(line.split(';')[0]))
-            if type_of_index == 'str':
-                all_indexes.append(line.split(';')[0])
-        return all_indexes
+        if not os.path.exists(self.root_directory_path + FileForObject.sale):
+            return [], []
+        active_sales = {}
+        for ind, vin, _ in self._iter_active_sales():
+            active_sales[vin] = ind + 1
+        all_vin = sorted(active_sales)
+        line_numbers = [active_sales[vin] for vin in all_vin]
+        self._save_index(FileIndexForObject.sale_by_car, all_vin, line_numbers)
+        return all_vin, line_numbers
 
+    @instrumented
     def _get_line_number_by_identifier(
             self,
             identifier: Union[int, str],
@@ -97,20 +439,205 @@ class CarService:
         об объекте с указанным идентификатором в соответствующем файле.
         Либо возвращает None, если файл или объект не найден.
         """
+        if self.lsm_index:
+            if object in SALE_INDEXES:
+                self._get_store(FileForObject.sale).reopen_if_replaced()
+            lsm = self._get_lsm_index(object)
+            if object == FileIndexForObject.sale_by_car and not lsm.exists():
+                self._rebuild_sales_by_car_index()
+            line_number = lsm.get(identifier)
+            return None if line_number is None else line_number - 1
+        all_id, line_numbers = self._load_index(object)
         try:
-            with open(self.root_directory_path + object, 'r') as file_index:
-                all_lines = file_index.readlines()
-                if isinstance(identifier, str):
-                    all_id = self._get_list_keys(all_lines, 'str')
-                if isinstance(identifier, int):
-                    all_id = self._get_list_keys(all_lines, 'int')
-                line_number = self._find_element_in_sorted_list(
-                    all_id,
-                    identifier
-                    )
-                return int(all_lines[line_number].split(';')[1]) - 1
-        except (ObjectIsNotExists, FileNotFoundError):
+            position = self._find_element_in_sorted_list(all_id, identifier)
+        except ObjectIsNotExists:
             return None
+        return line_numbers[position] - 1
+
+    @instrumented
+    def _get_line_numbers_by_identifiers(
+            self,
+            identifiers: Iterable[Union[int, str]],
+            object: FileIndexForObject
+            ) -> dict:
+        """Функция принимает три параметра:
+        - self: экземпляр класса CarService;
+        - identifiers: идентификаторы объектов;
+        - object: тип объекта для поиска в файле с индексами.
+        Функция сортирует идентификаторы и находит их одним проходом
+        слиянием с индексом: в памяти - сдвигая бинарный поиск вперед,
+        на диске - читая файлы LSM-дерева подряд, если запрошена заметная
+        доля записей. Иначе идентификаторы ищутся по одному.
+        Возвращает словарь идентификатор -> номер строки (с нуля)
+        для найденных объектов.
+        """
+        keys = sorted(set(identifiers))
+        result = {}
+        if not keys:
+            return result
+        if not self.lsm_index:
+            all_id, line_numbers = self._load_index(object)
+            position = 0
+            for key in keys:
+                position = bisect.bisect_left(all_id, key, position)
+                if position == len(all_id):
+                    break
+                if all_id[position] == key:
+                    result[key] = line_numbers[position] - 1
+            return result
+        lsm = self._get_lsm_index(object)
+        if lsm.exists() and len(keys) * BATCH_SCAN_RATIO >= lsm.entries_count():
+            if object in SALE_INDEXES:
+                self._get_store(FileForObject.sale).reopen_if_replaced()
+            position = 0
+            for key, line_number in lsm.iter_after():
+                while keys[position] < key:
+                    position += 1
+                    if position == len(keys):
+                        return result
+                if keys[position] == key:
+                    result[key] = line_number - 1
+            return result
+        for key in keys:
+            ind = self._get_line_number_by_identifier(key, object)
+            if ind is not None:
+                result[key] = ind
+        return result
+
+    def _get_store(self, object: FileForObject) -> RecordStore:
+        """Функция принимает два параметра:
+        - self: экземпляр класса CarService;
+        - object: тип объекта.
+        Функция возвращает отображенный в память файл с записями
+        об объектах этого типа, один на все время жизни экземпляра.
+        """
+        store = self._stores.get(object)
+        if store is None:
+            store = RecordStore(
+                self.root_directory_path + object,
+                codecs=get_codecs(object),
+                new_version=FORMAT_VERSIONS[self.record_format]
+                )
+            self._stores[object] = store
+        return store
+
+    def _is_binary(self, object: FileForObject) -> bool:
+        """Функция принимает два параметра:
+        - self: экземпляр класса CarService;
+        - object: тип объекта.
+        Функция проверяет, что записи об объектах этого типа дописываются
+        в двоичном формате. Только он не хранит цены точнее сотых,
+        поэтому проверять их нужно до изменения файлов.
+        """
+        return self._get_store(object).format_version() == BINARY_VERSION
+
+    def _read_record(self, object: FileForObject, ind: int) -> list[str]:
+        """Функция принимает три параметра:
+        - self: экземпляр класса CarService;
+        - object: тип объекта;
+        - ind: номер строки (с нуля) в файле с записями.
+        Функция возвращает поля записи в виде строк.
+        Либо вызывает исключение FileNotFoundError, если файл не найден.
+        """
+        store = self._get_store(object)
+        return store.decode(store.read(ind))
+
+    def _read_values(self, object: FileForObject, ind: int) -> list:
+        """Функция принимает три параметра:
+        - self: экземпляр класса CarService;
+        - object: тип объекта;
+        - ind: номер строки (с нуля) в файле с записями.
+        Функция возвращает поля записи в виде объектов Python.
+        Либо вызывает исключение FileNotFoundError, если файл не найден.
+        """
+        store = self._get_store(object)
+        return store.values(store.read(ind))
+
+    def _write_record(self, object: FileForObject, ind: int, fields: list):
+        """Функция принимает четыре параметра:
+        - self: экземпляр класса CarService;
+        - object: тип объекта;
+        - ind: номер строки (с нуля) в файле с записями;
+        - fields: новые значения полей записи.
+        Функция записывает запись на место прежней прямо в отображение файла.
+        """
+        store = self._get_store(object)
+        store.write(ind, store.encode(fields))
+
+    def _append_records(self, object: FileForObject, records: list) -> int:
+        """Функция принимает три параметра:
+        - self: экземпляр класса CarService;
+        - object: тип объекта;
+        - records: список записей, каждая в виде списка значений полей.
+        Функция одной записью дописывает записи в конец файла
+        и возвращает номер строки (с единицы) первой из них.
+        Либо вызывает исключение ValueError, если запись не помещается
+        в отведенные ей байты (тогда файл не меняется).
+        """
+        store = self._get_store(object)
+        data = b''.join(store.encode(fields) for fields in records)
+        return store.append(data) + 1
+
+    def close(self):
+        """Функция принимает один параметр:
+        - self: экземпляр класса CarService.
+        Функция выполняет контрольную точку, если включен журнал,
+        освобождает отображения файлов с записями и останавливает
+        пул процессов для обхода файлов.
+        """
+        if self._wal is not None:
+            self.checkpoint()
+            self._wal.close()
+            self._wal = None
+        self._scanner.close()
+        for store in self._stores.values():
+            store.close()
+        self._stores.clear()
+
+    def stats(self) -> dict[str, OperationStats]:
+        """Функция принимает один параметр:
+        - self: экземпляр класса CarService.
+        Функция возвращает снимок статистики по названиям методов:
+        количество вызовов и ошибок, суммарное и наибольшее время,
+        гистограмму времени (в корзине i - вызовы короче 2 ** i мкс),
+        открытия файлов, прочитанные и записанные байты и просмотренные
+        записи. Время и счетчики вложенных вызовов входят во внешние.
+        """
+        return self._stats.snapshot()
+
+    def reset_stats(self):
+        """Функция обнуляет статистику вызовов."""
+        self._stats.reset()
+
+    def set_operation_hook(self, hook: Union[Callable, None]):
+        """Функция принимает два параметра:
+        - self: экземпляр класса CarService;
+        - hook: обработчик hook(operation, call), который должен вызвать
+          call() и вернуть его результат (например,
+          instrumentation.ProfileHook), или None, чтобы отключить его.
+        Функция подключает обработчик ко всем внешним вызовам методов.
+        """
+        self._stats.hook = hook
+
+    def _iter_index(
+            self,
+            object: FileIndexForObject,
+            after: Union[int, str, None] = None
+            ) -> Iterator[tuple]:
+        """Функция принимает три параметра:
+        - self: экземпляр класса CarService;
+        - object: тип объекта;
+        - after: идентификатор, после которого начинать (None - с начала).
+        Функция по порядку возвращает пары (идентификатор, номер строки
+        с единицы) для всех идентификаторов больше after.
+        """
+        if self.lsm_index:
+            yield from self._get_lsm_index(object).iter_after(after)
+            return
+        all_id, line_numbers = self._load_index(object)
+        start = 0 if after is None else bisect.bisect_right(all_id, after)
+        for position in range(start, len(all_id)):
+            yield all_id[position], line_numbers[position]
 
     def _create_string(self, list_info: list, min_length=0) -> str:
         """Функция принимает три параметра:
@@ -125,6 +652,7 @@ class CarService:
         else:
             return ';'.join(list_info).ljust(min_length-1) + '\n'
 
+    @instrumented
     def _delete_index(self,
                       object: FileIndexForObject,
                       identifier: Union[int, str]
@@ -133,321 +661,1391 @@ class CarService:
         - self: экземпляр класса CarService;
         - object: тип объекта, индекс которого нужно удалить;
         - identifier: идентификатор объекта, индекс которого нужно удалить.
-        Функция удаляет запись с индексом по указанному идентификатору.
-        Либо вызывает исключение FileNotFoundError, если файл не найден.
+        Функция дописывает в LSM-дерево индекса надгробие для указанного
+        идентификатора и удаляет его из индекса в памяти.
         Либо вызывает исключение ObjectIsNotExists,
         если объект с таким идентификатором не существует.
         """
-        # записали все индексы в список и удалили нужный
-        try:
-            with open(self.root_directory_path + object, 'r') as file_index:
-                all_lines = file_index.readlines()
-                if isinstance(identifier, int):
-                    all_index = self._get_list_keys(all_lines, 'int')
-                if isinstance(identifier, str):
-                    all_index = self._get_list_keys(all_lines, 'str')
-                index_for_delete = self._find_element_in_sorted_list(
-                    all_index,
-                    identifier
-                    )
-                del all_lines[index_for_delete]
-        except FileNotFoundError:
-            raise FileNotFoundError
-        except ObjectIsNotExists:
-            raise ObjectIsNotExists
-
-        # собрали заново файл с индексами с учетом удаленного
-        try:
-            with open(self.root_directory_path + object, 'w+') as file_index:
-                for line in all_lines:
-                    file_index.write(line)
-        except FileNotFoundError:
-            raise FileNotFoundError
+        lsm = self._get_lsm_index(object)
+        if self.lsm_index:
+            if lsm.get(identifier) is None:
+                raise ObjectIsNotExists
+            lsm.delete(identifier)
+            return
+        all_id, line_numbers = self._load_index(object)
+        index_for_delete = self._find_element_in_sorted_list(
+            all_id,
+            identifier
+            )
+        lsm.delete(identifier)
+        del all_id[index_for_delete]
+        del line_numbers[index_for_delete]
+        self._index_cache[object] = (
+            self._get_index_signature(object),
+            all_id,
+            line_numbers
+            )
 
+    @instrumented
     def _insert_new_index(
             self,
             object: FileIndexForObject,
             identifier: Union[int, str],
-            new_string: str
+            line_number: int
             ):
         """Функция принимает четыре параметра:
         - self: экземпляр класса CarService;
         - object: тип объекта, индекс которого нужно вставить;
         - identifier: идентификатор объекта, индекс которого нужно вставить;
-        - new_string: строка, которую нужно вставить.
-        Функция вставляет запись с индексом по указанному идентификатору.
-        Либо вызывает исключение FileNotFoundError, если файл не найден.
+        - line_number: номер строки (с единицы) с информацией об объекте.
+        Функция дописывает запись с индексом по указанному идентификатору
+        в LSM-дерево индекса и вставляет ее в индекс в памяти.
         Либо вызывает исключение DuplicateValue,
         если объект с таким идентификатором уже существует.
         """
-        # вставляем индекс указанного идентификатора
-        try:
-            with open(self.root_directory_path + object, 'a+') as file_index:
-                file_index.seek(0)
-                all_lines = file_index.readlines()
-                if isinstance(identifier, int):
-                    all_index = self._get_list_keys(all_lines, 'int')
-                if isinstance(identifier, str):
-                    all_index = self._get_list_keys(all_lines, 'str')
-                position = self._get_position_for_insert_id(
-                    all_index,
-                    identifier
+        lsm = self._get_lsm_index(object)
+        if self.lsm_index:
+            if lsm.get(identifier) is not None:
+                raise DuplicateValue
+            lsm.put(identifier, line_number)
+            return
+        all_id, line_numbers = self._load_index(object)
+        position = self._get_position_for_insert_id(all_id, identifier)
+        lsm.put(identifier, line_number)
+        all_id.insert(position, identifier)
+        line_numbers.insert(position, line_number)
+        self._index_cache[object] = (
+            self._get_index_signature(object),
+            all_id,
+            line_numbers
+            )
+
+    @instrumented
+    def _insert_many_indexes(
+            self,
+            object: FileIndexForObject,
+            new_indexes: list[tuple],
+            replace: bool = False
+            ):
+        """Функция принимает четыре параметра:
+        - self: экземпляр класса CarService;
+        - object: тип объекта, индексы которого нужно вставить;
+        - new_indexes: список пар (идентификатор, номер строки с единицы);
+        - replace: если True, существующие индексы с теми же
+          идентификаторами заменяются новыми, иначе идентификаторов
+          из new_indexes еще не должно быть в индексе.
+        Функция одной записью дописывает новые индексы в LSM-дерево
+        индекса и добавляет их в индекс в памяти: по одному, если их
+        немного, иначе за один проход слиянием с уже существующими.
+        """
+        if not new_indexes:
+            return
+        lsm = self._get_lsm_index(object)
+        if self.lsm_index:
+            # более новая запись о том же идентификаторе заменяет прежнюю
+            lsm.put_many(new_indexes)
+            return
+        all_id, line_numbers = self._load_index(object)
+        lsm.put_many(new_indexes)
+        replaced = dict(new_indexes)
+        new_indexes = sorted(replaced.items())
+        if len(new_indexes) * BATCH_SCAN_RATIO < len(all_id):
+            for key, line_number in new_indexes:
+                position = bisect.bisect_left(all_id, key)
+                if position < len(all_id) and all_id[position] == key:
+                    line_numbers[position] = line_number
+                else:
+                    all_id.insert(position, key)
+                    line_numbers.insert(position, line_number)
+        else:
+            existing = zip(all_id, line_numbers)
+            if replace:
+                existing = (
+                    (key, line) for key, line in existing if key not in replaced
                     )
-                all_lines.insert(position, new_string)
-        except FileNotFoundError:
-            raise FileNotFoundError
-        except DuplicateValue:
-            raise DuplicateValue
+            merged = list(heapq.merge(existing, new_indexes))
+            all_id[:] = [key for key, _ in merged]
+            line_numbers[:] = [line for _, line in merged]
+        self._index_cache[object] = (
+            self._get_index_signature(object),
+            all_id,
+            line_numbers
+            )
 
-        # записываем изменения в файл
-        try:
-            with open(self.root_directory_path + object, 'w+') as file_index:
-                file_index.writelines(all_lines)
-        except FileNotFoundError:
-            raise FileNotFoundError
+    def _range_index_exists(self, object: FileIndexForObject) -> bool:
+        """Функция проверяет, что индекс object уже построен."""
+        return self._get_lsm_index(object).exists()
+
+    def _ensure_range_indexes(self):
+        """Функция принимает один параметр:
+        - self: экземпляр класса CarService.
+        Функция один раз за время жизни экземпляра проверяет, что индексы
+        по дате и цене построены, и строит их по файлу с автомобилями,
+        если БД создана до их появления.
+        """
+        if self._range_indexes_checked:
+            return
+        if (len(self._get_store(FileForObject.car)) > 0
+                and not all(self._range_index_exists(object) for object in RANGE_INDEXES)):
+            self._rebuild_range_indexes()
+        self._range_indexes_checked = True
+
+    def _rebuild_range_indexes(self):
+        """Функция принимает один параметр:
+        - self: экземпляр класса CarService.
+        Функция заново строит индексы по дате и цене по файлу с автомобилями.
+        """
+        cars = self._get_store(FileForObject.car)
+        entries = {object: [] for object in RANGE_INDEXES}
+        for line_number, record in enumerate(cars.iter_records(), start=1):
+            car_info = cars.values(record)
+            for object, (field, encode) in RANGE_INDEXES.items():
+                entries[object].append(
+                    (disk_index.range_key(encode(car_info[field]), line_number), line_number)
+                    )
+        for object, object_entries in entries.items():
+            object_entries.sort()
+            self._save_index(
+                object,
+                [key for key, _ in object_entries],
+                [line_number for _, line_number in object_entries]
+                )
+        self._range_indexes_checked = True
+
+    def _ensure_sales_date_index(self):
+        """Функция принимает один параметр:
+        - self: экземпляр класса CarService.
+        Функция один раз за время жизни экземпляра проверяет, что индекс
+        продаж по дате построен, и строит его по файлу с продажами,
+        если БД создана до его появления.
+        """
+        if self._sales_date_index_checked:
+            return
+        if (len(self._get_store(FileForObject.sale)) > 0
+                and not self._range_index_exists(FileIndexForObject.sale_date)):
+            self._rebuild_sales_date_index()
+        self._sales_date_index_checked = True
+
+    def _rebuild_sales_date_index(self):
+        """Функция принимает один параметр:
+        - self: экземпляр класса CarService.
+        Функция заново строит индекс неудаленных продаж по дате
+        по файлу с продажами.
+        """
+        sales = self._get_store(FileForObject.sale)
+        entries = []
+        for line_number, record in enumerate(sales.iter_records(), start=1):
+            sale_info = sales.values(record)
+            if sale_info[4] == 0:
+                entries.append((disk_index.sale_date_key(sale_info[2], sale_info[0]), line_number))
+        entries.sort()
+        self._save_index(
+            FileIndexForObject.sale_date,
+            [key for key, _ in entries],
+            [line_number for _, line_number in entries]
+            )
+        self._sales_date_index_checked = True
+
+    @instrumented
+    def _change_status_cars(self, vins: list[str], status: CarStatus):
+        """Функция принимает три параметра:
+        - self: экземпляр класса CarService;
+        - vins: идентификаторы автомобилей;
+        - status: статус, который необходимо установить.
+        Функция меняет статус всем найденным автомобилям прямо
+        в отображении файла, обходя записи в порядке их расположения.
+        Автомобили, которых нет в индексе, пропускаются.
+        Возвращает словарь vin -> информация об авто после изменения.
+        Либо вызывает исключение FileNotFoundError, если файл не найден.
+        """
+        self._invalidate_car_infos(vins)
+        line_numbers = []
+        for vin in vins:
+            ind = self._get_line_number_by_identifier(vin, FileIndexForObject.car)
+            if ind is not None:
+                line_numbers.append(ind)
+        changed_cars = {}
+        if not line_numbers:
+            return changed_cars
+        for ind in sorted(set(line_numbers)):
+            car_info = self._read_record(FileForObject.car, ind)
+            car_info[4] = status
+            self._write_record(FileForObject.car, ind, car_info)
+            changed_cars[car_info[0]] = car_info
+        self._write_status_codes(
+            [(ind, status) for ind in sorted(set(line_numbers))]
+            )
+        return changed_cars
 
+    @instrumented
     def _change_status_car(self, vin: str, status: CarStatus):
         """Функция принимает три параметра:
         - self: экземпляр класса CarService;
         - vin: идентификатор автомобиля;
         - status: статус, который необходимо установить.
-        Функция вставляет запись с индексом по указанному идентификатору.
+        Функция меняет статус автомобиля в файле с автомобилями
+        и возвращает информацию об авто после изменения.
+        Либо возвращает None, если автомобиль не найден.
         Либо вызывает исключение FileNotFoundError, если файл не найден.
-        Либо вызывает исключение ObjectIsNotExists,
-        если объект с таким идентификатором не существует.
         """
+        return self._change_status_cars([vin], status).get(vin)
+
+    def _get_model(self, model_id: int) -> Union[Model, None]:
+        """Функция принимает два параметра:
+        - self: экземпляр класса CarService;
+        - model_id: идентификатор модели.
+        Функция возвращает модель из кэша моделей или из файла
+        'models.txt' (и добавляет ее в кэш).
+        Либо возвращает None, если файл или модель не найдены.
+        """
+        model = self._model_cache.get(model_id)
+        if model is not MISSING:
+            return model
+        ind = self._get_line_number_by_identifier(
+            model_id,
+            FileIndexForObject.model
+            )
+        if ind is None:
+            return None
         try:
-            ind = self._get_line_number_by_identifier(vin, FileIndexForObject.car)
-            if ind is None:
-                return None
-            with open(self.root_directory_path + FileForObject.car, 'r+') as file_cars:
-                file_cars.seek(ind * 500)
-                car_info = file_cars.read(500).strip().split(';')
-                car_info[4] = status
-                new_string = self._create_string(car_info, 500)
-                file_cars.seek(ind * 500)
-                file_cars.write(new_string)
+            model_info = self._read_values(FileForObject.model, ind)
         except FileNotFoundError:
-            raise FileNotFoundError
-        except ObjectIsNotExists:
-            raise ObjectIsNotExists
+            return None
+        model = self._build(Model, id=model_info[0], name=model_info[1], brand=model_info[2])
+        self._model_cache.put(model_id, model)
+        return model
 
-    # Задание 1. Сохранение автомобилей и моделей
-    def add_model(self, model: Model) -> Union[Model, None]:
-        """Функция принимает два параметра:
+    def _cache_car_info(self, vin: str, car_info: CarFullInfo) -> CarFullInfo:
+        """Функция принимает три параметра:
         - self: экземпляр класса CarService;
-        - model: экземпляр класса Model.
-        Функция вставляет запись о модели и сохраняет соответствующий индекс.
-        Либо возвращает None, если такая модель уже существует в БД.
+        - vin: идентификатор автомобиля;
+        - car_info: информация об авто.
+        Функция добавляет информацию об авто в кэш и возвращает
+        ее копию, чтобы изменения вызывающего не попали в кэш.
         """
-        # проверяем, что такой модели еще нет в БД
-        if self._get_line_number_by_identifier(model.id, FileIndexForObject.model) is None:
-            # вставка модели
-            with open(self.root_directory_path + FileForObject.model, 'a') as file_models:
-                model_string = (f'{model.id};{model.name};'
-                                f'{model.brand}').ljust(499) + '\n'
-                file_models.write(model_string)
-                line_number = file_models.tell() // 500
-                # вставка индекса
-                new_string = (f'{model.id};{line_number}\n')
-                self._insert_new_index(
-                    FileIndexForObject.model,
-                    model.id,
-                    new_string)
-                return model
-        return None
+        if self._car_info_cache.maxsize == 0:
+            return car_info
+        self._car_info_cache.put(vin, car_info)
+        return car_info.model_copy()
 
-    # Задание 1. Сохранение автомобилей и моделей
-    def add_car(self, car: Car) -> Union[Car, None]:
+    def _invalidate_car_infos(self, vins: Iterable[str]):
+        """Функция удаляет из кэша информацию об автомобилях vins."""
+        for vin in vins:
+            self._car_info_cache.pop(vin)
+
+    def cache_stats(self) -> dict[str, CacheStats]:
+        """Функция принимает один параметр:
+        - self: экземпляр класса CarService.
+        Функция возвращает счетчики попаданий, промахов и вытеснений
+        и размеры кэша моделей ('models') и кэша информации
+        об автомобилях ('car_infos').
+        """
+        return {
+            'models': self._model_cache.stats(),
+            'car_infos': self._car_info_cache.stats(),
+        }
+
+    def clear_caches(self):
+        """Функция очищает кэш моделей и кэш информации об автомобилях."""
+        self._model_cache.clear()
+        self._car_info_cache.clear()
+
+    def _load_sales_stats(self) -> dict:
+        """Функция принимает один параметр:
+        - self: экземпляр класса CarService.
+        Функция возвращает агрегаты продаж в виде словаря
+        id модели -> [количество продаж, выручка, бренд, название модели].
+        Файл с агрегатами читается только при первом обращении
+        или если его изменил другой процесс.
+        Если файла с агрегатами нет, он строится заново по продажам.
+        """
+        path = self.root_directory_path + FileForObject.sale_stats
+        signature = self._get_file_signature(path)
+        if (self._sales_stats_cache is not None
+                and self._sales_stats_cache[0] == signature):
+            return self._sales_stats_cache[1]
+        if signature is None:
+            return self._rebuild_sales_aggregates()
+        sales_stats = {}
+        with open(path, 'r') as file_stats:
+            count_open()
+            for line in file_stats:
+                count_read(len(line), 1)
+                stats_info = line.rstrip('\n').split(';')
+                sales_stats[int(stats_info[0])] = [
+                    int(stats_info[3]),
+                    Decimal(stats_info[4]),
+                    stats_info[2],
+                    stats_info[1]
+                    ]
+        self._sales_stats_cache = (signature, sales_stats)
+        return sales_stats
+
+    def _save_sales_stats(self, sales_stats: dict):
         """Функция принимает два параметра:
         - self: экземпляр класса CarService;
-        - car: экземпляр класса Car.
-        Функция вставляет запись об авто и сохраняет соответствующий индекс.
-        Либо возвращает None, если такой авто уже существует в БД.
+        - sales_stats: агрегаты продаж по id модели.
+        Функция перезаписывает файл с агрегатами продаж
+        (модели без продаж не сохраняются) и обновляет кэш.
         """
-        # проверяем, что такого автомобиля еще нет в БД
-        if self._get_line_number_by_identifier(car.vin, FileIndexForObject.car) is None:
-            # вставка авто
-            with open(self.root_directory_path + FileForObject.car, 'a') as file_cars:
-                car_string = (f'{car.vin};{car.model};'
-                              f'{car.price};{car.date_start};'
-                              f'{car.status}').ljust(499) + '\n'
-                file_cars.write(car_string)
-                line_number = file_cars.tell() // 500
-                # вставка индекса
-                new_string = (f'{car.vin};{line_number}\n')
-                self._insert_new_index(
-                    FileIndexForObject.car,
-                    car.vin,
-                    new_string
-                    )
-                return car
-        return None
+        sales_stats = {
+            model_id: stats for model_id, stats in sales_stats.items()
+            if stats[0] > 0
+            }
+        path = self.root_directory_path + FileForObject.sale_stats
+        tmp_path = disk_index.get_tmp_path(path)
+        with open(tmp_path, 'w+') as file_stats:
+            count_open()
+            for model_id in sorted(sales_stats):
+                count, revenue, brand, name = sales_stats[model_id]
+                count_write(file_stats.write(self._create_string(
+                    [str(model_id), name, brand, str(count), str(revenue)]
+                    )))
+        os.replace(tmp_path, path)
+        self._sales_stats_cache = (self._get_file_signature(path), sales_stats)
 
-    # Задание 2. Сохранение продаж
-    def sell_car(self, sale: Sale):
+    def _update_sales_stats(self, changes: list[tuple]):
         """Функция принимает два параметра:
         - self: экземпляр класса CarService;
-        - sale: экземпляр класса Sale.
-        Функция вставляет запись о продаже и сохраняет соответствующий индекс.
-        Либо возвращает None, если такая продажа уже существует в БД.
+        - changes: список изменений (id модели, изменение количества
+          продаж, изменение выручки).
+        Функция применяет изменения к агрегатам продаж
+        и один раз записывает файл с агрегатами.
         """
-        # проверяем, что такой продажи еще нет в БД
-        if self._get_line_number_by_identifier(sale.sales_number, FileIndexForObject.sale) is None:
-            # вставка продажи
-            with open(self.root_directory_path + FileForObject.sale, 'a') as file_sales:
-                sale_string = (f'{sale.sales_number};{sale.car_vin};'
-                                f'{sale.sales_date};'
-                                f'{sale.cost};0').ljust(499) + '\n'
-                file_sales.write(sale_string)
-                line_number = file_sales.tell() // 500
-                # вставка индекса
-                new_string = (f'{sale.sales_number};{line_number}\n')
-                self._insert_new_index(
-                    FileIndexForObject.sale,
-                    sale.sales_number,
-                    new_string
-                    )
-                # меняем статус авто на sold
-                self._change_status_car(sale.car_vin, CarStatus.sold)
-        return None
+        if not changes:
+            return
+        sales_stats = {
+            model_id: list(stats)
+            for model_id, stats in self._load_sales_stats().items()
+            }
+        self._apply_sales_stats_changes(sales_stats, changes)
+        self._save_sales_stats(sales_stats)
 
-    # Задание 3. Доступные к продаже
-    def get_cars(self, status: CarStatus) -> list[Car]:
-        """Функция принимает два параметра:
+    def _apply_sales_stats_changes(self, sales_stats: dict, changes: list[tuple]):
+        """Функция принимает три параметра:
         - self: экземпляр класса CarService;
-        - status: статус автомобиля.
-        Функция возвращает список автомобилей с указанным статусом.
-        Либо возвращает пустой список, если файл не существует.
+        - sales_stats: агрегаты продаж по id модели, которые нужно изменить;
+        - changes: список изменений (id модели, изменение количества
+          продаж, изменение выручки).
+        Функция применяет изменения к агрегатам в памяти.
+        Изменения по моделям, которых нет в БД, пропускаются.
+        """
+        for model_id, count, cost in changes:
+            if model_id not in sales_stats:
+                model = self._get_model(model_id)
+                if model is None:
+                    continue
+                sales_stats[model_id] = [0, Decimal(0), model.brand, model.name]
+            sales_stats[model_id][0] += count
+            sales_stats[model_id][1] += cost
+
+    def _load_free_slots(self) -> list[int]:
+        """Функция принимает один параметр:
+        - self: экземпляр класса CarService.
+        Функция возвращает номера строк (с единицы) удаленных продаж,
+        место которых можно занять новыми продажами.
         """
-        available_cars = []
         try:
-            with open(self.root_directory_path + FileForObject.car, 'r') as file_cars:
-                for line in file_cars.readlines():
-                    car_info = line.strip().split(';')
-                    if car_info[4] == status:
-                        current_car = Car(
-                            vin=car_info[0],
-                            model=int(car_info[1]),
-                            price=Decimal(car_info[2]),
-                            date_start=datetime(
-                                int(car_info[3][:4]),
-                                int(car_info[3][5:7]),
-                                int(car_info[3][8:10])
-                                ),
-                            status=status)
-                        available_cars.append(current_car)
+            with open(self.root_directory_path + FileForObject.sale_free_slots, 'r') as file_free:
+                count_open()
+                # строка, недописанная при сбое, пропускается
+                free_slots = [int(line) for line in file_free if line.endswith('\n')]
+                count_read(file_free.tell(), len(free_slots))
+                return free_slots
         except FileNotFoundError:
             return []
-        return available_cars
 
-    # Задание 4. Детальная информация
-    def get_car_info(self, vin: str) -> Union[CarFullInfo, None]:
+    def _save_free_slots(self, free_slots: list[int]):
         """Функция принимает два параметра:
         - self: экземпляр класса CarService;
-        - vin: идентификатор автомобиля.
-        Функция возвращает экземпляр класса CarFullInfo.
-        Либо возвращает None, если файл или объект не найдены.
+        - free_slots: номера строк (с единицы) удаленных продаж.
+        Функция записывает список свободных мест в файле с продажами
+        во временный файл и заменяет им прежний список.
         """
-        try:
-            # Получаем информацию об авто из файла 'cars.txt'
-            with open(self.root_directory_path + FileForObject.car, 'r') as file_cars:
-                ind = self._get_line_number_by_identifier(
-                    vin,
-                    FileIndexForObject.car
-                    )
-                if ind is None:
-                    return None
-                file_cars.seek(ind * 500)
-                car_info = file_cars.read(500).strip().split(';')
-        except FileNotFoundError:
-            return None
-        except ObjectIsNotExists:
-            return None
-
-        try:
-            # Получаем информацию о модели из файла 'models.txt'
-            with open(self.root_directory_path + FileForObject.model, 'r') as file_models:
-                ind = self._get_line_number_by_identifier(
-                    int(car_info[1]),
-                    FileIndexForObject.model
-                    )
-                if ind is None:
-                    return None
-                file_models.seek(ind * 500)
-                model_info = file_models.read(500).strip().split(';')
-        except FileNotFoundError:
-            return None
-        except ObjectIsNotExists:
-            return None
+        path = self.root_directory_path + FileForObject.sale_free_slots
+        tmp_path = disk_index.get_tmp_path(path)
+        with open(tmp_path, 'w') as file_free:
+            count_open()
+            count_write(file_free.write(
+                ''.join(f'{line_number}\n' for line_number in free_slots)
+                ))
+        os.replace(tmp_path, path)
 
-        # Получаем информацию о продаже из файла 'sales.txt'
-        sales_date = None
-        sales_cost = None
-        try:
-            with open(self.root_directory_path + FileForObject.sale, 'r') as file_sales:
-                for line in file_sales.readlines():
-                    sale_info = line.strip().split(';')
-                    if sale_info[1] == vin and sale_info[4] == '0':
-                        sales_date = sale_info[2]
-                        sales_cost = sale_info[3]
-        except FileNotFoundError:
-            pass
+    def _add_free_slot(self, line_number: int):
+        """Функция принимает два параметра:
+        - self: экземпляр класса CarService;
+        - line_number: номер строки (с единицы) удаленной продажи.
+        Функция одной записью дописывает место в конец списка свободных мест.
+        """
+        path = self.root_directory_path + FileForObject.sale_free_slots
+        with open(path, 'a') as file_free:
+            count_open()
+            count_write(file_free.write(f'{line_number}\n'))
 
-        current_car = CarFullInfo(
-            vin=car_info[0],
-            car_model_name=model_info[1],
-            car_model_brand=model_info[2],
-            price=Decimal(car_info[2]),
-            date_start=car_info[3],
+    def _store_sales(self, records: list) -> list[int]:
+        """Функция принимает два параметра:
+        - self: экземпляр класса CarService;
+        - records: записи о продажах, каждая в виде списка значений полей.
+        Функция записывает продажи на свободные места удаленных продаж
+        (если включено reuse_free_slots), а остальные одной записью
+        дописывает в конец файла.
+        Возвращает номера строк (с единицы) записанных продаж.
+        """
+        line_numbers = []
+        if self.reuse_free_slots:
+            free_slots = self._load_free_slots()
+            position = 0
+            while position < len(free_slots) and len(line_numbers) < len(records):
+                line_number = free_slots[position]
+                position += 1
+                # место занимается, только если продажа в нем все еще удалена
+                if self._read_record(FileForObject.sale, line_number - 1)[4] != '1':
+                    continue
+                self._write_record(FileForObject.sale, line_number - 1, records[len(line_numbers)])
+                line_numbers.append(line_number)
+            if position:
+                self._save_free_slots(free_slots[position:])
+            records = records[len(line_numbers):]
+        if records:
+            first_line_number = self._append_records(FileForObject.sale, records)
+            line_numbers.extend(
+                range(first_line_number, first_line_number + len(records))
+                )
+        return line_numbers
+
+    def _load_status_index(self) -> dict:
+        """Функция принимает один параметр:
+        - self: экземпляр класса CarService.
+        Функция возвращает индекс статусов автомобилей в виде словаря
+        статус -> отсортированный список номеров строк (с нуля)
+        в файле 'cars.txt'.
+        В файле индекса статусов на каждый автомобиль приходится один
+        байт с кодом статуса, поэтому он в сотни раз меньше 'cars.txt'.
+        Файл читается только при первом обращении или если его изменил
+        другой процесс. Если файла нет или он не соответствует файлу
+        с автомобилями, индекс строится заново.
+        """
+        path = self.root_directory_path + FileIndexForObject.car_status
+        signature = self._get_file_signature(path)
+        if (self._status_index_cache is not None
+                and self._status_index_cache[0] == signature):
+            return self._status_index_cache[1]
+        codes = b''
+        if signature is not None:
+            with open(path, 'rb') as file_status:
+                count_open()
+                codes = file_status.read()
+            count_read(len(codes), len(codes))
+        if len(codes) != len(self._get_store(FileForObject.car)):
+            codes = self._rebuild_status_index()
+            signature = self._get_file_signature(path)
+        lines_by_status = {status: [] for status in CarStatus}
+        for ind, code in enumerate(codes):
+            lines_by_status[CAR_STATUS_BY_CODE[code - ord('0')]].append(ind)
+        self._status_index_cache = (signature, lines_by_status)
+        return lines_by_status
+
+    def _rebuild_status_index(self) -> bytes:
+        """Функция принимает один параметр:
+        - self: экземпляр класса CarService.
+        Функция заново строит файл индекса статусов по файлу 'cars.txt'
+        и возвращает его содержимое.
+        """
+        cars = self._get_store(FileForObject.car)
+        if self._scanner.should_scan(len(cars)):
+            codes = b''.join(self._scanner.scan(cars, FileForObject.car, car_status_codes))
+        else:
+            codes = bytes(
+                ord('0') + CAR_STATUS_CODES[CarStatus(cars.split(record)[4].decode())]
+                for record in cars.iter_records()
+                )
+        path = self.root_directory_path + FileIndexForObject.car_status
+        tmp_path = disk_index.get_tmp_path(path)
+        with open(tmp_path, 'wb') as file_status:
+            count_open()
+            count_write(file_status.write(codes))
+        os.replace(tmp_path, path)
+        return codes
+
+    def _write_status_codes(self, changes: list[tuple]):
+        """Функция принимает два параметра:
+        - self: экземпляр класса CarService;
+        - changes: список пар (номер строки авто с нуля, новый статус).
+        Функция записывает коды статусов в файл индекса статусов
+        и обновляет индекс в памяти. Строка может быть новой
+        (добавленный авто) или уже существующей (смена статуса).
+        """
+        if not changes:
+            return
+        lines_by_status = self._load_status_index()
+        path = self.root_directory_path + FileIndexForObject.car_status
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        count_open()
+        try:
+            size = os.fstat(fd).st_size
+            for ind, status in changes:
+                if ind < size:
+                    old_code = os.pread(fd, 1, ind)[0] - ord('0')
+                    count_read(1, 1)
+                    old_lines = lines_by_status[CAR_STATUS_BY_CODE[old_code]]
+                    del old_lines[bisect.bisect_left(old_lines, ind)]
+                else:
+                    size = ind + 1
+                count_write(os.pwrite(fd, bytes([ord('0') + CAR_STATUS_CODES[status]]), ind))
+                bisect.insort(lines_by_status[status], ind)
+        finally:
+            os.close(fd)
+        self._status_index_cache = (self._get_file_signature(path), lines_by_status)
+
+    # Задание 1. Сохранение автомобилей и моделей
+    @instrumented
+    def add_model(self, model: Model) -> Union[Model, None]:
+        """Функция принимает два параметра:
+        - self: экземпляр класса CarService;
+        - model: экземпляр класса Model.
+        Функция вставляет запись о модели и сохраняет соответствующий индекс.
+        Либо возвращает None, если такая модель уже существует в БД.
+        """
+        return self.add_models([model])[0]
+
+    @instrumented
+    def add_models(self, models: Iterable[Model]) -> list[Union[Model, None]]:
+        """Функция принимает два параметра:
+        - self: экземпляр класса CarService;
+        - models: набор экземпляров класса Model.
+        Функция записывает операцию в журнал (если он включен)
+        и вставляет все новые модели.
+        Возвращает список той же длины, что и models: модель,
+        если она добавлена, или None, если такая модель уже
+        существует в БД или повторяется в models.
+        Либо вызывает исключение ValueError, если идентификатор
+        нельзя записать в индекс.
+        """
+        models = list(models)
+        with self._logged_operation('add_models', lambda: {
+                'models': [model.model_dump(mode='json') for model in models]},
+                write=(FileForObject.model,)):
+            return self._add_models(models)
+
+    def _add_models(self, models: list[Model]) -> list[Union[Model, None]]:
+        """Функция принимает два параметра:
+        - self: экземпляр класса CarService;
+        - models: набор экземпляров класса Model.
+        Функция одной записью вставляет все новые модели и один раз
+        обновляет файл с индексами.
+        Возвращает список той же длины, что и models: модель,
+        если она добавлена, или None, если такая модель уже
+        существует в БД или повторяется в models.
+        Либо вызывает исключение ValueError, если идентификатор
+        нельзя записать в индекс.
+        """
+        result = []
+        new_models = []
+        seen_id = set()
+        for model in models:
+            disk_index.check_key(FileIndexForObject.model, model.id)
+            if (model.id in seen_id or self._get_line_number_by_identifier(
+                    model.id, FileIndexForObject.model) is not None):
+                result.append(None)
+                continue
+            seen_id.add(model.id)
+            new_models.append(model)
+            result.append(model)
+        if not new_models:
+            return result
+        for model in new_models:
+            self._model_cache.pop(model.id)
+
+        # вставка моделей
+        first_line_number = self._append_records(
+            FileForObject.model,
+            [[model.id, model.name, model.brand] for model in new_models]
+            )
+        # вставка индексов
+        self._insert_many_indexes(
+            FileIndexForObject.model,
+            [(model.id, first_line_number + i)
+             for i, model in enumerate(new_models)]
+            )
+        return result
+
+    # Задание 1. Сохранение автомобилей и моделей
+    @instrumented
+    def add_car(self, car: Car) -> Union[Car, None]:
+        """Функция принимает два параметра:
+        - self: экземпляр класса CarService;
+        - car: экземпляр класса Car.
+        Функция вставляет запись об авто и сохраняет соответствующий индекс.
+        Либо возвращает None, если такой авто уже существует в БД.
+        """
+        return self.add_cars([car])[0]
+
+    @instrumented
+    def add_cars(self, cars: Iterable[Car]) -> list[Union[Car, None]]:
+        """Функция принимает два параметра:
+        - self: экземпляр класса CarService;
+        - cars: набор экземпляров класса Car.
+        Функция записывает операцию в журнал (если он включен)
+        и вставляет все новые автомобили.
+        Возвращает список той же длины, что и cars: авто,
+        если он добавлен, или None, если такой авто уже
+        существует в БД или повторяется в cars.
+        Либо вызывает исключение ValueError, если идентификатор
+        нельзя записать в индекс или цена задана точнее, чем до сотых,
+        а файл записан в двоичном формате.
+        """
+        cars = list(cars)
+        with self._logged_operation('add_cars', lambda: {
+                'cars': [car.model_dump(mode='json') for car in cars]},
+                write=(FileForObject.car,)):
+            return self._add_cars(cars)
+
+    def _add_cars(self, cars: list[Car]) -> list[Union[Car, None]]:
+        """Функция принимает два параметра:
+        - self: экземпляр класса CarService;
+        - cars: набор экземпляров класса Car.
+        Функция одной записью вставляет все новые автомобили и один раз
+        обновляет файл с индексами.
+        Возвращает список той же длины, что и cars: авто,
+        если он добавлен, или None, если такой авто уже
+        существует в БД или повторяется в cars.
+        Либо вызывает исключение ValueError, если идентификатор
+        нельзя записать в индекс или цена задана точнее, чем до сотых,
+        а файл записан в двоичном формате.
+        """
+        result = []
+        new_cars = []
+        seen_vin = set()
+        binary = self._is_binary(FileForObject.car)
+        for car in cars:
+            disk_index.check_key(FileIndexForObject.car, car.vin)
+            disk_index.encode_price(car.price)
+            if binary:
+                check_price(car.price)
+            if (car.vin in seen_vin or self._get_line_number_by_identifier(
+                    car.vin, FileIndexForObject.car) is not None):
+                result.append(None)
+                continue
+            seen_vin.add(car.vin)
+            new_cars.append(car)
+            result.append(car)
+        if not new_cars:
+            return result
+
+        # индексы по диапазонам должны соответствовать файлу до вставки
+        self._ensure_range_indexes()
+
+        # индекс статусов должен соответствовать файлу до вставки
+        self._load_status_index()
+        # вставка авто
+        records = [[car.vin, car.model, car.price, car.date_start, car.status]
+                   for car in new_cars]
+        first_line_number = self._append_records(FileForObject.car, records)
+        self._write_status_codes(
+            [(first_line_number - 1 + i, car.status)
+             for i, car in enumerate(new_cars)]
+            )
+        # вставка индексов
+        self._insert_many_indexes(
+            FileIndexForObject.car,
+            [(car.vin, first_line_number + i)
+             for i, car in enumerate(new_cars)]
+            )
+        for object, (field, encode) in RANGE_INDEXES.items():
+            self._insert_many_indexes(
+                object,
+                [(disk_index.range_key(encode(car_info[field]), line_number), line_number)
+                 for line_number, car_info in enumerate(records, start=first_line_number)]
+                )
+        return result
+
+    # Задание 2. Сохранение продаж
+    @instrumented
+    def sell_car(self, sale: Sale):
+        """Функция принимает два параметра:
+        - self: экземпляр класса CarService;
+        - sale: экземпляр класса Sale.
+        Функция вставляет запись о продаже и сохраняет соответствующий индекс.
+        Либо возвращает None, если такая продажа уже существует в БД.
+        """
+        self.sell_cars([sale])
+        return None
+
+    @instrumented
+    def sell_cars(self, sales: Iterable[Sale]) -> list[Union[Sale, None]]:
+        """Функция принимает два параметра:
+        - self: экземпляр класса CarService;
+        - sales: набор экземпляров класса Sale.
+        Функция записывает операцию в журнал (если он включен),
+        вставляет все новые продажи и меняет статус проданных авто на sold.
+        Возвращает список той же длины, что и sales: продажу,
+        если она добавлена, или None, если такая продажа уже
+        существует в БД или повторяется в sales.
+        Либо вызывает исключение ValueError, если идентификатор
+        нельзя записать в индекс или цена задана точнее, чем до сотых,
+        а файл записан в двоичном формате.
+        """
+        sales = list(sales)
+        with self._logged_operation('sell_cars', lambda: {
+                'sales': [sale.model_dump(mode='json') for sale in sales]},
+                read=(FileForObject.model,),
+                write=(FileForObject.car, FileForObject.sale)):
+            return self._sell_cars(sales)
+
+    def _sell_cars(self, sales: list[Sale]) -> list[Union[Sale, None]]:
+        """Функция принимает два параметра:
+        - self: экземпляр класса CarService;
+        - sales: набор экземпляров класса Sale.
+        Функция одной записью вставляет все новые продажи, один раз
+        обновляет файл с индексами и за одно открытие файла
+        меняет статус проданных авто на sold.
+        Возвращает список той же длины, что и sales: продажу,
+        если она добавлена, или None, если такая продажа уже
+        существует в БД или повторяется в sales.
+        Либо вызывает исключение ValueError, если идентификатор
+        нельзя записать в индекс или цена задана точнее, чем до сотых,
+        а файл записан в двоичном формате.
+        """
+        result = []
+        new_sales = []
+        seen_number = set()
+        binary = self._is_binary(FileForObject.sale)
+        for sale in sales:
+            disk_index.check_key(FileIndexForObject.sale, sale.sales_number)
+            disk_index.check_key(FileIndexForObject.sale_by_car, sale.car_vin)
+            disk_index.check_key(
+                FileIndexForObject.sale_date,
+                disk_index.sale_date_key(sale.sales_date, sale.sales_number)
+                )
+            if binary:
+                check_price(sale.cost)
+            if (sale.sales_number in seen_number or self._get_line_number_by_identifier(
+                    sale.sales_number, FileIndexForObject.sale) is not None):
+                result.append(None)
+                continue
+            seen_number.add(sale.sales_number)
+            new_sales.append(sale)
+            result.append(sale)
+        if not new_sales:
+            return result
+        self._invalidate_car_infos(sale.car_vin for sale in new_sales)
+
+        # агрегаты и индекс по дате должны быть построены
+        # до изменения файла с продажами
+        self._load_sales_stats()
+        self._ensure_sales_date_index()
+        # вставка продаж
+        line_numbers = self._store_sales(
+            [[sale.sales_number, sale.car_vin, sale.sales_date, sale.cost, 0]
+             for sale in new_sales]
+            )
+        # вставка индексов
+        self._insert_many_indexes(
+            FileIndexForObject.sale,
+            [(sale.sales_number, line_number)
+             for sale, line_number in zip(new_sales, line_numbers)]
+            )
+        # индекс продаж по vin: у авто учитывается последняя продажа
+        self._insert_many_indexes(
+            FileIndexForObject.sale_by_car,
+            [(sale.car_vin, line_number)
+             for sale, line_number in zip(new_sales, line_numbers)],
+            replace=True
+            )
+        self._insert_many_indexes(
+            FileIndexForObject.sale_date,
+            [(disk_index.sale_date_key(sale.sales_date, sale.sales_number), line_number)
+             for sale, line_number in zip(new_sales, line_numbers)]
+            )
+        # меняем статус авто на sold
+        sold_cars = self._change_status_cars(
+            [sale.car_vin for sale in new_sales],
+            CarStatus.sold
+            )
+        # учитываем продажи в агрегатах по моделям
+        self._update_sales_stats([
+            (int(sold_cars[sale.car_vin][1]), 1, sale.cost)
+            for sale in new_sales if sale.car_vin in sold_cars
+            ])
+        return result
+
+    def _build(self, model_class: Type[BaseModel], **fields) -> BaseModel:
+        """Функция принимает параметры:
+        - self: экземпляр класса CarService;
+        - model_class: класс модели pydantic;
+        - fields: значения полей модели в виде объектов Python.
+        Функция возвращает экземпляр model_class. Если включено
+        trusted_reads, поля не проверяются (см. models.construct):
+        значения прочитаны из файлов, которые записал сам CarService.
+        """
+        if self.trusted_reads:
+            return construct(model_class, **fields)
+        return model_class(**fields)
+
+    def _make_car(self, car_info: list) -> Car:
+        """Функция принимает два параметра:
+        - self: экземпляр класса CarService;
+        - car_info: поля записи об авто в виде объектов Python.
+        Функция возвращает экземпляр класса Car.
+        """
+        return self._build(
+            Car,
+            vin=car_info[0],
+            model=car_info[1],
+            price=car_info[2],
+            date_start=car_info[3],
+            status=car_info[4])
+
+    # Задание 3. Доступные к продаже
+    @instrumented
+    def get_cars(self, status: CarStatus) -> list[Car]:
+        """Функция принимает два параметра:
+        - self: экземпляр класса CarService;
+        - status: статус автомобиля.
+        Функция по индексу статусов читает только автомобили
+        с указанным статусом и возвращает их список в порядке
+        расположения в файле. Если таких автомобилей много, записи
+        разбираются в пуле процессов. Блокировка чтения держится
+        на время всего чтения, поэтому список согласован.
+        Либо возвращает пустой список, если файл не существует.
+        """
+        with self._locks.locked(read=(FileForObject.car,)):
+            cars = self._scan_cars(status, self._make_car)
+            if cars is not None:
+                return cars
+            return list(self.iter_cars(status))
+
+    @instrumented
+    def get_car_records(self, status: CarStatus) -> list[CarRecord]:
+        """Функция принимает два параметра:
+        - self: экземпляр класса CarService;
+        - status: статус автомобиля.
+        Функция возвращает те же автомобили, что и get_cars, в виде
+        легких записей CarRecord без построения моделей pydantic
+        (в модель Car запись переводит метод to_car).
+        """
+        with self._locks.locked(read=(FileForObject.car,)):
+            records = self._scan_cars(status, CarRecord._make)
+            if records is not None:
+                return records
+            return [
+                record for chunk in self._iter_car_chunks(status, 1000, CarRecord._make)
+                for record in chunk
+                ]
+
+    def _scan_cars(self, status: CarStatus, make: Callable) -> Union[list, None]:
+        """Функция принимает три параметра:
+        - self: экземпляр класса CarService;
+        - status: статус автомобиля;
+        - make: функция, которая строит результат по полям записи.
+        Функция, если автомобилей со статусом status не меньше порога
+        параллельного обхода, разбирает в пуле процессов участок файла
+        от первого до последнего такого автомобиля и возвращает
+        результаты make в порядке расположения в файле. Все диапазоны
+        читаются под одной блокировкой чтения.
+        Либо возвращает None, если обход нужно выполнить в этом процессе.
+        """
+        with self._locks.locked(read=(FileForObject.car,)):
+            lines = self._load_status_index()[status]
+            if not self._scanner.should_scan(len(lines)):
+                return None
+            chunks = self._scanner.scan(
+                self._get_store(FileForObject.car), FileForObject.car,
+                select_cars, status, start=lines[0], stop=lines[-1] + 1
+                )
+        return [make(car_info) for chunk in chunks for car_info in chunk]
+
+    def iter_cars(
+            self,
+            status: Union[CarStatus, None] = None,
+            chunk_size: int = 1000
+            ) -> Iterator[Car]:
+        """Функция принимает три параметра:
+        - self: экземпляр класса CarService;
+        - status: статус автомобиля (None - все автомобили);
+        - chunk_size: сколько номеров строк брать из индекса статусов за раз.
+        Функция по одному возвращает автомобили в порядке расположения
+        в файле, не собирая их в список, поэтому первый автомобиль
+        доступен до окончания чтения файла.
+        Блокировка чтения берется только на время чтения очередной
+        порции из chunk_size автомобилей, поэтому изменения, сделанные
+        во время обхода, могут быть видны частично.
+        """
+        for chunk in self._iter_car_chunks(status, chunk_size, self._make_car):
+            yield from chunk
+
+    def _iter_car_chunks(
+            self,
+            status: Union[CarStatus, None],
+            chunk_size: int,
+            make: Callable
+            ) -> Iterator[list]:
+        """Функция принимает четыре параметра:
+        - self: экземпляр класса CarService;
+        - status: статус автомобиля (None - все автомобили);
+        - chunk_size: сколько автомобилей читать под одной блокировкой;
+        - make: функция, которая строит результат по полям записи.
+        Функция по порциям возвращает результаты make для автомобилей
+        в порядке расположения в файле (см. iter_cars).
+        """
+        cars = self._get_store(FileForObject.car)
+        last_ind = -1
+        while True:
+            with self._locks.locked(read=(FileForObject.car,)):
+                if status is None:
+                    lines = range(last_ind + 1, min(last_ind + 1 + chunk_size, len(cars)))
+                else:
+                    lines = self._load_status_index()[status]
+                    start = bisect.bisect_right(lines, last_ind)
+                    lines = lines[start:start + chunk_size]
+                chunk = [make(cars.values(cars.read(ind))) for ind in lines]
+            yield chunk
+            if len(chunk) < chunk_size:
+                return
+            last_ind = lines[-1]
+
+    @instrumented
+    def get_cars_page(
+            self,
+            status: Union[CarStatus, None] = None,
+            cursor: Union[str, None] = None,
+            limit: int = 100
+            ) -> CarsPage:
+        """Функция принимает четыре параметра:
+        - self: экземпляр класса CarService;
+        - status: статус автомобиля (None - все автомобили);
+        - cursor: vin, после которого начинается страница
+          (None - первая страница);
+        - limit: максимальное количество автомобилей на странице.
+        Функция обходит индекс автомобилей в порядке vin, начиная
+        после cursor, и возвращает страницу автомобилей с указанным
+        статусом вместе с курсором следующей страницы
+        (None, если страница последняя).
+        """
+        with self._locks.locked(read=(FileForObject.car,)):
+            return self._get_cars_page(status, cursor, limit)
+
+    def _get_cars_page(
+            self,
+            status: Union[CarStatus, None],
+            cursor: Union[str, None],
+            limit: int
+            ) -> CarsPage:
+        """Функция принимает четыре параметра:
+        - self: экземпляр класса CarService;
+        - status: статус автомобиля (None - все автомобили);
+        - cursor: vin, после которого начинается страница;
+        - limit: максимальное количество автомобилей на странице.
+        Функция возвращает страницу автомобилей (см. get_cars_page).
+        """
+        cars = self._get_store(FileForObject.car)
+        page = []
+        for vin, line_number in self._iter_index(FileIndexForObject.car, cursor):
+            car_info = cars.values(cars.read(line_number - 1))
+            if status is not None and car_info[4] != status:
+                continue
+            if len(page) == limit:
+                return CarsPage(cars=page, next_cursor=page[-1].vin)
+            page.append(self._make_car(car_info))
+        return CarsPage(cars=page, next_cursor=None)
+
+    @instrumented
+    def find_cars(
+            self,
+            status: Union[CarStatus, None] = None,
+            date_from: Union[datetime, None] = None,
+            date_to: Union[datetime, None] = None,
+            price_min: Union[Decimal, None] = None,
+            price_max: Union[Decimal, None] = None,
+            order_by: Union[str, None] = None,
+            limit: Union[int, None] = None
+            ) -> list[Car]:
+        """Функция принимает восемь параметров:
+        - self: экземпляр класса CarService;
+        - status: статус автомобиля (None - любой);
+        - date_from, date_to: границы даты поступления включительно
+          (None - без границы);
+        - price_min, price_max: границы цены включительно (None - без границы);
+        - order_by: 'date_start' или 'price' - поле, по возрастанию которого
+          упорядочен результат (по умолчанию 'price', если заданы только
+          границы цены, иначе 'date_start');
+        - limit: максимальное количество автомобилей (None - все).
+        Функция по индексу поля order_by переходит к началу диапазона
+        и читает только записи автомобилей с подходящим статусом,
+        пока не выйдет за конец диапазона.
+        Либо вызывает исключение ValueError, если order_by неизвестен.
+        """
+        if order_by is None:
+            order_by = ('price' if date_from is None and date_to is None
+                        and (price_min is not None or price_max is not None)
+                        else 'date_start')
+        if order_by not in RANGE_ORDERS:
+            raise ValueError(f'Нельзя упорядочить автомобили по {order_by!r}')
+        if date_from is not None:
+            date_from = disk_index.to_naive_utc(date_from)
+        if date_to is not None:
+            date_to = disk_index.to_naive_utc(date_to)
+        if not self._range_indexes_checked:
+            # индексы БД, созданной до их появления, строятся под
+            # блокировкой записи, а поиск идет под блокировкой чтения
+            with self._locks.locked(write=(FileForObject.car,)):
+                self._ensure_range_indexes()
+        with self._locks.locked(read=(FileForObject.car,)):
+            return self._find_cars(
+                status, (date_from, date_to), (price_min, price_max),
+                RANGE_ORDERS[order_by], limit
+                )
+
+    def _find_cars(
+            self,
+            status: Union[CarStatus, None],
+            date_range: tuple,
+            price_range: tuple,
+            object: FileIndexForObject,
+            limit: Union[int, None]
+            ) -> list[Car]:
+        """Функция принимает шесть параметров:
+        - self: экземпляр класса CarService;
+        - status: статус автомобиля (None - любой);
+        - date_range: границы даты поступления (без часового пояса);
+        - price_range: границы цены;
+        - object: индекс, по которому идет обход;
+        - limit: максимальное количество автомобилей.
+        Функция возвращает автомобили (см. find_cars).
+        """
+        field, encode = RANGE_INDEXES[object]
+        low, high = date_range if object == FileIndexForObject.car_date else price_range
+        # ключ без номера строки меньше всех ключей с тем же значением
+        after = None if low is None else encode(low)
+        high_key = None if high is None else encode(high)
+        status_lines = None if status is None else self._load_status_index()[status]
+        cars = self._get_store(FileForObject.car)
+        result = []
+        if limit is not None and limit <= 0:
+            return result
+        for key, line_number in self._iter_index(object, after):
+            if high_key is not None and key[:len(high_key)] > high_key:
+                break
+            ind = line_number - 1
+            if status_lines is not None:
+                position = bisect.bisect_left(status_lines, ind)
+                if position == len(status_lines) or status_lines[position] != ind:
+                    continue
+            car_info = cars.values(cars.read(ind))
+            # строка значения в ключе может быть округлена,
+            # поэтому границы проверяются по самим значениям
+            date_start = disk_index.to_naive_utc(car_info[3])
+            if ((date_range[0] is not None and date_start < date_range[0])
+                    or (date_range[1] is not None and date_start > date_range[1])
+                    or (price_range[0] is not None and car_info[2] < price_range[0])
+                    or (price_range[1] is not None and car_info[2] > price_range[1])):
+                continue
+            result.append(self._make_car(car_info))
+            if limit is not None and len(result) == limit:
+                break
+        return result
+
+    # Задание 4. Детальная информация
+    @instrumented
+    def get_car_info(self, vin: str) -> Union[CarFullInfo, None]:
+        """Функция принимает два параметра:
+        - self: экземпляр класса CarService;
+        - vin: идентификатор автомобиля.
+        Функция возвращает экземпляр класса CarFullInfo.
+        Либо возвращает None, если файл или объект не найдены.
+        """
+        with self._locks.locked(read=LOCK_ORDER):
+            return self._get_car_info(vin)
+
+    def _get_car_info(self, vin: str) -> Union[CarFullInfo, None]:
+        """Функция принимает два параметра:
+        - self: экземпляр класса CarService;
+        - vin: идентификатор автомобиля.
+        Функция возвращает экземпляр класса CarFullInfo из кэша
+        или собирает его из файлов.
+        Либо возвращает None, если файл или объект не найдены.
+        """
+        cached = self._car_info_cache.get(vin)
+        if cached is not MISSING:
+            return cached.model_copy()
+        try:
+            # Получаем информацию об авто из файла 'cars.txt'
+            ind = self._get_line_number_by_identifier(
+                vin,
+                FileIndexForObject.car
+                )
+            if ind is None:
+                return None
+            car_info = self._read_values(FileForObject.car, ind)
+        except FileNotFoundError:
+            return None
+
+        # Получаем информацию о модели из файла 'models.txt'
+        model = self._get_model(car_info[1])
+        if model is None:
+            return None
+
+        # Получаем информацию о продаже из файла 'sales.txt'
+        # по индексу продаж по vin автомобиля
+        sales_date = None
+        sales_cost = None
+        ind = self._get_line_number_by_identifier(
+            vin,
+            FileIndexForObject.sale_by_car
+            )
+        if ind is not None:
+            try:
+                sale_info = self._read_values(FileForObject.sale, ind)
+                if sale_info[1] == vin and sale_info[4] == 0:
+                    sales_date = sale_info[2]
+                    sales_cost = sale_info[3]
+            except FileNotFoundError:
+                pass
+
+        current_car = self._build(
+            CarFullInfo,
+            vin=car_info[0],
+            car_model_name=model.name,
+            car_model_brand=model.brand,
+            price=car_info[2],
+            date_start=car_info[3],
             status=car_info[4],
             sales_date=sales_date,
             sales_cost=sales_cost)
 
-        return current_car
+        return self._cache_car_info(vin, current_car)
+
+    @instrumented
+    def get_car_infos(self, vins: Iterable[str]) -> dict[str, Union[CarFullInfo, None]]:
+        """Функция принимает два параметра:
+        - self: экземпляр класса CarService;
+        - vins: идентификаторы автомобилей.
+        Функция возвращает словарь vin -> экземпляр класса CarFullInfo
+        (или None, если автомобиль не найден) для всех vin в порядке
+        их первого появления в vins.
+        """
+        vins = list(vins)
+        with self._locks.locked(read=LOCK_ORDER):
+            return self._get_car_infos(vins)
+
+    def _get_car_infos(self, vins: list[str]) -> dict[str, Union[CarFullInfo, None]]:
+        """Функция принимает два параметра:
+        - self: экземпляр класса CarService;
+        - vins: идентификаторы автомобилей.
+        Функция берет из кэша уже известные автомобили, остальные
+        находит одним проходом по индексу, читает их записи в порядке
+        расположения в файле, берет каждую модель один раз и так же
+        одним проходом находит продажи.
+        Возвращает словарь vin -> CarFullInfo или None.
+        """
+        result = dict.fromkeys(vins)
+        missing = []
+        for vin in result:
+            cached = self._car_info_cache.get(vin)
+            if cached is MISSING:
+                missing.append(vin)
+            else:
+                result[vin] = cached.model_copy()
+        car_lines = self._get_line_numbers_by_identifiers(missing, FileIndexForObject.car)
+        if not car_lines:
+            return result
+        try:
+            cars_info = {
+                vin: self._read_values(FileForObject.car, ind)
+                for vin, ind in sorted(car_lines.items(), key=itemgetter(1))
+                }
+        except FileNotFoundError:
+            return result
+
+        # каждая модель берется из кэша или читается один раз
+        models = {}
+        for model_id in {car_info[1] for car_info in cars_info.values()}:
+            model = self._model_cache.get(model_id)
+            if model is not MISSING:
+                models[model_id] = model
+        model_lines = self._get_line_numbers_by_identifiers(
+            {car_info[1] for car_info in cars_info.values()} - models.keys(),
+            FileIndexForObject.model
+            )
+        try:
+            for model_id, ind in sorted(model_lines.items(), key=itemgetter(1)):
+                model_info = self._read_values(FileForObject.model, ind)
+                models[model_id] = self._build(
+                    Model, id=model_info[0], name=model_info[1], brand=model_info[2]
+                    )
+                self._model_cache.put(model_id, models[model_id])
+        except FileNotFoundError:
+            return result
+
+        # продажи по индексу продаж по vin автомобиля
+        sale_lines = self._get_line_numbers_by_identifiers(
+            cars_info,
+            FileIndexForObject.sale_by_car
+            )
+        sales_info = {}
+        try:
+            for vin, ind in sorted(sale_lines.items(), key=itemgetter(1)):
+                sale_info = self._read_values(FileForObject.sale, ind)
+                if sale_info[1] == vin and sale_info[4] == 0:
+                    sales_info[vin] = sale_info
+        except FileNotFoundError:
+            pass
+
+        for vin, car_info in cars_info.items():
+            model = models.get(car_info[1])
+            if model is None:
+                continue
+            sale_info = sales_info.get(vin)
+            result[vin] = self._cache_car_info(vin, self._build(
+                CarFullInfo,
+                vin=car_info[0],
+                car_model_name=model.name,
+                car_model_brand=model.brand,
+                price=car_info[2],
+                date_start=car_info[3],
+                status=car_info[4],
+                sales_date=None if sale_info is None else sale_info[2],
+                sales_cost=None if sale_info is None else sale_info[3]))
+        return result
 
     # Задание 5. Обновление ключевого поля
+    @instrumented
     def update_vin(self, vin: str, new_vin: str):
         """Функция принимает три параметра:
         - self: экземпляр класса CarService;
         - vin: идентификатор автомобиля, который нужно заменить;
         - new_vin: новый идентификатор автомобиля.
-        Функция меняет идентификатор автомобиля в БД
-        и меняет соответсвующий индекс.
+        Функция записывает операцию в журнал (если он включен)
+        и меняет идентификатор автомобиля в БД.
         Либо возвращает None, если файл или объект не найдены.
+        Либо вызывает исключение ValueError, если new_vin
+        нельзя записать в индекс.
         """
+        with self._logged_operation('update_vin', lambda: {
+                'vin': vin, 'new_vin': new_vin},
+                write=(FileForObject.car, FileForObject.sale)):
+            return self._update_vin(vin, new_vin)
+
+    def _update_vin(self, vin: str, new_vin: str):
+        """Функция принимает три параметра:
+        - self: экземпляр класса CarService;
+        - vin: идентификатор автомобиля, который нужно заменить;
+        - new_vin: новый идентификатор автомобиля.
+        Функция меняет идентификатор автомобиля в БД, меняет
+        соответсвующий индекс и переносит на новый идентификатор
+        продажу автомобиля.
+        Либо возвращает None, если файл или объект не найдены.
+        Либо вызывает исключение ValueError, если new_vin
+        нельзя записать в индекс.
+        """
+        disk_index.check_key(FileIndexForObject.car, new_vin)
+        self._invalidate_car_infos([vin, new_vin])
         # Обновляем vin в файле 'car.txt'
         try:
-            with open(self.root_directory_path + FileForObject.car, 'r+') as file_cars:
-                car_line_number = self._get_line_number_by_identifier(
-                    vin,
-                    FileIndexForObject.car
-                    )
-                if car_line_number is None:
-                    return None
-                file_cars.seek(500 * car_line_number)
-                car_info = file_cars.read(500).strip().split(';')
-                car_info[0] = new_vin
-                new_car_string = self._create_string(car_info, min_length=500)
-                # Записываем изменения в файл
-                file_cars.seek(500 * car_line_number)
-                file_cars.write(new_car_string)
+            car_line_number = self._get_line_number_by_identifier(
+                vin,
+                FileIndexForObject.car
+                )
+            if car_line_number is None:
+                return None
+            car_info = self._read_record(FileForObject.car, car_line_number)
+            car_info[0] = new_vin
+            # Записываем изменения в файл
+            self._write_record(FileForObject.car, car_line_number, car_info)
         except FileNotFoundError:
             return None
-        except ObjectIsNotExists:
-            return None
 
         # Обновляем индекс в файле 'car_index.txt'
         self._delete_index(FileIndexForObject.car, vin)
-        new_string = f'{new_vin};{car_line_number + 1}\n'
         self._insert_new_index(
             FileIndexForObject.car,
             new_vin,
-            new_string
+            car_line_number + 1
+            )
+        self._move_sale_to_vin(vin, new_vin)
+
+    def _move_sale_to_vin(self, vin: str, new_vin: str):
+        """Функция принимает три параметра:
+        - self: экземпляр класса CarService;
+        - vin: прежний идентификатор автомобиля;
+        - new_vin: новый идентификатор автомобиля.
+        Функция меняет vin в записи последней продажи автомобиля
+        (по индексу продаж по vin) и переносит ее индекс на new_vin,
+        чтобы отмена продажи нашла автомобиль и его модель.
+        Ничего не делает, если у автомобиля нет продажи.
+        """
+        ind = self._get_line_number_by_identifier(vin, FileIndexForObject.sale_by_car)
+        if ind is None:
+            return
+        self._invalidate_car_infos([vin, new_vin])
+        sales_info = self._read_record(FileForObject.sale, ind)
+        sales_info[1] = new_vin
+        self._write_record(FileForObject.sale, ind, sales_info)
+        self._delete_index(FileIndexForObject.sale_by_car, vin)
+        self._insert_many_indexes(
+            FileIndexForObject.sale_by_car,
+            [(new_vin, ind + 1)],
+            replace=True
             )
 
     # Задание 6. Удаление продажи
+    @instrumented
     def revert_sale(self, sales_number: str):
+        """Функция принимает два параметра:
+        - self: экземпляр класса CarService;
+        - sales_number: идентификатор продажи, которую нужно удалить.
+        Функция записывает операцию в журнал (если он включен),
+        удаляет продажу и меняет статус авто на 'available'.
+        Либо возвращает None, если файл или объект не найдены.
+        """
+        with self._logged_operation('revert_sale', lambda: {
+                'sales_number': sales_number,
+                'car_vin': self._get_sale_car_vin(sales_number)},
+                read=(FileForObject.model,),
+                write=(FileForObject.car, FileForObject.sale)):
+            return self._revert_sale(sales_number)
+
+    @instrumented
+    def get_sale_vins(self, sales_numbers: Iterable[str]) -> dict[str, str]:
+        """Функция принимает два параметра:
+        - self: экземпляр класса CarService;
+        - sales_numbers: идентификаторы продаж.
+        Функция одним проходом по индексу продаж находит продажи
+        и возвращает словарь идентификатор продажи -> vin проданного
+        автомобиля для найденных продаж.
+        """
+        with self._locks.locked(read=(FileForObject.sale,)):
+            line_numbers = self._get_line_numbers_by_identifiers(
+                sales_numbers,
+                FileIndexForObject.sale
+                )
+            try:
+                return {
+                    sales_number: self._read_record(FileForObject.sale, ind)[1]
+                    for sales_number, ind in sorted(line_numbers.items(), key=itemgetter(1))
+                    }
+            except FileNotFoundError:
+                return {}
+
+    def _get_sale_car_vin(self, sales_number: str) -> Union[str, None]:
+        """Функция принимает два параметра:
+        - self: экземпляр класса CarService;
+        - sales_number: идентификатор продажи.
+        Функция возвращает vin проданного автомобиля.
+        Либо возвращает None, если файл или продажа не найдены.
+        """
+        ind = self._get_line_number_by_identifier(
+            sales_number,
+            FileIndexForObject.sale
+            )
+        if ind is None:
+            return None
+        try:
+            return self._read_record(FileForObject.sale, ind)[1]
+        except FileNotFoundError:
+            return None
+
+    def _revert_sale(self, sales_number: str):
         """Функция принимает два параметра:
         - self: экземпляр класса CarService;
         - sales_number: идентификатор продажи, которую нужно удалить.
@@ -455,81 +2053,574 @@ class CarService:
         удаляет индекс этой продажи, меняет статус авто на 'available'.
         Либо возвращает None, если файл или объект не найдены.
         """
+        # агрегаты и индекс по дате должны быть построены
+        # до изменения файла с продажами
+        self._load_sales_stats()
+        self._ensure_sales_date_index()
         # удаляем продажу (ставим флаг is_deleted = true)
         try:
-            with open(self.root_directory_path + FileForObject.sale, 'r+') as file_sales:
-                ind = self._get_line_number_by_identifier(
-                    sales_number,
-                    FileIndexForObject.sale
+            ind = self._get_line_number_by_identifier(
+                sales_number,
+                FileIndexForObject.sale
+                )
+            if ind is None:
+                return None
+            sales_info = self._read_record(FileForObject.sale, ind)
+            self._invalidate_car_infos([sales_info[1]])
+            # пометка is_deleted = true
+            sales_info[-1] = '1'
+            # записываем в файл и запоминаем освободившееся место
+            self._write_record(FileForObject.sale, ind, sales_info)
+            if self.reuse_free_slots:
+                self._add_free_slot(ind + 1)
+            # удаляем индекс продажи и меняем статус авто на 'available'
+            self._delete_index(FileIndexForObject.sale, sales_number)
+            if self._get_line_number_by_identifier(
+                    sales_info[1],
+                    FileIndexForObject.sale_by_car) == ind:
+                self._delete_index(
+                    FileIndexForObject.sale_by_car,
+                    sales_info[1]
+                    )
+            car_info = self._change_status_car(sales_info[1], CarStatus.available)
+            if car_info is not None:
+                self._update_sales_stats(
+                    [(int(car_info[1]), -1, -Decimal(sales_info[3]))]
                     )
-                if ind is None:
-                    return None
-                file_sales.seek(ind * 500)
-                sales_info = file_sales.read(500).strip().split(';')
-                # пометка is_deleted = true
-                sales_info[-1] = '1'
-                # записываем в файл
-                file_sales.seek(ind * 500)
-                file_sales.write(self._create_string(sales_info, 500))
-                # удаляем индекс продажи и меняем статус авто на 'available'
-                self._delete_index(FileIndexForObject.sale, sales_number)
-            self._change_status_car(sales_info[1], CarStatus.available)
+            else:
+                # по vin из продажи автомобиль не найден (например, продажа
+                # была до повторной продажи и смены vin), поэтому модель
+                # неизвестна и агрегаты считаются заново
+                self._rebuild_sales_aggregates()
+            self._delete_index(
+                FileIndexForObject.sale_date,
+                disk_index.sale_date_key(datetime.fromisoformat(sales_info[2]), sales_number)
+                )
         except FileNotFoundError:
             return None
         except ObjectIsNotExists:
             return None
 
     # Задание 7. Самые продаваемые модели
+    @instrumented
     def top_models_by_sales(self) -> list[ModelSaleStats]:
         """Функция принимает один параметр:
         - self: экземпляр класса CarService.
-        Функция считает количество продаж каждой модели авто
-        и суммарную их стомость.
-        Выбирает три модели, которые продавались чаще всего.
+        Функция по агрегатам продаж выбирает три модели,
+        которые продавались чаще всего.
         Если модели имеют одинаковое количество продаж,
         выбирает более дорогие модели.
-        Либо возвращает пустой список, если файл не существует.
+        Либо возвращает пустой список, если продаж нет.
         """
-        # считает количество продаж и суммарную стоимость каждой модели авто
-        number_sales_by_models = {}
-        try:
-            with open(self.root_directory_path + FileForObject.sale, 'r') as file_sales:
-                for line in file_sales.readlines():
-                    sale_info = line.strip().split(';')
-                    vin = sale_info[1]
-                    cost = Decimal(sale_info[3])
-                    is_deleted = int(sale_info[4])
-                    if not is_deleted:
-                        car_info = self.get_car_info(vin)
-                        if car_info is None:
-                            continue
-                        model_name = car_info.car_model_name 
-                        if model_name in number_sales_by_models:
-                            number_sales_by_models[model_name][0] += 1
-                            number_sales_by_models[model_name][1] += cost
-                        else:
-                            number_sales_by_models[model_name] = [
-                                1,
-                                cost,
-                                car_info.car_model_brand
-                                ]
-        except FileNotFoundError:
-            return []
-
+        with self._locks.locked(read=LOCK_ORDER):
+            sales_stats = self._load_sales_stats()
         # выбирает три модели, которые продавались чаще всего, если модели
         # имеют одинаковое количество продаж, выбирает более дорогие модели
-        top_3 = sorted(
-            number_sales_by_models.items(),
-            key=itemgetter(1),
-            reverse=True)[0:3]
-
-        list_top_models = []
-        for top in top_3:
-            current_model = ModelSaleStats(
-                car_model_name=top[0],
-                brand=str(top[1][2]),
-                sales_number=int(top[1][0])
+        return rank_models(sales_stats, 3, 'count', with_revenue=False, trusted=self.trusted_reads)
+
+    @instrumented
+    def top_models(
+            self,
+            n: int = 3,
+            since: Union[datetime, None] = None,
+            until: Union[datetime, None] = None,
+            by: str = 'count'
+            ) -> list[ModelSaleStats]:
+        """Функция принимает пять параметров:
+        - self: экземпляр класса CarService;
+        - n: количество моделей;
+        - since: начало периода включительно (None - без границы);
+        - until: конец периода не включительно (None - без границы);
+        - by: 'count' - упорядочить по количеству продаж (при равенстве -
+          по выручке), 'revenue' - по выручке (при равенстве - по количеству).
+        Функция возвращает n самых продаваемых за период моделей
+        с количеством продаж и выручкой. Без границ периода используются
+        агрегаты продаж, иначе по индексу продаж по дате читаются только
+        продажи за период.
+        Либо вызывает исключение ValueError, если by неизвестен.
+        """
+        if by not in TOP_MODELS_ORDERS:
+            raise ValueError(f'Нельзя упорядочить модели по {by!r}')
+        if n <= 0:
+            return []
+        return rank_models(self.get_sales_stats(since, until), n, by, trusted=self.trusted_reads)
+
+    @instrumented
+    def get_sales_stats(
+            self,
+            since: Union[datetime, None] = None,
+            until: Union[datetime, None] = None
+            ) -> dict:
+        """Функция принимает три параметра:
+        - self: экземпляр класса CarService;
+        - since: начало периода включительно (None - без границы);
+        - until: конец периода не включительно (None - без границы).
+        Функция возвращает копию агрегатов продаж за период: словарь
+        id модели -> [количество продаж, выручка, бренд, название модели].
+        Без границ периода используются агрегаты продаж, иначе продажи
+        за период читаются по индексу продаж по дате.
+        """
+        with self._locks.locked(read=LOCK_ORDER):
+            if since is None and until is None:
+                sales_stats = self._load_sales_stats()
+            else:
+                sales_stats = self._get_sales_stats_for_period(since, until)
+            return {model_id: list(stats) for model_id, stats in sales_stats.items()}
+
+    def _get_sales_stats_for_period(
+            self,
+            since: Union[datetime, None],
+            until: Union[datetime, None]
+            ) -> dict:
+        """Функция принимает три параметра:
+        - self: экземпляр класса CarService;
+        - since: начало периода включительно (None - без границы);
+        - until: конец периода не включительно (None - без границы).
+        Функция по индексу продаж по дате считает агрегаты продаж
+        за период в том же виде, что и _load_sales_stats. Как и при
+        построении агрегатов, учитываются только продажи автомобилей,
+        которые находятся по vin.
+        """
+        self._get_store(FileForObject.sale).reopen_if_replaced()
+        self._ensure_sales_date_index()
+        after = None if since is None else disk_index.encode_date(since)
+        until_key = None if until is None else disk_index.encode_date(until)
+        sales = self._get_store(FileForObject.sale)
+        period_sales = []
+        for key, line_number in self._iter_index(FileIndexForObject.sale_date, after):
+            if until_key is not None and key[:len(until_key)] >= until_key:
+                break
+            sale_info = sales.values(sales.read(line_number - 1))
+            if sale_info[4] == 0:
+                period_sales.append((sale_info[1], sale_info[3]))
+
+        # модели проданных авто читаются в порядке расположения в файле
+        car_lines = self._get_line_numbers_by_identifiers(
+            {vin for vin, _ in period_sales},
+            FileIndexForObject.car
+            )
+        cars = self._get_store(FileForObject.car)
+        model_by_vin = {
+            vin: cars.values(cars.read(ind))[1]
+            for vin, ind in sorted(car_lines.items(), key=itemgetter(1))
+            }
+        sales_stats = {}
+        self._apply_sales_stats_changes(
+            sales_stats,
+            [(model_by_vin[vin], 1, cost) for vin, cost in period_sales if vin in model_by_vin]
+            )
+        return sales_stats
+
+    def _columnar_signature(self) -> dict:
+        """Функция принимает один параметр:
+        - self: экземпляр класса CarService.
+        Функция возвращает сигнатуры файлов, по которым можно понять,
+        что БД изменилась после построения колоночного снимка.
+        Изменения, записанные в отображение файла с записями, не всегда
+        меняют время его изменения, поэтому учитываются и файлы, которые
+        такие изменения сопровождают: индекс статусов (продажа, отмена
+        продажи), агрегаты продаж и индекс автомобилей (смена vin).
+        """
+        paths = [self.root_directory_path + object for object in RECORD_FILES]
+        paths.append(self.root_directory_path + FileIndexForObject.car_status)
+        paths.append(self.root_directory_path + FileForObject.sale_stats)
+        paths.extend(self._get_lsm_index(FileIndexForObject.car).paths())
+        return {os.path.basename(path): self._get_file_signature(path) for path in paths}
+
+    @instrumented
+    def export_columnar(
+            self,
+            directory: Union[str, None] = None,
+            force: bool = False
+            ) -> ColumnarSnapshot:
+        """Функция принимает три параметра:
+        - self: экземпляр класса CarService;
+        - directory: каталог снимка (по умолчанию 'columnar' в каталоге БД);
+        - force: строить ли снимок, даже если БД не менялась.
+        Функция переводит модели, автомобили и продажи в колоночный
+        снимок (см. columnar.py) и возвращает его с отображенными
+        в память столбцами. Если снимок уже построен по текущему
+        состоянию БД, он только загружается.
+        Либо вызывает исключение ImportError, если NumPy не установлен.
+        """
+        if directory is None:
+            directory = self.root_directory_path + COLUMNAR_DIRECTORY
+        with self._locks.locked(read=LOCK_ORDER):
+            signature = self._columnar_signature()
+            if force or not columnar.is_fresh(directory, signature):
+                columnar.export_snapshot(
+                    {object: self._get_store(object) for object in RECORD_FILES},
+                    directory,
+                    signature
+                    )
+            return columnar.load_snapshot(directory)
+
+    @instrumented
+    def read_snapshot(self) -> ReadSnapshot:
+        """Функция принимает один параметр:
+        - self: экземпляр класса CarService.
+        Функция возвращает снимок автомобилей, индекса статусов
+        и агрегатов продаж на текущий момент (см. read_snapshot.py).
+        Блокировка чтения держится только на время создания снимка,
+        поэтому долгий отчет по снимку не задерживает запись, а изменения,
+        сделанные после создания снимка, в нем не видны.
+        Снимок нужно закрыть (close или блок with).
+        """
+        with self._locks.locked(read=LOCK_ORDER):
+            cars = RecordView(self._get_store(FileForObject.car))
+            try:
+                # списки индекса статусов меняются на месте при записи,
+                # поэтому снимок хранит их копии
+                lines_by_status = {
+                    status: list(lines)
+                    for status, lines in self._load_status_index().items()
+                    }
+                sales_stats = {
+                    model_id: list(stats)
+                    for model_id, stats in self._load_sales_stats().items()
+                    }
+            except BaseException:
+                cars.close()
+                raise
+        return ReadSnapshot(
+            cars, lines_by_status, sales_stats, self._make_car,
+            functools.partial(rank_models, trusted=self.trusted_reads)
+            )
+
+    @instrumented
+    def rebuild_sales_aggregates(self) -> dict:
+        """Функция принимает один параметр:
+        - self: экземпляр класса CarService.
+        Функция заново считает агрегаты продаж по файлу с продажами
+        и перезаписывает файл с агрегатами.
+        Возвращает агрегаты продаж по id модели.
+        """
+        with self._locks.locked(
+                read=(FileForObject.model, FileForObject.car),
+                write=(FileForObject.sale,)):
+            return self._rebuild_sales_aggregates()
+
+    def _rebuild_sales_aggregates(self) -> dict:
+        """Функция принимает один параметр:
+        - self: экземпляр класса CarService.
+        Функция заново считает количество продаж и суммарную
+        стоимость каждой модели авто по файлу с продажами
+        и перезаписывает файл с агрегатами.
+        Возвращает агрегаты продаж по id модели.
+        """
+        changes = []
+        for _, vin, cost in self._iter_active_sales():
+            ind = self._get_line_number_by_identifier(vin, FileIndexForObject.car)
+            if ind is None:
+                continue
+            changes.append((ind, cost))
+
+        # читаем модели проданных авто в порядке расположения в файле
+        cars = self._get_store(FileForObject.car)
+        model_by_line = {
+            ind: int(cars.split(cars.read(ind))[1])
+            for ind in sorted({ind for ind, _ in changes})
+            }
+
+        sales_stats = {}
+        self._apply_sales_stats_changes(
+            sales_stats,
+            [(model_by_line[ind], 1, cost) for ind, cost in changes]
+            )
+        self._save_sales_stats(sales_stats)
+        return self._load_sales_stats()
+
+    def _finish_compaction(self):
+        """Функция принимает один параметр:
+        - self: экземпляр класса CarService.
+        Функция доводит до конца уплотнение, прерванное сбоем: если
+        отметка о готовности новых файлов есть, оставшиеся новые файлы
+        заменяют старые, иначе недописанные новые файлы удаляются.
+        """
+        marker = self.root_directory_path + COMPACTION_MARKER
+        committed = os.path.exists(marker)
+        for object in COMPACTED_FILES:
+            path = self.root_directory_path + object
+            if os.path.exists(path + '.compact'):
+                if committed:
+                    os.replace(path + '.compact', path)
+                else:
+                    os.remove(path + '.compact')
+        if committed:
+            os.remove(marker)
+
+    @instrumented
+    def compact(self) -> int:
+        """Функция принимает один параметр:
+        - self: экземпляр класса CarService.
+        Функция переписывает файл с продажами без удаленных продаж,
+        перенумеровывает строки в индексах продаж и очищает список
+        свободных мест. Новые файлы сначала пишутся рядом со старыми
+        и заменяют их только после записи отметки о готовности,
+        поэтому после сбоя остается либо старое, либо новое состояние.
+        Файлы с автомобилями и моделями удаленных записей не содержат.
+        Возвращает количество освобожденных байт.
+        """
+        with self._locks.locked(write=(FileForObject.sale,)):
+            return self._compact()
+
+    def _compact(self) -> int:
+        """Функция принимает один параметр:
+        - self: экземпляр класса CarService.
+        Функция уплотняет файл с продажами (см. compact)
+        и возвращает количество освобожденных байт.
+        """
+        path = self.root_directory_path + FileForObject.sale
+        if not os.path.exists(path):
+            return 0
+        # индекс по дате переписывается вместе с остальными индексами продаж
+        self._ensure_sales_date_index()
+        # индексы продаж заменяются целиком, поэтому сначала сливаются
+        for object in SALE_INDEXES:
+            self._get_lsm_index(object).merge()
+        # переписываем живые продажи и запоминаем их новые номера строк
+        new_line_numbers = {}
+        with open(path + '.compact', 'wb') as file_sales:
+            sales = self._get_store(FileForObject.sale)
+            file_sales.write(sales.header)
+            for line_number, record in enumerate(sales.iter_records(), start=1):
+                if sales.split(record)[4] != b'0':
+                    continue
+                new_line_numbers[line_number] = len(new_line_numbers) + 1
+                file_sales.write(record)
+            file_sales.flush()
+            os.fsync(file_sales.fileno())
+        reclaimed = os.path.getsize(path) - os.path.getsize(path + '.compact')
+
+        for object in SALE_INDEXES:
+            disk_index.write_entries(
+                self.root_directory_path + object + '.compact',
+                object,
+                [(key, new_line_numbers[line_number])
+                 for key, line_number in self._iter_index(object)
+                 if line_number in new_line_numbers]
                 )
-            list_top_models.append(current_model)
+        with open(self.root_directory_path + FileForObject.sale_free_slots
+                  + '.compact', 'w'):
+            pass
+
+        # отметка о готовности: с этого момента уплотнение доводится до конца
+        with open(self.root_directory_path + COMPACTION_MARKER, 'w') as file_marker:
+            file_marker.flush()
+            os.fsync(file_marker.fileno())
+        self._get_store(FileForObject.sale).close()
+        self._finish_compaction()
+        for object in SALE_INDEXES:
+            self._index_cache.pop(object, None)
+        return reclaimed
+
+    @contextmanager
+    def _logged_operation(
+            self,
+            op: str,
+            args_factory,
+            read: tuple = (),
+            write: tuple = ()
+            ):
+        """Функция принимает пять параметров:
+        - self: экземпляр класса CarService;
+        - op: название операции;
+        - args_factory: функция, возвращающая аргументы операции для журнала;
+        - read: типы объектов, файлы которых операция читает;
+        - write: типы объектов, файлы которых операция меняет.
+        Функция-контекст записывает операцию в журнал и дожидается
+        ее сброса на диск вместе с операциями других потоков (одним fsync),
+        после чего выполняет тело контекста под блокировками read и write
+        в порядке номеров операций. Если сбросить журнал не удалось,
+        операция отмечается в журнале как непримененная и исключение
+        передается дальше. Если журнал выключен, тело только
+        выполняется под блокировками.
+        """
+        if self._wal is None:
+            with self._locks.locked(read, write):
+                yield
+            return
+        with self._locks.locked(read, write):
+            lsn = self._wal.append(op, args_factory())
+        try:
+            self._wal.commit(lsn)
+        except BaseException:
+            # операция не применяется, но ее очередь должна пройти,
+            # иначе следующие операции будут ждать ее вечно
+            with self._apply_turn:
+                while self._applied_lsn != lsn - 1:
+                    self._apply_turn.wait()
+                try:
+                    self._wal.abort(lsn)
+                finally:
+                    self._applied_lsn = lsn
+                    self._wal.mark_applied(lsn)
+                    self._apply_turn.notify_all()
+            raise
+        with self._apply_turn:
+            while self._applied_lsn != lsn - 1:
+                self._apply_turn.wait()
+            try:
+                with self._locks.locked(read, write):
+                    yield
+            finally:
+                self._applied_lsn = lsn
+                self._wal.mark_applied(lsn)
+                self._apply_turn.notify_all()
+        if self._wal.size() > self.checkpoint_bytes:
+            self.checkpoint()
+
+    @instrumented
+    def checkpoint(self) -> bool:
+        """Функция принимает один параметр:
+        - self: экземпляр класса CarService.
+        Функция сбрасывает на диск все файлы БД и каталог с ними
+        и, если все записанные в журнал операции уже применены,
+        очищает журнал.
+        Возвращает True, если журнал очищен.
+        """
+        with self._locks.locked(write=LOCK_ORDER):
+            for store in self._stores.values():
+                store.flush()
+            for object in (*FileForObject, *FileIndexForObject):
+                fsync_path(self.root_directory_path + object)
+            for lsm in self._lsm_indexes.values():
+                for path in lsm.paths():
+                    fsync_path(path)
+            fsync_path(self.root_directory_path)
+            if self._wal is None:
+                return False
+            self._wal.mark_durable(self._applied_lsn)
+            if self._applied_lsn != self._wal.last_lsn():
+                return False
+            self._wal.truncate()
+            return True
+
+    def _drop_torn_records(self, object: FileForObject):
+        """Функция принимает два параметра:
+        - self: экземпляр класса CarService;
+        - object: тип объекта.
+        Функция отбрасывает недописанные при сбое записи в конце файла.
+        """
+        store = self._get_store(object)
+        count = len(store)
+        while count > 0 and not store.is_valid(store.read(count - 1)):
+            count -= 1
+        if count < len(store):
+            store.truncate(count)
 
-        return list_top_models
+    @instrumented
+    def rebuild_indexes(self):
+        """Функция принимает один параметр:
+        - self: экземпляр класса CarService.
+        Функция заново строит по файлам с данными индексы моделей,
+        автомобилей и продаж, индексы продаж по vin и по дате, индексы
+        автомобилей по дате и цене, индекс статусов, список свободных
+        мест и агрегаты продаж.
+        """
+        with self._locks.locked(write=LOCK_ORDER):
+            for object in RECORD_FILES:
+                self._get_store(object).reopen_if_replaced()
+                self._drop_torn_records(object)
+            self._index_cache.clear()
+            for object, index_object in (
+                    (FileForObject.model, FileIndexForObject.model),
+                    (FileForObject.car, FileIndexForObject.car)):
+                key_type = int if object == FileForObject.model else str
+                line_by_key = {}
+                store = self._get_store(object)
+                for line_number, record in enumerate(store.iter_records(), start=1):
+                    line_by_key[key_type(store.split(record)[0].decode())] = line_number
+                all_id = sorted(line_by_key)
+                self._save_index(
+                    index_object,
+                    all_id,
+                    [line_by_key[key] for key in all_id]
+                    )
+
+            line_by_number = {}
+            free_slots = []
+            sales = self._get_store(FileForObject.sale)
+            for line_number, record in enumerate(sales.iter_records(), start=1):
+                sale_info = sales.split(record)
+                if sale_info[4] == b'0':
+                    line_by_number[sale_info[0].decode()] = line_number
+                else:
+                    free_slots.append(line_number)
+            all_number = sorted(line_by_number)
+            self._save_index(
+                FileIndexForObject.sale,
+                all_number,
+                [line_by_number[number] for number in all_number]
+                )
+            self._save_free_slots(free_slots)
+            self._rebuild_sales_by_car_index()
+            self._rebuild_sales_date_index()
+
+            self._rebuild_range_indexes()
+            self._rebuild_status_index()
+            self._status_index_cache = None
+            self._sales_stats_cache = None
+            self._rebuild_sales_aggregates()
+
+    def _recover(self):
+        """Функция принимает один параметр:
+        - self: экземпляр класса CarService.
+        Функция восстанавливает БД после сбоя: если в журнале остались
+        не примененные до сбоя операции (см. wal.py), индексы строятся
+        заново по файлам с данными, эти операции применяются повторно
+        в порядке записи, после чего выполняется контрольная точка.
+        """
+        with self._locks.locked(write=LOCK_ORDER):
+            operations = self._wal.operations()
+            if operations:
+                self.rebuild_indexes()
+            for record in operations:
+                try:
+                    self._replay(record['op'], record['args'])
+                except (ValueError, DuplicateValue, ObjectIsNotExists):
+                    # операция завершилась ошибкой и при первом выполнении
+                    pass
+                self._wal.mark_applied(record['lsn'])
+            if self._wal.size() > 0:
+                self.checkpoint()
+
+    def _replay(self, op: str, args: dict):
+        """Функция принимает три параметра:
+        - self: экземпляр класса CarService;
+        - op: название операции из журнала;
+        - args: аргументы операции.
+        Функция повторно применяет операцию. Операции, которые уже
+        попали в файлы до сбоя, не применяются второй раз, а у частично
+        примененных доводятся до конца оставшиеся изменения.
+        """
+        if op == 'add_models':
+            self._add_models([Model(**model) for model in args['models']])
+        elif op == 'add_cars':
+            self._add_cars([Car(**car) for car in args['cars']])
+        elif op == 'sell_cars':
+            sales = [Sale(**sale) for sale in args['sales']]
+            self._sell_cars(sales)
+            # продажа могла попасть в файл, а статус авто - нет
+            sold_vins = []
+            for sale in sales:
+                ind = self._get_line_number_by_identifier(
+                    sale.sales_number,
+                    FileIndexForObject.sale
+                    )
+                if (ind is not None and self._read_record(
+                        FileForObject.sale, ind)[1] == sale.car_vin):
+                    sold_vins.append(sale.car_vin)
+            self._change_status_cars(sold_vins, CarStatus.sold)
+        elif op == 'update_vin':
+            if self._get_line_number_by_identifier(
+                    args['new_vin'], FileIndexForObject.car) is None:
+                self._update_vin(args['vin'], args['new_vin'])
+            else:
+                # vin авто мог попасть в файл, а vin продажи - нет
+                self._move_sale_to_vin(args['vin'], args['new_vin'])
+        elif op == 'revert_sale':
+            self._revert_sale(args['sales_number'])
+            # флаг удаления мог попасть в файл, а статус авто - нет
+            if args['car_vin'] is not None:
+                self._change_status_car(args['car_vin'], CarStatus.available)
@@ -0,0 +1,369 @@
+"""Модуль для колоночного снимка БД в массивах NumPy.
+
+Снимок переводит файлы 'cars.txt', 'models.txt' и 'sales.txt' в столбцы:
+по файлу '.npy' на поле записи, которые можно отобразить в память
+(np.load(..., mmap_mode='r')). Строки хранятся байтами фиксированной
+ширины, цены - целым числом сотых (int64), даты - datetime64[us],
+статусы автомобилей - кодами из CAR_STATUS_CODES. Для продаж
+дополнительно сохраняется номер строки (с нуля) проданного автомобиля
+в столбцах автомобилей (-1, если автомобиля нет), чтобы соединение
+продаж с автомобилями и моделями не требовало поиска по vin.
+
+Поля записей в двоичном формате (версия 1) уже упакованы так, как
+их хранят столбцы, поэтому такой файл переводится в столбцы без разбора
+записей. Записи текстового формата разбираются и упаковываются
+двоичным кодеком по одной; цены точнее сотых, которые текстовый
+формат хранит как есть, при этом округляются до сотых.
+
+Агрегирующие функции (revenue_by_model, revenue_by_brand,
+revenue_by_month, average_days_to_sale) считают по столбцам без циклов
+Python по записям. NumPy - необязательная зависимость: без нее модуль
+импортируется, но его функции вызывают ImportError.
+"""
+import json
+import os
+from decimal import ROUND_HALF_EVEN, Decimal
+from typing import Union
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from instrumentation import count_read, count_write
+from models import CAR_STATUS_CODES, CarStatus, FileForObject
+from record_format import (
+    BINARY_VERSION, FIELD_FLAG, FIELD_PRICE, FIELD_STATUS, FIELD_STR, PRICE_SCALE,
+    RECORD_LAYOUTS, get_codecs
+    )
+from record_store import RecordStore
+
+# каталог снимка внутри каталога БД
+COLUMNAR_DIRECTORY = '/columnar'
+# файл с описанием снимка: сигнатуры файлов, по которым он построен
+META_FILE = 'meta.json'
+
+# названия столбцов по типам объектов в порядке полей записи
+COLUMNS = {
+    FileForObject.model: ('id', 'name', 'brand'),
+    FileForObject.car: ('vin', 'model', 'price', 'date_start', 'status'),
+    FileForObject.sale: ('number', 'car_vin', 'date', 'cost', 'is_deleted'),
+}
+# префиксы файлов столбцов по типам объектов
+PREFIXES = {
+    FileForObject.model: 'models',
+    FileForObject.car: 'cars',
+    FileForObject.sale: 'sales',
+}
+# столбцы с датами
+DATE_COLUMNS = ('cars_date_start', 'sales_date')
+# столбец с номерами строк проданных автомобилей
+SALE_CAR_COLUMN = 'sales_car'
+# ширина диапазона целых ключей, группы по которым считаются без сортировки
+DENSE_KEYS_LIMIT = 1 << 20
+# до какой суммы модулей целые суммируются через float64 без потери точности
+FLOAT_EXACT_LIMIT = 1 << 53
+
+
+def _require_numpy():
+    """Функция вызывает исключение ImportError, если NumPy не установлен."""
+    if np is None:
+        raise ImportError('Для колоночного снимка нужен пакет numpy')
+
+
+def get_record_dtype(object: FileForObject):
+    """Функция принимает один параметр:
+    - object: тип объекта.
+    Функция возвращает тип NumPy для записей двоичного формата
+    (поля без выравнивания, в том же порядке и размере, что у struct).
+    """
+    _require_numpy()
+    return np.dtype([
+        (name, f'S{width}' if kind == FIELD_STR
+         else 'u1' if kind in (FIELD_STATUS, FIELD_FLAG)
+         else '<i8')
+        for name, (kind, width) in zip(COLUMNS[object], RECORD_LAYOUTS[object])
+        ])
+
+
+def _read_records(store: RecordStore, object: FileForObject):
+    """Функция принимает два параметра:
+    - store: файл с записями;
+    - object: тип объекта.
+    Функция возвращает записи файла в виде структурированного массива
+    с типом get_record_dtype(object).
+    """
+    dtype = get_record_dtype(object)
+    count = len(store)
+    if count == 0:
+        return np.zeros(0, dtype)
+    if store.codec.version == BINARY_VERSION:
+        with open(store.path, 'rb') as file_records:
+            file_records.seek(len(store.header))
+            data = file_records.read(count * store.record_size)
+        count_read(len(data), count)
+        return np.frombuffer(data, dtype, count).copy()
+    codec = get_codecs(object)[BINARY_VERSION]
+    price_fields = [ind for ind, kind in enumerate(codec.kinds) if kind == FIELD_PRICE]
+    cent = Decimal(1) / PRICE_SCALE
+    chunks = []
+    for record in store.iter_records():
+        values = store.values(record)
+        for ind in price_fields:
+            values[ind] = values[ind].quantize(cent, ROUND_HALF_EVEN)
+        chunks.append(codec.encode(values))
+    return np.frombuffer(b''.join(chunks), dtype)
+
+
+def _save_column(directory: str, name: str, column):
+    """Функция сохраняет столбец в файл '<name>.npy', заменяя его атомарно."""
+    path = os.path.join(directory, name + '.npy')
+    tmp_path = os.path.join(directory, name + '.tmp.npy')
+    np.save(tmp_path, column)
+    count_write(column.nbytes)
+    os.replace(tmp_path, path)
+
+
+class ColumnarSnapshot:
+    """Колоночный снимок БД: столбцы по именам вида '<prefix>_<поле>'
+    (например, 'cars_price', 'sales_car').
+    """
+
+    def __init__(self, columns: dict) -> None:
+        self.columns = columns
+
+    def __getitem__(self, name: str):
+        return self.columns[name]
+
+    def __len__(self) -> int:
+        """Функция возвращает количество автомобилей в снимке."""
+        return len(self.columns['cars_vin'])
+
+
+def export_snapshot(
+        stores: dict[FileForObject, RecordStore],
+        directory: str,
+        signature: Union[dict, None] = None
+        ) -> ColumnarSnapshot:
+    """Функция принимает три параметра:
+    - stores: файлы с записями о моделях, автомобилях и продажах;
+    - directory: каталог снимка;
+    - signature: сигнатуры исходных файлов, которые записываются
+      в описание снимка (см. is_fresh).
+    Функция переводит файлы в столбцы, сохраняет их в каталог
+    и возвращает снимок.
+    Либо вызывает исключение ValueError, если значение нельзя
+    записать в столбец (например, цену точнее сотых).
+    """
+    _require_numpy()
+    os.makedirs(directory, exist_ok=True)
+    # пока столбцы заменяются, снимок считается устаревшим
+    meta_path = os.path.join(directory, META_FILE)
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+    columns = {}
+    for object, prefix in PREFIXES.items():
+        records = _read_records(stores[object], object)
+        for name in COLUMNS[object]:
+            columns[f'{prefix}_{name}'] = np.ascontiguousarray(records[name])
+    for name in DATE_COLUMNS:
+        columns[name] = columns[name].view('datetime64[us]')
+    # соединение продаж с автомобилями по vin
+    columns[SALE_CAR_COLUMN] = _lookup(columns['cars_vin'], columns['sales_car_vin'])
+    for name, column in columns.items():
+        _save_column(directory, name, column)
+    # описание записывается последним
+    tmp_path = meta_path + '.tmp'
+    with open(tmp_path, 'w') as file_meta:
+        json.dump({'columns': sorted(columns), 'signature': signature}, file_meta)
+    os.replace(tmp_path, meta_path)
+    return ColumnarSnapshot(columns)
+
+
+def is_fresh(directory: str, signature: dict) -> bool:
+    """Функция принимает два параметра:
+    - directory: каталог снимка;
+    - signature: текущие сигнатуры исходных файлов.
+    Функция проверяет, что снимок в каталоге построен по файлам
+    с такими же сигнатурами.
+    """
+    try:
+        with open(os.path.join(directory, META_FILE), 'r') as file_meta:
+            meta = json.load(file_meta)
+    except (FileNotFoundError, ValueError):
+        return False
+    # кортежи в JSON сохраняются списками
+    return meta['signature'] == json.loads(json.dumps(signature))
+
+
+def load_snapshot(directory: str, mmap: bool = True) -> ColumnarSnapshot:
+    """Функция принимает два параметра:
+    - directory: каталог снимка;
+    - mmap: отображать ли столбцы в память вместо чтения.
+    Функция возвращает снимок, сохраненный export_snapshot.
+    Либо вызывает исключение FileNotFoundError, если снимка нет.
+    """
+    _require_numpy()
+    with open(os.path.join(directory, META_FILE), 'r') as file_meta:
+        meta = json.load(file_meta)
+    return ColumnarSnapshot({
+        name: np.load(os.path.join(directory, name + '.npy'), mmap_mode='r' if mmap else None)
+        for name in meta['columns']
+        })
+
+
+def _lookup(keys, values):
+    """Функция принимает два параметра:
+    - keys: столбец с уникальными ключами;
+    - values: искомые ключи.
+    Функция возвращает для каждого искомого ключа его позицию
+    в столбце keys (int64) или -1, если ключа нет.
+    """
+    if len(keys) == 0:
+        return np.full(len(values), -1, np.int64)
+    if keys.dtype.kind in 'iu':
+        low = int(keys.min())
+        high = int(keys.max())
+        if high - low <= DENSE_KEYS_LIMIT:
+            # узкий диапазон целых ключей: позиции берутся из таблицы
+            table = np.full(high - low + 2, -1, np.int64)
+            table[keys - low] = np.arange(len(keys))
+            offsets = values.astype(np.int64) - low
+            # ключи вне диапазона попадают в последнюю ячейку с -1
+            offsets[(offsets < 0) | (offsets > high - low)] = high - low + 1
+            return table[offsets]
+    order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
+    positions = np.searchsorted(sorted_keys, values)
+    positions[positions == len(keys)] = 0
+    return np.where(sorted_keys[positions] == values, order[positions], -1).astype(np.int64)
+
+
+def _to_price(value: int) -> Decimal:
+    """Функция возвращает цену по целому числу сотых."""
+    return Decimal(int(value)).scaleb(-2)
+
+
+def _factorize(keys) -> tuple:
+    """Функция принимает один параметр:
+    - keys: целые ключи групп.
+    Функция возвращает возможные ключи групп по возрастанию и номер
+    группы каждого ключа. Если ключи лежат в узком диапазоне
+    (как id моделей или месяцы), номером служит смещение от меньшего
+    ключа и сортировка не нужна.
+    """
+    if len(keys) == 0:
+        return keys, keys.astype(np.int64)
+    low = int(keys.min())
+    high = int(keys.max())
+    if high - low <= max(DENSE_KEYS_LIMIT, len(keys)):
+        return np.arange(low, high + 1), keys - low
+    return np.unique(keys, return_inverse=True)
+
+
+def _group_sum(keys, values) -> tuple:
+    """Функция принимает два параметра:
+    - keys: целые ключи групп;
+    - values: целые значения (int64) той же длины.
+    Функция возвращает ключи непустых групп по возрастанию, количество
+    элементов и сумму значений в каждой группе.
+    """
+    groups, codes = _factorize(keys)
+    counts = np.bincount(codes, minlength=len(groups))
+    values = values.astype(np.int64)
+    if int(np.abs(values).sum()) < FLOAT_EXACT_LIMIT:
+        # суммы целых меньше 2 ** 53 в float64 считаются точно
+        sums = np.rint(np.bincount(codes, values, len(groups))).astype(np.int64)
+    else:
+        sums = np.zeros(len(groups), np.int64)
+        np.add.at(sums, codes, values)
+    present = counts > 0
+    return groups[present], counts[present], sums[present]
+
+
+def _active_sales(snapshot: ColumnarSnapshot):
+    """Функция возвращает маску неудаленных продаж существующих автомобилей."""
+    return (snapshot['sales_is_deleted'] == 0) & (snapshot[SALE_CAR_COLUMN] >= 0)
+
+
+def _sale_models(snapshot: ColumnarSnapshot, mask):
+    """Функция возвращает id моделей автомобилей продаж из маски mask."""
+    return snapshot['cars_model'][snapshot[SALE_CAR_COLUMN][mask]]
+
+
+def revenue_by_model(snapshot: ColumnarSnapshot) -> dict[int, tuple[int, Decimal]]:
+    """Функция принимает один параметр:
+    - snapshot: колоночный снимок.
+    Функция возвращает для каждого id модели количество неудаленных
+    продаж и их суммарную стоимость.
+    """
+    _require_numpy()
+    mask = _active_sales(snapshot)
+    keys, counts, sums = _group_sum(_sale_models(snapshot, mask), snapshot['sales_cost'][mask])
+    return {
+        int(key): (int(count), _to_price(total))
+        for key, count, total in zip(keys, counts, sums)
+        }
+
+
+def revenue_by_brand(snapshot: ColumnarSnapshot) -> dict[str, tuple[int, Decimal]]:
+    """Функция принимает один параметр:
+    - snapshot: колоночный снимок.
+    Функция возвращает для каждой марки количество неудаленных продаж
+    и их суммарную стоимость. Продажи автомобилей неизвестных моделей
+    не учитываются.
+    """
+    _require_numpy()
+    mask = _active_sales(snapshot)
+    # марки нумеруются по небольшой таблице моделей, а продажи
+    # соединяются с моделями по id
+    brands, brand_codes = np.unique(snapshot['models_brand'], return_inverse=True)
+    models = _lookup(snapshot['models_id'], _sale_models(snapshot, mask))
+    found = models >= 0
+    keys, counts, sums = _group_sum(
+        brand_codes[models[found]],
+        snapshot['sales_cost'][mask][found]
+        )
+    return {
+        brands[key].decode(): (int(count), _to_price(total))
+        for key, count, total in zip(keys, counts, sums)
+        }
+
+
+def revenue_by_month(snapshot: ColumnarSnapshot) -> dict[str, tuple[int, Decimal]]:
+    """Функция принимает один параметр:
+    - snapshot: колоночный снимок.
+    Функция возвращает для каждого месяца продажи (в виде 'ГГГГ-ММ')
+    количество неудаленных продаж и их суммарную стоимость.
+    """
+    _require_numpy()
+    mask = _active_sales(snapshot)
+    months = snapshot['sales_date'][mask].astype('datetime64[M]').astype(np.int64)
+    keys, counts, sums = _group_sum(months, snapshot['sales_cost'][mask])
+    return {
+        str(np.datetime64(int(key), 'M')): (int(count), _to_price(total))
+        for key, count, total in zip(keys, counts, sums)
+        }
+
+
+def average_days_to_sale(snapshot: ColumnarSnapshot) -> Union[float, None]:
+    """Функция принимает один параметр:
+    - snapshot: колоночный снимок.
+    Функция возвращает среднее время от поступления автомобиля
+    до неудаленной продажи в днях.
+    Либо возвращает None, если продаж нет.
+    """
+    _require_numpy()
+    mask = _active_sales(snapshot)
+    if not mask.any():
+        return None
+    started = snapshot['cars_date_start'][snapshot[SALE_CAR_COLUMN][mask]]
+    elapsed = (snapshot['sales_date'][mask] - started).astype(np.int64)
+    return float(elapsed.mean()) / 86_400_000_000
+
+
+def status_counts(snapshot: ColumnarSnapshot) -> dict[CarStatus, int]:
+    """Функция возвращает количество автомобилей каждого статуса."""
+    _require_numpy()
+    counts = np.bincount(snapshot['cars_status'], minlength=len(CAR_STATUS_CODES))
+    return {status: int(counts[code]) for status, code in CAR_STATUS_CODES.items()}
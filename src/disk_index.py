@@ -0,0 +1,314 @@
+"""Модуль для работы с файлами индексов фиксированной ширины.
+
+Каждая запись индекса занимает одинаковое число байт: идентификатор,
+дополненный пробелами до ширины ключа, ';', номер строки, дополненный
+пробелами до LINE_NUMBER_WIDTH символов, и '\\n'. Запись с номером N
+начинается со смещения N * ширина записи, поэтому по файлу можно искать
+бинарным поиском через pread, не читая его целиком. Файлы индекса
+не меняются на месте: они только записываются целиком и заменяют
+прежние (write_entries), а вставки и удаления ведет lsm_index.py.
+"""
+import os
+import threading
+from datetime import UTC, datetime
+from decimal import ROUND_FLOOR, Decimal
+from typing import Iterable, Iterator, Union
+
+from instrumentation import count_open, count_read, count_write
+from models import FileIndexForObject
+
+LINE_NUMBER_WIDTH = 10
+
+# ключи индексов по дате поступления и по цене автомобиля: значение
+# в виде строки, порядок которой совпадает с порядком значений,
+# и номер строки авто (чтобы ключи одинаковых значений различались)
+DATE_KEY_WIDTH = 20
+PRICE_KEY_WIDTH = 22
+# цена в ключе хранится целым числом миллионных долей (с округлением вниз)
+PRICE_KEY_SCALE = 10 ** 6
+
+INDEX_KEY_WIDTH = {
+    FileIndexForObject.car: 24,
+    FileIndexForObject.model: 20,
+    FileIndexForObject.sale: 48,
+    FileIndexForObject.sale_by_car: 24,
+    FileIndexForObject.car_date: DATE_KEY_WIDTH + LINE_NUMBER_WIDTH,
+    FileIndexForObject.car_price: PRICE_KEY_WIDTH + LINE_NUMBER_WIDTH,
+    # дата продажи и номер продажи
+    FileIndexForObject.sale_date: DATE_KEY_WIDTH + 48,
+}
+
+
+def to_naive_utc(value: datetime) -> datetime:
+    """Функция возвращает дату без часового пояса: дата с часовым
+    поясом переводится в UTC.
+    """
+    if value.tzinfo is None:
+        return value
+    return value.astimezone(UTC).replace(tzinfo=None)
+
+
+def encode_date(value: datetime) -> str:
+    """Функция принимает один параметр:
+    - value: дата.
+    Функция возвращает дату в виде строки из DATE_KEY_WIDTH цифр,
+    которые сравниваются как строки в том же порядке, что и даты.
+    """
+    value = to_naive_utc(value)
+    return (f'{value.year:04d}{value.month:02d}{value.day:02d}'
+            f'{value.hour:02d}{value.minute:02d}{value.second:02d}'
+            f'{value.microsecond:06d}')
+
+
+def encode_price(value: Decimal) -> str:
+    """Функция принимает один параметр:
+    - value: цена.
+    Функция возвращает цену в виде строки из PRICE_KEY_WIDTH символов,
+    которые сравниваются как строки в том же порядке, что и цены
+    (цены, отличающиеся меньше чем на 1 / PRICE_KEY_SCALE, могут
+    получить одинаковую строку).
+    Либо вызывает исключение ValueError, если цена слишком велика.
+    """
+    scaled = int((Decimal(value) * PRICE_KEY_SCALE).to_integral_value(ROUND_FLOOR))
+    digits = PRICE_KEY_WIDTH - 1
+    if abs(scaled) >= 10 ** digits:
+        raise ValueError(f'Цену {value} нельзя записать в индекс')
+    # отрицательные цены идут раньше положительных и хранятся
+    # дополнением, чтобы большая по модулю цена шла раньше
+    if scaled < 0:
+        return '0' + str(10 ** digits + scaled).zfill(digits)
+    return '1' + str(scaled).zfill(digits)
+
+
+def sale_date_key(sales_date: datetime, sales_number: str) -> str:
+    """Функция возвращает ключ индекса продаж по дате: дату продажи
+    и номер продажи (чтобы ключи продаж одного дня различались и не
+    зависели от места продажи в файле).
+    """
+    return encode_date(sales_date) + sales_number
+
+
+def range_key(value_key: str, line_number: int) -> str:
+    """Функция возвращает ключ индекса по дате или цене из строки
+    значения и номера строки (с единицы) авто.
+    """
+    return value_key + str(line_number).zfill(LINE_NUMBER_WIDTH)
+
+
+def get_entry_size(object: FileIndexForObject) -> int:
+    """Функция возвращает размер одной записи индекса object в байтах."""
+    return INDEX_KEY_WIDTH[object] + LINE_NUMBER_WIDTH + 2
+
+
+def check_key(object: FileIndexForObject, key: Union[int, str]):
+    """Функция принимает два параметра:
+    - object: тип объекта, в индекс которого записывается ключ;
+    - key: идентификатор объекта.
+    Функция вызывает исключение ValueError, если идентификатор
+    не помещается в запись индекса или содержит ';' или перевод строки.
+    """
+    text = str(key)
+    if (len(text.encode()) > INDEX_KEY_WIDTH[object]
+            or ';' in text or '\n' in text):
+        raise ValueError(
+            f'Идентификатор {text!r} нельзя записать в индекс {object}'
+            )
+
+
+def format_entry(
+        object: FileIndexForObject,
+        key: Union[int, str],
+        line_number: int
+        ) -> bytes:
+    """Функция принимает три параметра:
+    - object: тип объекта;
+    - key: идентификатор объекта;
+    - line_number: номер строки (с единицы) с информацией об объекте.
+    Функция возвращает запись индекса фиксированной ширины.
+    """
+    check_key(object, key)
+    # ширина ключа считается в байтах: в UTF-8 символ бывает длиннее байта
+    key_width = INDEX_KEY_WIDTH[object]
+    return (str(key).encode().ljust(key_width) + b';'
+            + str(line_number).ljust(LINE_NUMBER_WIDTH).encode() + b'\n')
+
+
+def parse_entry(object: FileIndexForObject, entry: bytes) -> tuple:
+    """Функция принимает два параметра:
+    - object: тип объекта;
+    - entry: запись индекса фиксированной ширины.
+    Функция возвращает пару (идентификатор, номер строки с единицы).
+    """
+    key_width = INDEX_KEY_WIDTH[object]
+    key = entry[:key_width].rstrip().decode()
+    line_number = int(entry[key_width + 1:])
+    if object == FileIndexForObject.model:
+        return int(key), line_number
+    return key, line_number
+
+
+def is_fixed_width(path: str, object: FileIndexForObject) -> bool:
+    """Функция принимает два параметра:
+    - path: путь до файла с индексами;
+    - object: тип объекта.
+    Функция проверяет, что файл записан в формате фиксированной ширины,
+    а не в прежнем формате 'ключ;строка' переменной длины.
+    Либо вызывает исключение FileNotFoundError, если файл не найден.
+    """
+    entry_size = get_entry_size(object)
+    key_width = INDEX_KEY_WIDTH[object]
+    with open(path, 'rb') as file_index:
+        count_open()
+        first_entry = file_index.read(entry_size)
+        size = os.fstat(file_index.fileno()).st_size
+    count_read(len(first_entry), 1)
+    if size == 0:
+        return True
+    return (size % entry_size == 0
+            and first_entry[-1:] == b'\n'
+            and first_entry[key_width:key_width + 1] == b';')
+
+
+def read_entries(path: str, object: FileIndexForObject) -> Iterator[tuple]:
+    """Функция принимает два параметра:
+    - path: путь до файла с индексами;
+    - object: тип объекта.
+    Функция по одной возвращает пары (идентификатор, номер строки)
+    в порядке их расположения в файле. Понимает и прежний формат
+    'ключ;строка' переменной длины.
+    Либо вызывает исключение FileNotFoundError, если файл не найден.
+    """
+    key_type = int if object == FileIndexForObject.model else str
+    with open(path, 'r') as file_index:
+        count_open()
+        for line in file_index:
+            count_read(len(line), 1)
+            key, line_number = line.split(';')
+            yield key_type(key.rstrip()), int(line_number)
+
+
+def get_tmp_path(path: str) -> str:
+    """Функция принимает один параметр:
+    - path: путь до файла, который нужно заменить.
+    Функция возвращает путь до временного файла рядом с path,
+    свой для каждого процесса и потока.
+    """
+    return f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+
+
+def write_entries(
+        path: str,
+        object: FileIndexForObject,
+        entries: Iterable[tuple]
+        ):
+    """Функция принимает три параметра:
+    - path: путь до файла с индексами;
+    - object: тип объекта;
+    - entries: отсортированные пары (идентификатор, номер строки).
+    Функция записывает индекс в формате фиксированной ширины во временный
+    файл и заменяет им файл с индексами, поэтому entries можно читать
+    из заменяемого файла.
+    """
+    tmp_path = get_tmp_path(path)
+    with open(tmp_path, 'wb') as file_index:
+        count_open()
+        buffer = []
+        for key, line_number in entries:
+            buffer.append(format_entry(object, key, line_number))
+            if len(buffer) >= 4096:
+                count_write(file_index.write(b''.join(buffer)))
+                buffer.clear()
+        count_write(file_index.write(b''.join(buffer)))
+    os.replace(tmp_path, path)
+
+
+def _find_position(
+        fd: int,
+        object: FileIndexForObject,
+        key: Union[int, str]
+        ) -> tuple[int, Union[int, None]]:
+    """Функция принимает три параметра:
+    - fd: дескриптор открытого файла с индексами;
+    - object: тип объекта;
+    - key: искомый идентификатор.
+    Функция бинарным поиском по записям файла находит позицию,
+    на которой стоит или должен стоять идентификатор key.
+    Возвращает пару (позиция, номер строки), где номер строки
+    равен None, если идентификатора в индексе нет.
+    """
+    entry_size = get_entry_size(object)
+    left = 0
+    right = os.fstat(fd).st_size // entry_size
+    while left < right:
+        mid = (left + right) // 2
+        mid_key, line_number = parse_entry(
+            object,
+            os.pread(fd, entry_size, mid * entry_size)
+            )
+        count_read(entry_size, 1)
+        if mid_key == key:
+            return mid, line_number
+        if mid_key < key:
+            left = mid + 1
+        else:
+            right = mid
+    return left, None
+
+
+def search(
+        path: str,
+        object: FileIndexForObject,
+        key: Union[int, str]
+        ) -> Union[int, None]:
+    """Функция принимает три параметра:
+    - path: путь до файла с индексами фиксированной ширины;
+    - object: тип объекта;
+    - key: искомый идентификатор.
+    Функция за O(log n) чтений находит номер строки (с единицы)
+    объекта с идентификатором key.
+    Либо возвращает None, если такого идентификатора нет.
+    Либо вызывает исключение FileNotFoundError, если файл не найден.
+    """
+    fd = os.open(path, os.O_RDONLY)
+    count_open()
+    try:
+        return _find_position(fd, object, key)[1]
+    finally:
+        os.close(fd)
+
+
+def iter_entries_after(
+        path: str,
+        object: FileIndexForObject,
+        key: Union[int, str, None] = None,
+        chunk_entries: int = 1024
+        ) -> Iterator[tuple]:
+    """Функция принимает четыре параметра:
+    - path: путь до файла с индексами фиксированной ширины;
+    - object: тип объекта;
+    - key: идентификатор, после которого начинать (None - с начала);
+    - chunk_entries: сколько записей читать за одно обращение к файлу.
+    Функция бинарным поиском находит первую запись с идентификатором
+    больше key и по порядку возвращает пары (идентификатор, номер строки),
+    читая файл блоками по chunk_entries записей.
+    Либо вызывает исключение FileNotFoundError, если файл не найден.
+    """
+    entry_size = get_entry_size(object)
+    fd = os.open(path, os.O_RDONLY)
+    count_open()
+    try:
+        position = 0
+        if key is not None:
+            position, found = _find_position(fd, object, key)
+            if found is not None:
+                position += 1
+        while True:
+            chunk = os.pread(fd, chunk_entries * entry_size, position * entry_size)
+            if len(chunk) < entry_size:
+                return
+            count_read(len(chunk), len(chunk) // entry_size)
+            for offset in range(0, len(chunk) - entry_size + 1, entry_size):
+                yield parse_entry(object, chunk[offset:offset + entry_size])
+            position += len(chunk) // entry_size
+    finally:
+        os.close(fd)
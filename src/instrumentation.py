@@ -0,0 +1,189 @@
+"""Модуль для сбора статистики операций CarService.
+
+Модули, работающие с файлами (record_store, disk_index и другие),
+сообщают об открытиях файлов, прочитанных и записанных байтах
+и просмотренных записях функциями count_open, count_read и count_write.
+Счетчики ведутся отдельно для каждого потока, поэтому операции,
+выполняющиеся в разных потоках, не смешивают свои счетчики.
+
+Методы CarService, помеченные декоратором instrumented, запоминают
+в ServiceStats количество вызовов, время выполнения (суммарное,
+наибольшее и гистограмму) и разницу счетчиков потока за время вызова.
+Время и счетчики вложенного вызова учитываются и во внешнем.
+
+К внешней операции (вызванной не из другого помеченного метода) можно
+подключить обработчик: функцию hook(operation, call), которая должна
+вызвать call() и вернуть его результат, например ProfileHook
+для cProfile. Без обработчика его проверка стоит одно сравнение.
+"""
+import cProfile
+import functools
+import pstats
+import threading
+from time import perf_counter_ns
+from typing import Callable, Union
+
+from models import OperationStats
+
+# количество корзин гистограммы: в корзине i время вызова меньше
+# 2 ** i микросекунд, в последней - все более долгие вызовы
+HISTOGRAM_BUCKETS = 24
+
+_local = threading.local()
+
+
+def _get_counters() -> list[int]:
+    """Функция возвращает счетчики текущего потока: открытия файлов,
+    прочитанные байты, записанные байты, просмотренные записи.
+    """
+    try:
+        return _local.counters
+    except AttributeError:
+        _local.counters = [0, 0, 0, 0]
+        _local.depth = 0
+        return _local.counters
+
+
+def count_open(count: int = 1):
+    """Функция учитывает count открытий файлов."""
+    _get_counters()[0] += count
+
+
+def count_read(size: int, records: int = 0):
+    """Функция принимает два параметра:
+    - size: количество прочитанных байт;
+    - records: количество просмотренных записей.
+    Функция учитывает чтение в счетчиках текущего потока.
+    """
+    counters = _get_counters()
+    counters[1] += size
+    counters[3] += records
+
+
+def count_write(size: int):
+    """Функция учитывает запись size байт."""
+    _get_counters()[2] += size
+
+
+class ServiceStats:
+    """Статистика вызовов операций одного экземпляра CarService."""
+
+    def __init__(self, hook: Union[Callable, None] = None) -> None:
+        # обработчик внешних операций или None
+        self.hook = hook
+        self._lock = threading.Lock()
+        # операция -> [вызовы, ошибки, суммарное время, наибольшее время,
+        # гистограмма, открытия, прочитано, записано, записей]
+        self._operations: dict[str, list] = {}
+
+    def call(self, operation: str, func: Callable, *args, **kwargs):
+        """Функция принимает параметры:
+        - self: экземпляр класса ServiceStats;
+        - operation: название операции;
+        - func, args, kwargs: функция и ее аргументы.
+        Функция вызывает func, передав вызов обработчику, если операция
+        внешняя и обработчик задан, и учитывает вызов в статистике.
+        Возвращает результат func.
+        """
+        counters = _get_counters()
+        opens, read, written, scanned = counters
+        _local.depth += 1
+        failed = True
+        started = perf_counter_ns()
+        try:
+            if self.hook is not None and _local.depth == 1:
+                result = self.hook(operation, functools.partial(func, *args, **kwargs))
+            else:
+                result = func(*args, **kwargs)
+            failed = False
+            return result
+        finally:
+            elapsed = perf_counter_ns() - started
+            _local.depth -= 1
+            bucket = (elapsed // 1000).bit_length()
+            if bucket >= HISTOGRAM_BUCKETS:
+                bucket = HISTOGRAM_BUCKETS - 1
+            with self._lock:
+                stats = self._operations.get(operation)
+                if stats is None:
+                    stats = [0, 0, 0, 0, [0] * HISTOGRAM_BUCKETS, 0, 0, 0, 0]
+                    self._operations[operation] = stats
+                stats[0] += 1
+                stats[1] += failed
+                stats[2] += elapsed
+                if elapsed > stats[3]:
+                    stats[3] = elapsed
+                stats[4][bucket] += 1
+                stats[5] += counters[0] - opens
+                stats[6] += counters[1] - read
+                stats[7] += counters[2] - written
+                stats[8] += counters[3] - scanned
+
+    def snapshot(self) -> dict[str, OperationStats]:
+        """Функция возвращает копию статистики по названиям операций."""
+        with self._lock:
+            return {
+                operation: OperationStats(
+                    calls=stats[0],
+                    errors=stats[1],
+                    total_ms=stats[2] / 1_000_000,
+                    max_ms=stats[3] / 1_000_000,
+                    latency_histogram=list(stats[4]),
+                    file_opens=stats[5],
+                    bytes_read=stats[6],
+                    bytes_written=stats[7],
+                    records_scanned=stats[8],
+                    )
+                for operation, stats in sorted(self._operations.items())
+                }
+
+    def reset(self):
+        """Функция обнуляет статистику."""
+        with self._lock:
+            self._operations.clear()
+
+
+def instrumented(func: Callable) -> Callable:
+    """Функция-декоратор для методов CarService: вызовы метода
+    учитываются в статистике экземпляра под именем метода.
+    """
+    operation = func.__name__
+
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        return self._stats.call(operation, func, self, *args, **kwargs)
+    return wrapper
+
+
+class ProfileHook:
+    """Обработчик операций, профилирующий их через cProfile.
+
+    Для каждой операции ведется свой профиль, который можно получить
+    методом get_stats.
+    """
+
+    def __init__(self) -> None:
+        self.profiles: dict[str, cProfile.Profile] = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, operation: str, call: Callable):
+        """Функция выполняет call под профилировщиком операции."""
+        # cProfile нельзя включить одновременно в нескольких потоках
+        with self._lock:
+            profile = self.profiles.get(operation)
+            if profile is None:
+                profile = cProfile.Profile()
+                self.profiles[operation] = profile
+            return profile.runcall(call)
+
+    def get_stats(self, operation: str) -> Union[pstats.Stats, None]:
+        """Функция принимает два параметра:
+        - self: экземпляр класса ProfileHook;
+        - operation: название операции.
+        Функция возвращает профиль операции для вывода или сохранения.
+        Либо возвращает None, если операция не вызывалась.
+        """
+        profile = self.profiles.get(operation)
+        if profile is None:
+            return None
+        return pstats.Stats(profile)
@@ -0,0 +1,124 @@
+"""Модуль для блокировок файлов БД между потоками и процессами.
+
+На каждый тип объекта (модели, автомобили, продажи) приходится одна
+блокировка чтения-записи: читатели работают параллельно, писатель
+работает один. Между потоками одного процесса блокировку обеспечивает
+threading.Condition, между процессами - fcntl.flock на файле
+'<файл с данными>.lock' рядом с файлом с данными. Несколько блокировок
+всегда берутся в порядке LOCK_ORDER, поэтому взаимных блокировок нет.
+"""
+import fcntl
+import os
+import threading
+from contextlib import ExitStack, contextmanager
+from typing import Iterable
+
+from models import FileForObject
+
+# порядок, в котором берутся блокировки
+LOCK_ORDER = (FileForObject.model, FileForObject.car, FileForObject.sale)
+
+
+class ReadWriteLock:
+    """Блокировка чтения-записи для потоков и процессов.
+
+    Поток, который держит блокировку записи, может повторно взять
+    блокировку записи или чтения. Повысить блокировку чтения до
+    блокировки записи нельзя.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._condition = threading.Condition()
+        self._readers = 0
+        self._writer = None
+        self._writer_depth = 0
+        self._fd = None
+        self._pid = None
+
+    def _get_fd(self) -> int:
+        """Функция принимает один параметр:
+        - self: экземпляр класса ReadWriteLock.
+        Функция возвращает дескриптор файла блокировки. После fork
+        файл открывается заново, чтобы блокировки процессов не делили
+        одно открытое описание файла.
+        """
+        if self._pid != os.getpid():
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            self._pid = os.getpid()
+        return self._fd
+
+    @contextmanager
+    def read(self):
+        """Функция-контекст берет блокировку чтения."""
+        if self._writer == threading.get_ident():
+            yield
+            return
+        with self._condition:
+            while self._writer is not None:
+                self._condition.wait()
+            if self._readers == 0:
+                fcntl.flock(self._get_fd(), fcntl.LOCK_SH)
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._readers -= 1
+                if self._readers == 0:
+                    fcntl.flock(self._fd, fcntl.LOCK_UN)
+                    self._condition.notify_all()
+
+    @contextmanager
+    def write(self):
+        """Функция-контекст берет блокировку записи."""
+        thread_id = threading.get_ident()
+        with self._condition:
+            if self._writer != thread_id:
+                while self._writer is not None or self._readers > 0:
+                    self._condition.wait()
+                fcntl.flock(self._get_fd(), fcntl.LOCK_EX)
+                self._writer = thread_id
+            self._writer_depth += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._writer_depth -= 1
+                if self._writer_depth == 0:
+                    fcntl.flock(self._fd, fcntl.LOCK_UN)
+                    self._writer = None
+                    self._condition.notify_all()
+
+
+class LockManager:
+    """Блокировки файлов одной БД по типам объектов."""
+
+    def __init__(self, root_directory_path: str) -> None:
+        self._locks = {
+            object: ReadWriteLock(root_directory_path + object + '.lock')
+            for object in LOCK_ORDER
+            }
+
+    @contextmanager
+    def locked(
+            self,
+            read: Iterable[FileForObject] = (),
+            write: Iterable[FileForObject] = ()
+            ):
+        """Функция принимает три параметра:
+        - self: экземпляр класса LockManager;
+        - read: типы объектов, файлы которых только читаются;
+        - write: типы объектов, файлы которых меняются.
+        Функция-контекст в порядке LOCK_ORDER берет блокировки записи
+        для write и блокировки чтения для остальных типов из read.
+        """
+        read = set(read)
+        write = set(write)
+        with ExitStack() as stack:
+            for object in LOCK_ORDER:
+                if object in write:
+                    stack.enter_context(self._locks[object].write())
+                elif object in read:
+                    stack.enter_context(self._locks[object].read())
+            yield
@@ -0,0 +1,94 @@
+"""Модуль для кэша с вытеснением давно не использованных записей (LRU).
+
+Кэш хранит не больше maxsize записей; при добавлении записи сверх
+этого предела вытесняется запись, к которой дольше всего не обращались.
+Счетчики попаданий, промахов и вытеснений помогают подобрать размер.
+"""
+import threading
+from collections import OrderedDict
+from typing import Any, Hashable
+
+from models import CacheStats
+
+# значение, которым get сообщает о промахе
+MISSING = object()
+
+
+class LruCache:
+    """Ограниченный по размеру кэш, которым можно пользоваться
+    из нескольких потоков. При maxsize, равном 0, кэш ничего не хранит.
+    """
+
+    def __init__(self, maxsize: int) -> None:
+        if maxsize < 0:
+            raise ValueError('Размер кэша не может быть отрицательным')
+        self.maxsize = maxsize
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable) -> Any:
+        """Функция принимает два параметра:
+        - self: экземпляр класса LruCache;
+        - key: ключ записи.
+        Функция возвращает значение записи и отмечает обращение к ней.
+        Либо возвращает MISSING, если записи нет.
+        """
+        if self.maxsize == 0:
+            return MISSING
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return MISSING
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value: Any):
+        """Функция принимает три параметра:
+        - self: экземпляр класса LruCache;
+        - key: ключ записи;
+        - value: значение записи.
+        Функция добавляет или заменяет запись и, если записей стало
+        больше maxsize, вытесняет самую давно использованную.
+        """
+        if self.maxsize == 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key: Hashable):
+        """Функция удаляет запись с ключом key, если она есть."""
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        """Функция удаляет все записи, не обнуляя счетчики."""
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> CacheStats:
+        """Функция возвращает счетчики и текущий размер кэша."""
+        with self._lock:
+            return CacheStats(
+                hits=self.hits,
+                misses=self.misses,
+                evictions=self.evictions,
+                size=len(self._data),
+                maxsize=self.maxsize,
+                )
+
+    def reset_stats(self):
+        """Функция обнуляет счетчики."""
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
@@ -0,0 +1,383 @@
+"""Модуль для индекса, организованного как LSM-дерево.
+
+Новые записи индекса попадают в таблицу в памяти (memtable) и дописываются
+в журнал '<индекс>.memtable', чтобы их видели другие процессы и чтобы они
+пережили перезапуск. Когда в таблице набирается memtable_limit записей,
+она сбрасывается в неизменяемый отсортированный файл '<индекс>.run.<N>'
+в формате фиксированной ширины, а журнал очищается. Список файлов
+хранится в '<индекс>.runs' от старых к новым. Удаление записывается как
+запись-надгробие с номером строки 0 (настоящие номера строк начинаются
+с единицы).
+
+Файлы индекса не меняются на месте: в журнал только дописываются записи,
+а основной файл, файлы, их список и очищенный журнал записываются заново
+и заменяют прежние через os.replace. Поэтому читатель, открывший файл
+раньше, дочитывает прежнее содержимое.
+
+Поиск идет по таблице в памяти, затем по файлам от новых к старым
+и в конце по основному файлу индекса.
+
+Файлы сливаются по уровням: файл с не больше чем memtable_limit *
+max_runs ** L записями относится к уровню L. Когда последние max_runs
+файлов оказываются на одном уровне, они сливаются в один файл
+следующего уровня (надгробия сохраняются, ведь старые записи о тех же
+идентификаторах могут лежать в более старых файлах). Основной файл
+индекса переписывается, только если сливаются все файлы и записей в них
+не меньше чем 1 / max_runs от основного файла; тогда надгробия
+отбрасываются. Поэтому каждая запись переписывается O(log n) раз
+(по разу на уровень), а переписывание основного файла окупается
+вставками, накопленными с прошлого раза: в среднем на вставку
+приходится O(max_runs * log n) записанных записей индекса, а не O(n).
+Файлов при этом не больше (max_runs - 1) на уровень, то есть
+O(max_runs * log n). Слияние всех файлов с основным файлом (merge)
+можно выполнить и по запросу.
+"""
+import heapq
+import os
+from typing import Iterable, Iterator, Union
+
+import disk_index
+from instrumentation import count_open, count_read, count_write
+from models import FileIndexForObject
+
+# номер строки, которым помечается удаленный идентификатор
+TOMBSTONE = 0
+
+
+def _with_age(entries: Iterable[tuple], age: int) -> Iterator[tuple]:
+    """Функция по одной возвращает тройки (идентификатор, возраст,
+    номер строки) для пар entries: при слиянии из записей об одном
+    идентификаторе берется запись с меньшим возрастом (более новая).
+    """
+    for key, line_number in entries:
+        yield key, age, line_number
+
+
+class LsmIndex:
+    """Индекс одного типа объектов в виде LSM-дерева."""
+
+    def __init__(
+            self,
+            path: str,
+            object: FileIndexForObject,
+            memtable_limit: int = 1024,
+            max_runs: int = 8
+            ) -> None:
+        self.path = path
+        self.object = object
+        self.memtable_limit = memtable_limit
+        # сколько файлов одного уровня сливаются в файл следующего уровня
+        self.max_runs = max(max_runs, 2)
+        self._memtable: dict = {}
+        self._runs: list[str] = []
+        # сигнатуры журнала и списка файлов, по которым они были прочитаны
+        self._signature = None
+
+    def _get_signature(self) -> tuple:
+        """Функция возвращает сигнатуры журнала таблицы и списка файлов."""
+        signature = []
+        for path in (self.path + '.memtable', self.path + '.runs'):
+            try:
+                stat = os.stat(path)
+                signature.append((stat.st_ino, stat.st_size, stat.st_mtime_ns))
+            except FileNotFoundError:
+                signature.append(None)
+        return tuple(signature)
+
+    def _refresh(self):
+        """Функция принимает один параметр:
+        - self: экземпляр класса LsmIndex.
+        Функция заново читает журнал таблицы и список файлов,
+        если их изменил другой процесс или другой экземпляр.
+        """
+        signature = self._get_signature()
+        if signature == self._signature:
+            return
+        memtable = {}
+        if signature[0] is not None:
+            entry_size = disk_index.get_entry_size(self.object)
+            with open(self.path + '.memtable', 'rb') as file_memtable:
+                count_open()
+                data = file_memtable.read()
+            count_read(len(data), len(data) // entry_size)
+            # запись, недописанная при сбое, пропускается
+            for offset in range(0, len(data) - entry_size + 1, entry_size):
+                key, line_number = disk_index.parse_entry(
+                    self.object, data[offset:offset + entry_size])
+                memtable[key] = line_number
+        runs = []
+        if signature[1] is not None:
+            directory = os.path.dirname(self.path)
+            with open(self.path + '.runs', 'r') as file_runs:
+                count_open()
+                runs = [os.path.join(directory, line.rstrip('\n'))
+                        for line in file_runs if line.strip()]
+        self._memtable = memtable
+        self._runs = runs
+        self._signature = signature
+
+    def _save_runs(self, runs: list[str]):
+        """Функция принимает два параметра:
+        - self: экземпляр класса LsmIndex;
+        - runs: пути до файлов от старых к новым.
+        Функция заменяет список файлов (в нем хранятся имена файлов
+        без каталога).
+        """
+        tmp_path = disk_index.get_tmp_path(self.path + '.runs')
+        with open(tmp_path, 'w') as file_runs:
+            file_runs.writelines(f'{os.path.basename(run)}\n' for run in runs)
+        os.replace(tmp_path, self.path + '.runs')
+        self._runs = runs
+
+    def _clear_memtable(self):
+        """Функция заменяет журнал таблицы в памяти пустым файлом."""
+        tmp_path = disk_index.get_tmp_path(self.path + '.memtable')
+        open(tmp_path, 'wb').close()
+        count_open()
+        os.replace(tmp_path, self.path + '.memtable')
+
+    def paths(self) -> list[str]:
+        """Функция возвращает пути до всех файлов индекса."""
+        self._refresh()
+        return [self.path, self.path + '.memtable', self.path + '.runs', *self._runs]
+
+    def exists(self) -> bool:
+        """Функция проверяет, что в индексе есть основной файл
+        или еще не слитые записи.
+        """
+        self._refresh()
+        return bool(os.path.exists(self.path) or self._runs or self._memtable)
+
+    def entries_count(self) -> int:
+        """Функция возвращает количество записей во всех файлах индекса
+        и в таблице в памяти (вместе с надгробиями и устаревшими записями).
+        """
+        self._refresh()
+        return len(self._memtable) + sum(
+            self._entries_count(path) for path in [self.path, *self._runs])
+
+    def get(self, key: Union[int, str]) -> Union[int, None]:
+        """Функция принимает два параметра:
+        - self: экземпляр класса LsmIndex;
+        - key: идентификатор объекта.
+        Функция возвращает номер строки (с единицы) объекта, находя
+        самую новую запись о key: в таблице в памяти, затем в файлах
+        от новых к старым, затем в основном файле индекса.
+        Либо возвращает None, если объекта нет или он удален.
+        """
+        self._refresh()
+        line_number = self._memtable.get(key)
+        if line_number is None:
+            for path in [*reversed(self._runs), self.path]:
+                try:
+                    line_number = disk_index.search(path, self.object, key)
+                except FileNotFoundError:
+                    continue
+                if line_number is not None:
+                    break
+        if line_number == TOMBSTONE:
+            return None
+        return line_number
+
+    def put_many(self, entries: Iterable[tuple]):
+        """Функция принимает два параметра:
+        - self: экземпляр класса LsmIndex;
+        - entries: пары (идентификатор, номер строки с единицы), номер
+          строки TOMBSTONE удаляет идентификатор.
+        Функция дописывает записи в журнал таблицы и в таблицу в памяти.
+        Если таблица заполнена, она сбрасывается в новый файл.
+        """
+        entries = list(entries)
+        if not entries:
+            return
+        self._refresh()
+        data = b''.join(
+            disk_index.format_entry(self.object, key, line_number)
+            for key, line_number in entries
+            )
+        fd = os.open(self.path + '.memtable', os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        count_open()
+        try:
+            # запись, недописанная при сбое, отрезается, чтобы новые
+            # записи начинались с границы записи
+            size = os.fstat(fd).st_size
+            torn = size % disk_index.get_entry_size(self.object)
+            if torn:
+                os.ftruncate(fd, size - torn)
+            count_write(os.write(fd, data))
+        finally:
+            os.close(fd)
+        self._memtable.update(entries)
+        self._signature = self._get_signature()
+        if len(self._memtable) >= self.memtable_limit:
+            self.flush()
+
+    def put(self, key: Union[int, str], line_number: int):
+        """Функция записывает номер строки (с единицы) объекта key."""
+        self.put_many([(key, line_number)])
+
+    def delete(self, key: Union[int, str]):
+        """Функция записывает надгробие для идентификатора key."""
+        self.put_many([(key, TOMBSTONE)])
+
+    def flush(self):
+        """Функция принимает один параметр:
+        - self: экземпляр класса LsmIndex.
+        Функция сбрасывает таблицу в памяти в новый отсортированный
+        файл и очищает журнал таблицы, а затем сливает файлы по уровням
+        (см. описание модуля).
+        """
+        self._refresh()
+        if not self._memtable:
+            return
+        run = self._new_run_path()
+        disk_index.write_entries(run, self.object, sorted(self._memtable.items()))
+        self._save_runs(self._runs + [run])
+        # журнал очищается только после записи файла: при сбое между
+        # ними записи окажутся и в файле, и в журнале, что не страшно
+        self._clear_memtable()
+        self._memtable = {}
+        self._signature = self._get_signature()
+        self._merge_levels()
+
+    def _new_run_path(self) -> str:
+        """Функция возвращает путь до следующего по номеру файла."""
+        number = 1 + max(
+            (int(run.rsplit('.', 1)[1]) for run in self._runs),
+            default=0
+            )
+        return f'{self.path}.run.{number}'
+
+    def _entries_count(self, path: str) -> int:
+        """Функция возвращает количество записей в файле path
+        (0, если файла нет).
+        """
+        try:
+            return os.path.getsize(path) // disk_index.get_entry_size(self.object)
+        except FileNotFoundError:
+            return 0
+
+    def _level(self, run: str) -> int:
+        """Функция возвращает уровень файла run (см. описание модуля)."""
+        entries = self._entries_count(run)
+        level = 0
+        capacity = max(self.memtable_limit, 1)
+        while entries > capacity:
+            capacity *= self.max_runs
+            level += 1
+        return level
+
+    def _merge_levels(self):
+        """Функция принимает один параметр:
+        - self: экземпляр класса LsmIndex.
+        Функция, пока последние max_runs файлов находятся на одном уровне,
+        сливает их в один файл, а если это все файлы и их записей
+        достаточно много, - с основным файлом индекса.
+        """
+        while len(self._runs) >= self.max_runs:
+            group = self._runs[-self.max_runs:]
+            levels = {self._level(run) for run in group}
+            if len(levels) > 1:
+                return
+            if len(group) == len(self._runs):
+                merged_entries = sum(self._entries_count(run) for run in group)
+                if merged_entries * self.max_runs >= self._entries_count(self.path):
+                    self.merge()
+                    return
+            run = self._new_run_path()
+            disk_index.write_entries(
+                run,
+                self.object,
+                self._iter_merged(list(reversed(group)))
+                )
+            self._save_runs(self._runs[:-self.max_runs] + [run])
+            # при сбое до удаления слитых файлов они просто останутся
+            # на диске, в списке файлов их уже нет
+            for path in group:
+                os.remove(path)
+            self._signature = self._get_signature()
+
+    def merge(self):
+        """Функция принимает один параметр:
+        - self: экземпляр класса LsmIndex.
+        Функция сбрасывает таблицу в памяти, сливает все файлы
+        с основным файлом индекса (надгробия при этом отбрасываются)
+        и удаляет слитые файлы.
+        """
+        self.flush()
+        runs = self._runs
+        if not runs:
+            return
+        disk_index.write_entries(self.path, self.object, self.iter_after())
+        # после замены основного файла слитые файлы уже не нужны; если
+        # сбой случится до их удаления, они повторно дадут те же записи
+        self._save_runs([])
+        for run in runs:
+            os.remove(run)
+        self._signature = self._get_signature()
+
+    def clear(self):
+        """Функция принимает один параметр:
+        - self: экземпляр класса LsmIndex.
+        Функция удаляет таблицу в памяти и все файлы, кроме основного
+        файла индекса (перед тем как основной файл строится заново).
+        """
+        self._refresh()
+        runs = self._runs
+        self._save_runs([])
+        for run in runs:
+            if os.path.exists(run):
+                os.remove(run)
+        if os.path.exists(self.path + '.memtable'):
+            self._clear_memtable()
+        self._memtable = {}
+        self._signature = self._get_signature()
+
+    def iter_after(self, key: Union[int, str, None] = None) -> Iterator[tuple]:
+        """Функция принимает два параметра:
+        - self: экземпляр класса LsmIndex;
+        - key: идентификатор, после которого начинать (None - с начала).
+        Функция по порядку возвращает пары (идентификатор, номер строки)
+        для всех неудаленных идентификаторов больше key, сливая таблицу
+        в памяти, файлы и основной файл индекса.
+        """
+        self._refresh()
+        for entry_key, line_number in self._iter_merged(
+                [*reversed(self._runs), self.path], key, self._memtable):
+            if line_number != TOMBSTONE:
+                yield entry_key, line_number
+
+    def _iter_merged(
+            self,
+            paths: list[str],
+            key: Union[int, str, None] = None,
+            memtable: Union[dict, None] = None
+            ) -> Iterator[tuple]:
+        """Функция принимает четыре параметра:
+        - self: экземпляр класса LsmIndex;
+        - paths: пути до файлов от новых к старым;
+        - key: идентификатор, после которого начинать (None - с начала);
+        - memtable: таблица в памяти, более новая, чем все файлы.
+        Функция по порядку возвращает пары (идентификатор, номер строки)
+        по самой новой записи о каждом идентификаторе больше key,
+        включая надгробия.
+        """
+        sources = [sorted(
+            (entry_key, 0, line_number)
+            for entry_key, line_number in (memtable or {}).items()
+            if key is None or entry_key > key
+            )]
+        for age, path in enumerate(paths, start=1):
+            if os.path.exists(path):
+                sources.append(_with_age(
+                    disk_index.iter_entries_after(path, self.object, key),
+                    age
+                    ))
+        previous_key = None
+        first = True
+        for entry_key, _, line_number in heapq.merge(*sources):
+            if not first and entry_key == previous_key:
+                continue
+            first = False
+            previous_key = entry_key
+            yield entry_key, line_number
@@ -0,0 +1,141 @@
+"""Модуль для перевода файлов с записями БД в другой формат.
+
+Файлы 'models.txt', 'cars.txt' и 'sales.txt' переписываются потоком,
+порциями записей, во временный файл рядом с исходным, который затем
+заменяет исходный. Номера строк записей не меняются, поэтому индексы
+остаются верными. Переводить каталог нужно, пока с ним не работают
+экземпляры CarService.
+
+Перед переводом все файлы проверяются: если какую-то запись нельзя
+записать в новом формате (например, цену точнее сотых, сохраненную
+в текстовом формате до появления проверки), ни один файл
+не переписывается, а такие записи перечисляются в исключении.
+
+Запуск из командной строки:
+    python migrate_records.py <каталог БД> [--format binary|text]
+"""
+import argparse
+import os
+
+from locks import LOCK_ORDER, LockManager
+from models import FileForObject
+from record_format import FORMAT_VERSIONS, get_codecs
+from record_store import RecordStore
+from wal import fsync_path
+
+# сколько записей переписывать за одно обращение к файлу
+MIGRATION_CHUNK_SIZE = 1024
+# сколько записей, которые нельзя перевести, перечислять в исключении
+MAX_REPORTED_RECORDS = 10
+
+
+def find_unconvertible_records(path: str, object: FileForObject, version: int) -> list[tuple]:
+    """Функция принимает три параметра:
+    - path: путь до файла с записями;
+    - object: тип объекта;
+    - version: версия формата, в который нужно перевести файл.
+    Функция возвращает пары (номер строки с единицы, текст ошибки)
+    для записей, которые нельзя записать в формате версии version.
+    """
+    if not os.path.exists(path):
+        return []
+    source = RecordStore(path, codecs=get_codecs(object))
+    target_codec = get_codecs(object)[version]
+    problems = []
+    try:
+        if source.codec.version == version:
+            return []
+        for line_number, record in enumerate(source.iter_records(), start=1):
+            try:
+                target_codec.encode(source.values(record))
+            except ValueError as error:
+                problems.append((line_number, str(error)))
+    finally:
+        source.close()
+    return problems
+
+
+def migrate_file(path: str, object: FileForObject, version: int) -> bool:
+    """Функция принимает три параметра:
+    - path: путь до файла с записями;
+    - object: тип объекта;
+    - version: версия формата, в который нужно перевести файл.
+    Функция переписывает файл в формат версии version.
+    Возвращает False, если файла нет или он уже в этом формате.
+    """
+    if not os.path.exists(path):
+        return False
+    source = RecordStore(path, codecs=get_codecs(object))
+    # при первом обращении файл открывается и определяется его формат
+    len(source)
+    if source.codec.version == version:
+        source.close()
+        return False
+    tmp_path = path + '.migrate'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    target = RecordStore(tmp_path, codecs=get_codecs(object), new_version=version)
+    # заголовок пишется и в файл без записей
+    target.append(b'')
+    chunk = []
+    for record in source.iter_records():
+        chunk.append(target.encode(source.values(record)))
+        if len(chunk) == MIGRATION_CHUNK_SIZE:
+            target.append(b''.join(chunk))
+            chunk.clear()
+    target.append(b''.join(chunk))
+    target.close()
+    source.close()
+    fsync_path(tmp_path)
+    os.replace(tmp_path, path)
+    return True
+
+
+def migrate_directory(root_directory_path: str, record_format: str = 'binary') -> list[FileForObject]:
+    """Функция принимает два параметра:
+    - root_directory_path: каталог БД;
+    - record_format: формат, в который нужно перевести файлы
+      ('binary' или 'text').
+    Функция под блокировками записи переводит файлы с записями
+    в формат record_format и возвращает типы объектов,
+    файлы которых были переписаны.
+    Либо вызывает исключение ValueError, если какие-то записи нельзя
+    записать в формате record_format (тогда файлы не меняются).
+    """
+    version = FORMAT_VERSIONS[record_format]
+    objects = (FileForObject.model, FileForObject.car, FileForObject.sale)
+    migrated = []
+    with LockManager(root_directory_path).locked(write=LOCK_ORDER):
+        problems = [
+            f'{object.lstrip("/")}, строка {line_number}: {error}'
+            for object in objects
+            for line_number, error in find_unconvertible_records(
+                root_directory_path + object, object, version)
+            ]
+        if problems:
+            raise ValueError(
+                f'Записи нельзя перевести в формат {record_format} '
+                f'({len(problems)}): ' + '; '.join(problems[:MAX_REPORTED_RECORDS])
+                )
+        for object in objects:
+            if migrate_file(root_directory_path + object, object, version):
+                migrated.append(object)
+        fsync_path(root_directory_path)
+    return migrated
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Перевод файлов с записями БД в другой формат')
+    parser.add_argument('root_directory_path', help='каталог БД')
+    parser.add_argument('--format', choices=sorted(FORMAT_VERSIONS), default='binary', dest='record_format')
+    args = parser.parse_args(argv)
+    try:
+        migrated = migrate_directory(args.root_directory_path, args.record_format)
+    except ValueError as error:
+        parser.exit(1, f'{error}\n')
+    for object in migrated:
+        print(f'{object.lstrip("/")}: переведен в формат {args.record_format}')
+
+
+if __name__ == '__main__':
+    main()
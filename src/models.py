@@ -1,20 +1,36 @@
 from datetime import datetime
 from decimal import Decimal
 from enum import StrEnum
+from typing import NamedTuple
 
 from pydantic import BaseModel
 
 
+def construct(model_class: type, **fields):
+    """Функция возвращает экземпляр модели model_class с полями fields
+    без проверки значений (BaseModel.model_construct), поэтому в fields
+    должны быть переданы все поля модели в виде объектов нужных типов.
+    """
+    return model_class.model_construct(**fields)
+
+
 class FileForObject(StrEnum):
     car = "/cars.txt"
     model = "/models.txt"
     sale = "/sales.txt"
+    sale_stats = "/sales_stats.txt"
+    sale_free_slots = "/sales_free.txt"
 
 
 class FileIndexForObject(StrEnum):
     car = "/cars_index.txt"
     model = "/models_index.txt"
     sale = "/sales_index.txt"
+    sale_by_car = "/sales_car_index.txt"
+    car_status = "/cars_status_index.txt"
+    car_date = "/cars_date_index.txt"
+    car_price = "/cars_price_index.txt"
+    sale_date = "/sales_date_index.txt"
 
 
 class CarStatus(StrEnum):
@@ -24,6 +40,16 @@ class CarStatus(StrEnum):
     delivery = "delivery"
 
 
+# коды статусов автомобиля для компактного хранения (один байт на авто)
+CAR_STATUS_CODES = {
+    CarStatus.available: 0,
+    CarStatus.reserve: 1,
+    CarStatus.sold: 2,
+    CarStatus.delivery: 3,
+}
+CAR_STATUS_BY_CODE = {code: status for status, code in CAR_STATUS_CODES.items()}
+
+
 class Car(BaseModel):
     vin: str
     model: int
@@ -35,6 +61,24 @@ class Car(BaseModel):
         return self.vin
 
 
+class CarRecord(NamedTuple):
+    """Легкая запись об автомобиле без проверки полей pydantic."""
+    vin: str
+    model: int
+    price: Decimal
+    date_start: datetime
+    status: CarStatus
+
+    def to_car(self) -> Car:
+        return construct(
+            Car,
+            vin=self.vin,
+            model=self.model,
+            price=self.price,
+            date_start=self.date_start,
+            status=self.status)
+
+
 class Model(BaseModel):
     id: int
     name: str
@@ -69,3 +113,29 @@ class ModelSaleStats(BaseModel):
     car_model_name: str
     brand: str
     sales_number: int
+    revenue: Decimal | None = None
+
+
+class CarsPage(BaseModel):
+    cars: list[Car]
+    next_cursor: str | None
+
+
+class OperationStats(BaseModel):
+    calls: int
+    errors: int
+    total_ms: float
+    max_ms: float
+    latency_histogram: list[int]
+    file_opens: int
+    bytes_read: int
+    bytes_written: int
+    records_scanned: int
+
+
+class CacheStats(BaseModel):
+    hits: int
+    misses: int
+    evictions: int
+    size: int
+    maxsize: int
@@ -0,0 +1,198 @@
+"""Модуль для параллельного обхода файлов с записями в пуле процессов.
+
+Записи в файлах 'cars.txt' и 'sales.txt' имеют фиксированный размер,
+поэтому файл можно разделить на диапазоны ровно по границам записей.
+ParallelScanner раздает диапазоны процессам пула: каждый процесс одним
+вызовом pread читает свой диапазон, разбирает записи кодеком формата
+файла и выполняет над ними задачу (отбор или подсчет). Результаты
+диапазонов возвращаются в порядке расположения в файле, а объединяет их
+вызывающий код.
+
+Задача - функция уровня модуля task(codec, records, *args), где records -
+пары (номер записи с нуля, запись). Задача и ее аргументы передаются
+в процесс через pickle.
+
+Процессы читают файл напрямую, поэтому вызывающий код должен держать
+блокировку чтения на время всего обхода, а не отдельных диапазонов.
+Изменения, записанные в отображение файла этим процессом, другие
+процессы видят сразу (отображение общее).
+
+Процессы пула запускаются через forkserver (или spawn, где его нет),
+а не fork: CarService работает в нескольких потоках и держит flock
+на файлах блокировок, а процесс, полученный fork, унаследовал бы
+захваченные другими потоками блокировки и открытые дескрипторы.
+"""
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Iterator, Union
+
+from instrumentation import count_read
+from models import CAR_STATUS_CODES, CarStatus, FileForObject
+from record_format import get_codecs
+from record_store import RecordStore
+
+# на сколько диапазонов на процесс делится обход: процессы, быстрее
+# закончившие свои диапазоны, забирают оставшиеся
+CHUNKS_PER_WORKER = 4
+# меньше скольких записей разбирать параллельно невыгодно:
+# передача задачи и результата в процесс стоит дороже разбора
+PARALLEL_SCAN_MIN_RECORDS = 100_000
+
+# способ запуска процессов пула по умолчанию
+START_METHOD = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+
+# кодеки, созданные в процессе пула: (тип объекта, версия) -> кодек
+_codecs: dict = {}
+
+
+def _get_codec(object: FileForObject, version: int):
+    """Функция возвращает кодек записей object версии version."""
+    codec = _codecs.get((object, version))
+    if codec is None:
+        codec = get_codecs(object)[version]
+        _codecs[(object, version)] = codec
+    return codec
+
+
+def _scan_range(
+        path: str,
+        object: FileForObject,
+        version: int,
+        header_size: int,
+        record_size: int,
+        start: int,
+        stop: int,
+        task: Callable,
+        args: tuple
+        ):
+    """Функция принимает параметры:
+    - path: путь до файла с записями;
+    - object: тип объекта;
+    - version, header_size, record_size: формат файла;
+    - start, stop: номера первой и следующей за последней записей (с нуля);
+    - task, args: задача и ее аргументы.
+    Функция выполняется в процессе пула: читает записи диапазона
+    и возвращает результат задачи над ними.
+    """
+    codec = _get_codec(object, version)
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        data = os.pread(fd, (stop - start) * record_size, header_size + start * record_size)
+    finally:
+        os.close(fd)
+    view = memoryview(data)
+    records = (
+        (start + offset // record_size, view[offset:offset + record_size])
+        for offset in range(0, len(data) - record_size + 1, record_size)
+        )
+    return task(codec, records, *args)
+
+
+def select_cars(codec, records: Iterator[tuple], status: CarStatus) -> list[list]:
+    """Задача: возвращает поля (объекты Python) автомобилей со статусом status."""
+    selected = []
+    for _, record in records:
+        car_info = codec.values(record)
+        if car_info[4] == status:
+            selected.append(car_info)
+    return selected
+
+
+def select_active_sales(codec, records: Iterator[tuple]) -> list[tuple]:
+    """Задача: возвращает для неудаленных продаж тройки
+    (номер записи с нуля, vin автомобиля, стоимость).
+    """
+    return [
+        (number, sale_info[1], sale_info[3])
+        for number, sale_info in ((number, codec.values(record)) for number, record in records)
+        if sale_info[4] == 0
+        ]
+
+
+def car_status_codes(codec, records: Iterator[tuple]) -> bytes:
+    """Задача: возвращает содержимое индекса статусов для автомобилей
+    диапазона (по байту с кодом статуса на автомобиль).
+    """
+    return bytes(
+        ord('0') + CAR_STATUS_CODES[codec.values(record)[4]]
+        for _, record in records
+        )
+
+
+class ParallelScanner:
+    """Пул процессов для параллельного обхода файлов с записями.
+
+    Пул создается при первом параллельном обходе. При workers меньше 2
+    или если записей меньше min_records, вызывающий код должен
+    обходить файл сам (см. should_scan).
+    """
+
+    def __init__(
+            self,
+            workers: int,
+            min_records: int = PARALLEL_SCAN_MIN_RECORDS,
+            mp_context=None
+            ) -> None:
+        if workers < 0 or min_records < 0:
+            raise ValueError('Количество процессов и порог не могут быть отрицательными')
+        self.workers = workers
+        self.min_records = min_records
+        self._mp_context = mp_context or multiprocessing.get_context(START_METHOD)
+        self._executor: Union[ProcessPoolExecutor, None] = None
+        self._lock = threading.Lock()
+
+    def should_scan(self, count: int) -> bool:
+        """Функция проверяет, стоит ли разбирать count записей параллельно."""
+        return self.workers > 1 and count >= self.min_records
+
+    def scan(
+            self,
+            store: RecordStore,
+            object: FileForObject,
+            task: Callable,
+            *args,
+            start: int = 0,
+            stop: Union[int, None] = None
+            ) -> list:
+        """Функция принимает параметры:
+        - self: экземпляр класса ParallelScanner;
+        - store: файл с записями;
+        - object: тип объекта;
+        - task, args: задача и ее аргументы;
+        - start, stop: номера первой и следующей за последней записей
+          (по умолчанию - весь файл).
+        Функция делит записи на диапазоны, выполняет задачу над ними
+        в процессах пула и возвращает результаты диапазонов в порядке
+        расположения в файле.
+        """
+        count = len(store)
+        stop = count if stop is None else min(stop, count)
+        if start >= stop:
+            return []
+        chunk_size = -(-(stop - start) // (self.workers * CHUNKS_PER_WORKER))
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(self.workers, mp_context=self._mp_context)
+            executor = self._executor
+        futures = [
+            executor.submit(
+                _scan_range, store.path, object, store.codec.version,
+                len(store.header), store.record_size,
+                chunk_start, min(chunk_start + chunk_size, stop), task, args
+                )
+            for chunk_start in range(start, stop, chunk_size)
+            ]
+        results = [future.result() for future in futures]
+        # процессы пула ведут свои счетчики, поэтому чтение учитывается здесь
+        count_read((stop - start) * store.record_size, stop - start)
+        return results
+
+    def close(self):
+        """Функция останавливает процессы пула."""
+        with self._lock:
+            executor = self._executor
+            self._executor = None
+        if executor is not None:
+            executor.shutdown()
@@ -0,0 +1,102 @@
+"""Модуль для согласованных снимков чтения CarService.
+
+Снимок (ReadSnapshot) запоминает состояние БД на момент создания:
+вид файла с автомобилями (record_store.RecordView), копию индекса
+статусов и копию агрегатов продаж. Блокировка чтения нужна только
+на время создания снимка, поэтому долгий отчет по снимку не задерживает
+запись, а запись не меняет того, что видит отчет: добавленные позже
+автомобили в снимке не видны, а прежнее содержимое измененных записей
+сохраняется в виде файла.
+
+Файлы индексов снимок не читает: индекс статусов и агрегаты продаж
+копируются при создании, а файлы LSM-индексов и так не меняются на месте
+(см. lsm_index.py).
+
+Снимок согласован относительно изменений, сделанных в этом процессе.
+Изменения, которые другие процессы записывают в отображение файла
+на месте, в снимке видны.
+"""
+from typing import Callable, Iterator, Union
+
+from models import Car, CarRecord, CarStatus, ModelSaleStats
+from record_store import RecordView
+
+
+class ReadSnapshot:
+    """Состояние БД на момент создания для долгих отчетов.
+
+    Снимок создается методом CarService.read_snapshot и закрывается
+    методом close (или при выходе из блока with).
+    """
+
+    def __init__(
+            self,
+            cars: RecordView,
+            lines_by_status: dict,
+            sales_stats: dict,
+            make_car: Callable,
+            rank_models: Callable
+            ) -> None:
+        self._cars = cars
+        # статус -> отсортированный список номеров строк (с нуля)
+        self._lines_by_status = lines_by_status
+        # id модели -> [количество продаж, выручка, бренд, название модели]
+        self._sales_stats = sales_stats
+        self._make_car = make_car
+        self._rank_models = rank_models
+
+    def __enter__(self) -> 'ReadSnapshot':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self) -> int:
+        """Функция возвращает количество автомобилей в снимке."""
+        return len(self._cars)
+
+    def _iter_values(self, status: Union[CarStatus, None]) -> Iterator[list]:
+        """Функция принимает два параметра:
+        - self: экземпляр класса ReadSnapshot;
+        - status: статус автомобиля (None - все автомобили).
+        Функция по одному возвращает поля записей автомобилей в порядке
+        расположения в файле.
+        """
+        cars = self._cars
+        lines = range(len(cars)) if status is None else self._lines_by_status[status]
+        for ind in lines:
+            yield cars.values(cars.read(ind))
+
+    def iter_cars(self, status: Union[CarStatus, None] = None) -> Iterator[Car]:
+        """Функция по одному возвращает автомобили со статусом status
+        (None - все автомобили) в порядке расположения в файле.
+        """
+        for car_info in self._iter_values(status):
+            yield self._make_car(car_info)
+
+    def get_cars(self, status: CarStatus) -> list[Car]:
+        """Функция возвращает автомобили со статусом status (см. CarService.get_cars)."""
+        return list(self.iter_cars(status))
+
+    def get_car_records(self, status: CarStatus) -> list[CarRecord]:
+        """Функция возвращает автомобили со статусом status в виде CarRecord."""
+        return [CarRecord._make(car_info) for car_info in self._iter_values(status)]
+
+    def top_models_by_sales(self) -> list[ModelSaleStats]:
+        """Функция возвращает три самые продаваемые модели
+        (см. CarService.top_models_by_sales).
+        """
+        return self._rank_models(self._sales_stats, 3, 'count', with_revenue=False)
+
+    def top_models(self, n: int = 3, by: str = 'count') -> list[ModelSaleStats]:
+        """Функция возвращает n самых продаваемых за все время моделей
+        с выручкой (см. CarService.top_models).
+        Либо вызывает исключение ValueError, если by неизвестен.
+        """
+        if by not in ('count', 'revenue'):
+            raise ValueError(f'Нельзя упорядочить модели по {by!r}')
+        return self._rank_models(self._sales_stats, max(n, 0), by)
+
+    def close(self):
+        """Функция закрывает снимок и освобождает вид файла."""
+        self._cars.close()
@@ -0,0 +1,266 @@
+"""Модуль с форматами записей о моделях, автомобилях и продажах.
+
+Версия 0 - текстовый формат: поля через ';', дополненные пробелами
+до 500 байт. Версия 1 - двоичный формат: поля фиксированного размера,
+упакованные struct. Строки хранятся в UTF-8 и дополняются нулевыми
+байтами, цены - целым числом сотых (копеек), даты - целым числом
+микросекунд от 1970-01-01 (дата с часовым поясом переводится в UTC),
+статус автомобиля - кодом из CAR_STATUS_CODES. Текстовый формат
+хранит значения как есть, поэтому записи с ценой точнее сотых
+migrate_records переводить отказывается.
+Запись об автомобиле занимает 49 байт вместо 500.
+
+Оба формата отдают поля записи в одинаковом текстовом виде (split,
+decode), поэтому CarService работает с файлами любого формата, а также
+в виде значений Python (values) без разбора текста.
+"""
+import struct
+from datetime import datetime, timedelta
+from decimal import Decimal
+from typing import Union
+
+from disk_index import to_naive_utc
+from models import CAR_STATUS_BY_CODE, CAR_STATUS_CODES, CarStatus, FileForObject
+from record_store import RECORD_SIZE, TEXT_VERSION, TextCodec
+
+BINARY_VERSION = 1
+
+# версии формата по названию
+FORMAT_VERSIONS = {
+    'text': TEXT_VERSION,
+    'binary': BINARY_VERSION,
+}
+
+# виды полей записи
+FIELD_STR = 'str'
+FIELD_INT = 'int'
+FIELD_PRICE = 'price'
+FIELD_DATETIME = 'datetime'
+FIELD_STATUS = 'status'
+FIELD_FLAG = 'flag'
+
+# поля записей: (вид поля, размер строки в байтах для FIELD_STR)
+RECORD_LAYOUTS = {
+    FileForObject.model: [(FIELD_INT, 0), (FIELD_STR, 64), (FIELD_STR, 32)],
+    FileForObject.car: [
+        (FIELD_STR, 24), (FIELD_INT, 0), (FIELD_PRICE, 0),
+        (FIELD_DATETIME, 0), (FIELD_STATUS, 0)
+        ],
+    FileForObject.sale: [
+        (FIELD_STR, 48), (FIELD_STR, 24), (FIELD_DATETIME, 0),
+        (FIELD_PRICE, 0), (FIELD_FLAG, 0)
+        ],
+}
+
+# количество сотых в единице цены
+PRICE_SCALE = 100
+EPOCH = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds=1)
+
+
+def check_price(value) -> Decimal:
+    """Функция принимает один параметр:
+    - value: цена (Decimal или текст).
+    Функция возвращает цену, умноженную на PRICE_SCALE.
+    Либо вызывает исключение ValueError, если цена задана точнее,
+    чем до сотых.
+    """
+    scaled = Decimal(str(value)) * PRICE_SCALE
+    if scaled != scaled.to_integral_value():
+        raise ValueError(f'Цена {value} задана точнее, чем до сотых')
+    return scaled
+
+
+# статусы автомобиля по текстовому значению: поиск в словаре
+# в несколько раз быстрее вызова CarStatus(text)
+CAR_STATUS_BY_VALUE = {status.value: status for status in CarStatus}
+
+
+def _parse_status(text: str) -> CarStatus:
+    """Функция возвращает статус автомобиля по его текстовому значению.
+    Либо вызывает исключение ValueError, если такого статуса нет.
+    """
+    try:
+        return CAR_STATUS_BY_VALUE[text]
+    except KeyError:
+        raise ValueError(f'Неизвестный статус {text!r}')
+
+
+# функции разбора текстового значения поля по видам полей
+TEXT_PARSERS = {
+    FIELD_STR: str,
+    FIELD_INT: int,
+    FIELD_PRICE: Decimal,
+    FIELD_DATETIME: datetime.fromisoformat,
+    FIELD_STATUS: _parse_status,
+    FIELD_FLAG: int,
+}
+
+
+def parse_value(kind: str, text: str):
+    """Функция принимает два параметра:
+    - kind: вид поля;
+    - text: значение поля в текстовом виде.
+    Функция возвращает значение поля в виде объекта Python.
+    """
+    return TEXT_PARSERS.get(kind, str)(text)
+
+
+class TypedTextCodec(TextCodec):
+    """Текстовый формат записей с известными видами полей."""
+
+    def __init__(self, layout: list[tuple], record_size: int = RECORD_SIZE) -> None:
+        super().__init__(record_size, len(layout))
+        self.kinds = [kind for kind, _ in layout]
+        self._parsers = [TEXT_PARSERS[kind] for kind in self.kinds]
+
+    def values(self, record: Union[bytes, memoryview]) -> list:
+        """Функция принимает два параметра:
+        - self: экземпляр класса TypedTextCodec;
+        - record: запись из файла.
+        Функция возвращает поля записи в виде объектов Python.
+        """
+        return [
+            parse(field)
+            for parse, field in zip(self._parsers, self.decode(record))
+            ]
+
+
+def _decode_str(value: bytes) -> str:
+    """Функция возвращает строку из поля, дополненного нулевыми байтами."""
+    return value.rstrip(b'\0').decode()
+
+
+def _unscale_price(value: int) -> Decimal:
+    """Функция возвращает цену по целому числу сотых."""
+    return Decimal(value).scaleb(-2)
+
+
+def _from_microseconds(value: int) -> datetime:
+    """Функция возвращает дату по числу микросекунд от EPOCH."""
+    return EPOCH + timedelta(microseconds=value)
+
+
+# функции перевода распакованного значения поля в объект Python
+# по видам полей (None - значение уже нужного типа)
+BINARY_CONVERTERS = {
+    FIELD_STR: _decode_str,
+    FIELD_INT: None,
+    FIELD_PRICE: _unscale_price,
+    FIELD_DATETIME: _from_microseconds,
+    FIELD_STATUS: CAR_STATUS_BY_CODE.__getitem__,
+    FIELD_FLAG: None,
+}
+
+
+class BinaryCodec:
+    """Двоичный формат записей с полями фиксированного размера."""
+
+    version = BINARY_VERSION
+
+    def __init__(self, layout: list[tuple]) -> None:
+        self.kinds = [kind for kind, _ in layout]
+        self.fields_count = len(layout)
+        self._struct = struct.Struct('<' + ''.join(
+            f'{width}s' if kind == FIELD_STR
+            else 'B' if kind in (FIELD_STATUS, FIELD_FLAG)
+            else 'q'
+            for kind, width in layout
+            ))
+        self.record_size = self._struct.size
+        self._widths = [width for _, width in layout]
+        self._converters = [BINARY_CONVERTERS[kind] for kind in self.kinds]
+
+    def _pack_value(self, kind: str, width: int, value):
+        """Функция принимает четыре параметра:
+        - self: экземпляр класса BinaryCodec;
+        - kind: вид поля;
+        - width: размер строки в байтах для FIELD_STR;
+        - value: значение поля (объект Python или текст).
+        Функция возвращает значение, готовое для упаковки struct.
+        Либо вызывает исключение ValueError, если значение нельзя
+        записать в поле без потери точности.
+        """
+        if kind == FIELD_STR:
+            data = str(value).encode()
+            if len(data) > width or b'\0' in data:
+                raise ValueError(f'Строка {value!r} не помещается в {width} байт')
+            return data
+        if kind == FIELD_INT:
+            return int(value)
+        if kind == FIELD_PRICE:
+            return int(check_price(value))
+        if kind == FIELD_DATETIME:
+            if not isinstance(value, datetime):
+                value = datetime.fromisoformat(str(value))
+            return (to_naive_utc(value) - EPOCH) // MICROSECOND
+        if kind == FIELD_STATUS:
+            return CAR_STATUS_CODES[CarStatus(value)]
+        return int(value)
+
+    def encode(self, fields: list) -> bytes:
+        """Функция принимает два параметра:
+        - self: экземпляр класса BinaryCodec;
+        - fields: значения полей записи (объекты Python или текст).
+        Функция возвращает упакованную запись.
+        Либо вызывает исключение ValueError, если поля нельзя записать.
+        """
+        return self._struct.pack(*(
+            self._pack_value(kind, width, value)
+            for kind, width, value in zip(self.kinds, self._widths, fields)
+            ))
+
+    def values(self, record: Union[bytes, memoryview]) -> list:
+        """Функция принимает два параметра:
+        - self: экземпляр класса BinaryCodec;
+        - record: запись из файла.
+        Функция возвращает поля записи в виде объектов Python.
+        """
+        return [
+            value if convert is None else convert(value)
+            for convert, value in zip(self._converters, self._struct.unpack(record))
+            ]
+
+    def decode(self, record: Union[bytes, memoryview]) -> list[str]:
+        """Функция принимает два параметра:
+        - self: экземпляр класса BinaryCodec;
+        - record: запись из файла.
+        Функция возвращает поля записи в том же текстовом виде,
+        что и текстовый формат.
+        """
+        return [
+            value.value if isinstance(value, CarStatus) else str(value)
+            for value in self.values(record)
+            ]
+
+    def split(self, record: Union[bytes, memoryview]) -> list[bytes]:
+        """Функция возвращает поля записи в текстовом виде (bytes)."""
+        return [field.encode() for field in self.decode(record)]
+
+    def is_valid(self, record: Union[bytes, memoryview]) -> bool:
+        """Функция принимает два параметра:
+        - self: экземпляр класса BinaryCodec;
+        - record: запись из файла.
+        Функция проверяет, что запись дописана до конца: недописанная
+        при сбое запись состоит из нулевых байт.
+        """
+        if not any(record):
+            return False
+        try:
+            self.values(record)
+        except (ValueError, KeyError, UnicodeDecodeError):
+            return False
+        return True
+
+
+def get_codecs(object: FileForObject) -> dict:
+    """Функция принимает один параметр:
+    - object: тип объекта.
+    Функция возвращает кодеки записей об объектах этого типа
+    по версиям формата.
+    """
+    layout = RECORD_LAYOUTS[object]
+    return {
+        TEXT_VERSION: TypedTextCodec(layout),
+        BINARY_VERSION: BinaryCodec(layout),
+    }
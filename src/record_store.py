@@ -0,0 +1,502 @@
+"""Модуль для доступа к файлам с записями фиксированного размера.
+
+Файлы 'cars.txt', 'models.txt' и 'sales.txt' состоят из записей
+по RECORD_SIZE байт: поля, разделенные ';', дополненные пробелами,
+и '\\n' в конце. RecordStore отображает такой файл в память через mmap
+и отдает запись с номером N срезом memoryview без копирования
+и без системных вызовов, а изменения записывает прямо в отображение.
+
+Кроме текстового формата (версия 0, без заголовка) файл может быть
+записан в другом формате с записями другого размера. Такой файл
+начинается с заголовка HEADER: метка MAGIC, версия формата и размер
+записи. Запись кодируется и разбирается кодеком этой версии.
+
+RecordView - вид файла на момент создания: записи, дописанные позже,
+в нем не видны, а прежнее содержимое записей, измененных позже
+на месте, RecordStore.write сохраняет в открытых видах этого файла
+до записи нового. Так видом можно читать, не мешая записи.
+"""
+import mmap
+import os
+import struct
+import threading
+from typing import Iterator, Union
+
+from instrumentation import count_open, count_read, count_write
+
+RECORD_SIZE = 500
+
+# заголовок файла с форматом версии больше 0: метка, версия, размер записи
+HEADER = struct.Struct('<8sHH4x')
+MAGIC = b'BIBIPREC'
+TEXT_VERSION = 0
+
+# открытые виды файлов: (устройство, inode) -> виды этого файла
+_open_views: dict[tuple, list] = {}
+_views_lock = threading.Lock()
+
+
+def encode_record(fields: list, record_size: int = RECORD_SIZE) -> bytes:
+    """Функция принимает два параметра:
+    - fields: значения полей записи;
+    - record_size: размер записи в байтах.
+    Функция возвращает запись, готовую для записи в файл: поля через ';',
+    дополненные пробелами до record_size байт вместе с '\\n'.
+    Либо вызывает исключение ValueError, если поля не помещаются в запись.
+    """
+    data = ';'.join(str(field) for field in fields).encode()
+    if len(data) > record_size - 1 or b'\n' in data:
+        raise ValueError(
+            f'Запись длиной {len(data)} байт не помещается '
+            f'в {record_size} байт'
+            )
+    return data.ljust(record_size - 1) + b'\n'
+
+
+def split_record(record: Union[bytes, memoryview]) -> list[bytes]:
+    """Функция принимает один параметр:
+    - record: запись из файла.
+    Функция возвращает поля записи в виде bytes, не декодируя их.
+    """
+    return bytes(record).rstrip().split(b';')
+
+
+def decode_record(record: Union[bytes, memoryview]) -> list[str]:
+    """Функция принимает один параметр:
+    - record: запись из файла.
+    Функция возвращает поля записи в виде строк.
+    """
+    return [field.decode() for field in split_record(record)]
+
+
+def pack_header(version: int, record_size: int) -> bytes:
+    """Функция принимает два параметра:
+    - version: версия формата записей;
+    - record_size: размер записи в байтах.
+    Функция возвращает заголовок файла с записями.
+    """
+    return HEADER.pack(MAGIC, version, record_size)
+
+
+def unpack_header(data: bytes) -> Union[tuple[int, int], None]:
+    """Функция принимает один параметр:
+    - data: первые байты файла с записями.
+    Функция возвращает пару (версия формата, размер записи).
+    Либо возвращает None, если файл записан в текстовом формате
+    без заголовка.
+    """
+    if len(data) < HEADER.size or not data.startswith(MAGIC):
+        return None
+    _, version, record_size = HEADER.unpack(data[:HEADER.size])
+    return version, record_size
+
+
+class TextCodec:
+    """Текстовый формат записей: поля через ';', дополненные пробелами."""
+
+    version = TEXT_VERSION
+
+    def __init__(self, record_size: int = RECORD_SIZE, fields_count: Union[int, None] = None) -> None:
+        self.record_size = record_size
+        # количество полей в записи, если оно известно
+        self.fields_count = fields_count
+
+    def encode(self, fields: list) -> bytes:
+        """Функция возвращает запись с полями fields (см. encode_record)."""
+        return encode_record(fields, self.record_size)
+
+    def split(self, record: Union[bytes, memoryview]) -> list[bytes]:
+        """Функция возвращает поля записи в виде bytes (см. split_record)."""
+        return split_record(record)
+
+    def decode(self, record: Union[bytes, memoryview]) -> list[str]:
+        """Функция возвращает поля записи в виде строк (см. decode_record)."""
+        return decode_record(record)
+
+    def is_valid(self, record: Union[bytes, memoryview]) -> bool:
+        """Функция принимает два параметра:
+        - self: экземпляр класса TextCodec;
+        - record: запись из файла.
+        Функция проверяет, что запись дописана до конца
+        (например, не оборвалась при сбое).
+        """
+        record = bytes(record)
+        return (record.endswith(b'\n') and b'\0' not in record
+                and (self.fields_count is None
+                     or len(split_record(record)) == self.fields_count))
+
+
+class RecordStore:
+    """Отображенный в память файл с записями фиксированного размера.
+
+    Файл открывается при первом обращении, отображение пересоздается,
+    только когда запрошена запись за его пределами (файл вырос).
+    Если файла нет, чтение вызывает FileNotFoundError,
+    а добавление записей создает файл в формате версии new_version.
+    Формат существующего файла определяется по заголовку, а записи
+    кодируются и разбираются кодеком его версии из codecs.
+    Экземпляром можно пользоваться из нескольких потоков.
+    """
+
+    def __init__(
+            self,
+            path: str,
+            record_size: int = RECORD_SIZE,
+            codecs: Union[dict, None] = None,
+            new_version: int = TEXT_VERSION
+            ) -> None:
+        self.path = path
+        # кодеки по версиям формата
+        self.codecs = codecs or {TEXT_VERSION: TextCodec(record_size)}
+        self.new_version = new_version
+        self._set_codec(self.codecs[TEXT_VERSION])
+        self._file = None
+        self._mmap: Union[mmap.mmap, None] = None
+        self._view: Union[memoryview, None] = None
+        self._count = 0
+        # (устройство, inode) открытого файла
+        self._file_id = None
+        # защищает файл и отображение при обращении из нескольких потоков
+        self._lock = threading.RLock()
+
+    def _set_codec(self, codec):
+        """Функция принимает два параметра:
+        - self: экземпляр класса RecordStore;
+        - codec: кодек формата записей файла.
+        Функция запоминает формат файла: кодек, размер записи и заголовок.
+        """
+        self.codec = codec
+        self.record_size = codec.record_size
+        self.header = (b'' if codec.version == TEXT_VERSION
+                       else pack_header(codec.version, codec.record_size))
+
+    def _open(self, create: bool = False):
+        """Функция принимает два параметра:
+        - self: экземпляр класса RecordStore;
+        - create: создавать ли файл, если его нет.
+        Функция открывает файл и по заголовку определяет его формат.
+        В новый файл записывается заголовок формата версии new_version.
+        Либо вызывает исключение FileNotFoundError, если файла нет
+        и create равен False.
+        Либо вызывает исключение ValueError, если версия формата неизвестна.
+        """
+        flags = os.O_RDWR | (os.O_CREAT if create else 0)
+        file = open(os.open(self.path, flags, 0o644), 'r+b')
+        count_open()
+        header = os.pread(file.fileno(), HEADER.size, 0)
+        if not header:
+            self._set_codec(self.codecs[self.new_version])
+            os.pwrite(file.fileno(), self.header, 0)
+        else:
+            version = unpack_header(header)
+            version = TEXT_VERSION if version is None else version[0]
+            if version not in self.codecs:
+                file.close()
+                raise ValueError(f'Неизвестная версия формата {version} файла {self.path}')
+            self._set_codec(self.codecs[version])
+        self._file = file
+        stat = os.fstat(file.fileno())
+        self._file_id = (stat.st_dev, stat.st_ino)
+
+    def __len__(self) -> int:
+        """Функция возвращает количество записей в файле."""
+        with self._lock:
+            try:
+                self._remap()
+            except FileNotFoundError:
+                return 0
+            return self._count
+
+    def _remap(self):
+        """Функция принимает один параметр:
+        - self: экземпляр класса RecordStore.
+        Функция открывает файл, если он еще не открыт, и заново
+        отображает его в память, если с прошлого раза он вырос.
+        Либо вызывает исключение FileNotFoundError, если файл не найден.
+        """
+        if self._file is None:
+            self._open()
+        size = os.fstat(self._file.fileno()).st_size
+        count = max(size - len(self.header), 0) // self.record_size
+        if count == self._count and (self._mmap is not None or count == 0):
+            return
+        self._unmap()
+        if count > 0:
+            self._mmap = mmap.mmap(
+                self._file.fileno(),
+                len(self.header) + count * self.record_size,
+                access=mmap.ACCESS_WRITE
+                )
+            self._view = memoryview(self._mmap)
+        self._count = count
+
+    def _unmap(self):
+        """Функция принимает один параметр:
+        - self: экземпляр класса RecordStore.
+        Функция освобождает текущее отображение. Если на него еще
+        ссылаются выданные срезы, отображение закроется сборщиком мусора.
+        """
+        if self._view is not None:
+            try:
+                self._view.release()
+            except BufferError:
+                pass
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                pass
+        self._view = None
+        self._mmap = None
+        self._count = 0
+
+    def read(self, number: int) -> memoryview:
+        """Функция принимает два параметра:
+        - self: экземпляр класса RecordStore;
+        - number: номер записи (с нуля).
+        Функция возвращает срез отображения с записью без копирования.
+        Либо вызывает исключение IndexError, если такой записи нет.
+        Либо вызывает исключение FileNotFoundError, если файл не найден.
+        """
+        with self._lock:
+            if number >= self._count or self._view is None:
+                self._remap()
+                if number >= self._count:
+                    raise IndexError(number)
+            start = len(self.header) + number * self.record_size
+            count_read(self.record_size, 1)
+            return self._view[start:start + self.record_size]
+
+    def write(self, number: int, record: bytes):
+        """Функция принимает три параметра:
+        - self: экземпляр класса RecordStore;
+        - number: номер записи (с нуля);
+        - record: новое содержимое записи ровно из record_size байт.
+        Функция записывает запись прямо в отображение файла.
+        Либо вызывает исключение IndexError, если такой записи нет.
+        """
+        if len(record) != self.record_size:
+            raise ValueError(f'Размер записи должен быть {self.record_size} байт')
+        with self._lock:
+            if number >= self._count or self._view is None:
+                self._remap()
+                if number >= self._count:
+                    raise IndexError(number)
+            start = len(self.header) + number * self.record_size
+            views = _open_views.get(self._file_id)
+            if views:
+                old_record = bytes(self._view[start:start + self.record_size])
+                for view in views:
+                    view._preserve(number, old_record)
+            self._view[start:start + self.record_size] = record
+            count_write(self.record_size)
+
+    def append(self, records: bytes) -> int:
+        """Функция принимает два параметра:
+        - self: экземпляр класса RecordStore;
+        - records: одна или несколько подряд идущих записей.
+        Функция одной записью дописывает записи в конец файла
+        (недописанный хвост файла перезаписывается) и возвращает
+        номер первой добавленной записи (с нуля).
+        """
+        with self._lock:
+            if self._file is None:
+                self._open(create=True)
+            if len(records) % self.record_size != 0:
+                raise ValueError(f'Размер записей должен быть кратен {self.record_size} байт')
+            size = os.fstat(self._file.fileno()).st_size
+            first = (size - len(self.header)) // self.record_size
+            os.pwrite(
+                self._file.fileno(),
+                records,
+                len(self.header) + first * self.record_size
+                )
+            count_write(len(records))
+            return first
+
+    def truncate(self, count: int):
+        """Функция принимает два параметра:
+        - self: экземпляр класса RecordStore;
+        - count: сколько записей оставить в файле.
+        Функция отбрасывает записи с номерами count и дальше.
+        """
+        with self._lock:
+            self._remap()
+            self._unmap()
+            self._file.truncate(len(self.header) + count * self.record_size)
+
+    def iter_records(self, start: int = 0) -> Iterator[memoryview]:
+        """Функция принимает два параметра:
+        - self: экземпляр класса RecordStore;
+        - start: номер записи (с нуля), с которой начинать.
+        Функция по одной возвращает записи файла, начиная с start,
+        в том виде, в каком файл был на момент начала обхода.
+        Если файла нет, не возвращает ничего.
+        """
+        with self._lock:
+            try:
+                self._remap()
+            except FileNotFoundError:
+                return
+            if self._mmap is None:
+                return
+            # собственное представление держит отображение открытым,
+            # даже если во время обхода файл вырастет и будет отображен заново
+            view = memoryview(self._mmap)
+            header_size = len(self.header)
+        for number in range(start, (len(view) - header_size) // self.record_size):
+            offset = header_size + number * self.record_size
+            count_read(self.record_size, 1)
+            yield view[offset:offset + self.record_size]
+
+    def reopen_if_replaced(self):
+        """Функция принимает один параметр:
+        - self: экземпляр класса RecordStore.
+        Функция закрывает файл и отображение, если файл по пути path
+        был заменен другим (например, после уплотнения), чтобы при
+        следующем обращении открылся новый файл.
+        """
+        with self._lock:
+            if self._file is None:
+                return
+            try:
+                inode = os.stat(self.path).st_ino
+            except FileNotFoundError:
+                inode = None
+            if inode != os.fstat(self._file.fileno()).st_ino:
+                self.close()
+
+    def format_version(self) -> int:
+        """Функция возвращает версию формата, в котором в файл
+        дописываются записи.
+        """
+        with self._lock:
+            if self._file is None:
+                try:
+                    self._open()
+                except FileNotFoundError:
+                    # файл будет создан в формате версии new_version
+                    return self.new_version
+            return self.codec.version
+
+    def encode(self, fields: list) -> bytes:
+        """Функция возвращает запись с полями fields в формате файла."""
+        with self._lock:
+            return self.codecs[self.format_version()].encode(fields)
+
+    def split(self, record: Union[bytes, memoryview]) -> list[bytes]:
+        """Функция возвращает поля записи файла в текстовом виде (bytes)."""
+        return self.codec.split(record)
+
+    def decode(self, record: Union[bytes, memoryview]) -> list[str]:
+        """Функция возвращает поля записи файла в виде строк."""
+        return self.codec.decode(record)
+
+    def values(self, record: Union[bytes, memoryview]) -> list:
+        """Функция возвращает поля записи файла в виде объектов Python."""
+        return self.codec.values(record)
+
+    def is_valid(self, record: Union[bytes, memoryview]) -> bool:
+        """Функция проверяет, что запись файла дописана до конца."""
+        return self.codec.is_valid(record)
+
+    def flush(self):
+        """Функция сбрасывает изменения отображения на диск."""
+        with self._lock:
+            if self._mmap is not None:
+                self._mmap.flush()
+
+    def close(self):
+        """Функция освобождает отображение и закрывает файл."""
+        with self._lock:
+            self._unmap()
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class RecordView:
+    """Вид файла с записями на момент создания.
+
+    Вид держит собственное отображение файла и видит только записи,
+    которые были в файле при создании вида, в их тогдашнем содержимом.
+    Изменения, сделанные после создания вида через RecordStore этого
+    процесса, в виде не видны. Вид нужно создавать, когда файл
+    не меняется (под блокировкой чтения), и закрывать методом close.
+    """
+
+    def __init__(self, store: RecordStore) -> None:
+        # прежнее содержимое записей, измененных после создания вида
+        self._before: dict[int, bytes] = {}
+        with store._lock:
+            try:
+                store._remap()
+            except FileNotFoundError:
+                pass
+            self.codec = store.codec
+            self.record_size = store.record_size
+            self._header_size = len(store.header)
+            self._count = store._count
+            self._mmap = None
+            self._view = None
+            if self._count > 0:
+                self._mmap = mmap.mmap(
+                    store._file.fileno(),
+                    self._header_size + self._count * self.record_size,
+                    access=mmap.ACCESS_READ
+                    )
+                self._view = memoryview(self._mmap)
+            self._file_id = store._file_id
+        if self._file_id is not None:
+            with _views_lock:
+                _open_views.setdefault(self._file_id, []).append(self)
+
+    def __len__(self) -> int:
+        """Функция возвращает количество записей в виде."""
+        return self._count
+
+    def _preserve(self, number: int, record: bytes):
+        """Функция запоминает прежнее содержимое записи number,
+        если запись есть в виде и еще не менялась.
+        """
+        if number < self._count:
+            self._before.setdefault(number, record)
+
+    def read(self, number: int) -> bytes:
+        """Функция принимает два параметра:
+        - self: экземпляр класса RecordView;
+        - number: номер записи (с нуля).
+        Функция возвращает запись в том виде, в каком она была
+        при создании вида.
+        Либо вызывает исключение IndexError, если такой записи нет.
+        """
+        if number >= self._count:
+            raise IndexError(number)
+        start = self._header_size + number * self.record_size
+        # запись копируется до проверки прежнего содержимого: если
+        # ее изменят между этими шагами, прежнее уже будет сохранено
+        record = bytes(self._view[start:start + self.record_size])
+        count_read(self.record_size, 1)
+        return self._before.get(number, record)
+
+    def values(self, record: Union[bytes, memoryview]) -> list:
+        """Функция возвращает поля записи в виде объектов Python."""
+        return self.codec.values(record)
+
+    def close(self):
+        """Функция закрывает вид: прежнее содержимое записей
+        больше не сохраняется.
+        """
+        if self._file_id is not None:
+            with _views_lock:
+                views = _open_views.get(self._file_id, [])
+                if self in views:
+                    views.remove(self)
+                if not views:
+                    _open_views.pop(self._file_id, None)
+        if self._view is not None:
+            self._view.release()
+            self._mmap.close()
+            self._view = None
+            self._mmap = None
+        self._before.clear()
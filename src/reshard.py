@@ -0,0 +1,141 @@
+"""Модуль для переноса БД в другое количество шардов.
+
+Исходные каталоги - обычный каталог CarService или шарды
+ShardedCarService - читаются потоком, порциями записей, и переносятся
+в новые пустые каталоги шардов: модели копируются во все шарды,
+автомобили и неудаленные продажи - в шарды по vin автомобиля
+(см. sharded_service.py). Индексы, индекс статусов и агрегаты продаж
+новые шарды строят сами при вставке. Удаленные продажи не переносятся.
+Переносить данные нужно, пока с исходными каталогами не работают
+экземпляры CarService.
+
+Запуск из командной строки:
+    python reshard.py <исходные каталоги> --target <каталоги шардов> [--format binary|text]
+"""
+import argparse
+import os
+from contextlib import ExitStack
+
+from bibip_car_service import WAL_FILE, CarService
+from locks import LOCK_ORDER, LockManager
+from models import Car, FileForObject, Model, Sale, construct
+from record_format import FORMAT_VERSIONS, get_codecs
+from record_store import RecordStore
+from sharded_service import ShardedCarService
+
+# сколько записей переносить за одну вставку
+RESHARD_CHUNK_SIZE = 1024
+
+
+def iter_values(path: str, object: FileForObject):
+    """Функция принимает два параметра:
+    - path: путь до файла с записями;
+    - object: тип объекта.
+    Функция по одной возвращает поля записей файла
+    в виде объектов Python.
+    """
+    if not os.path.exists(path):
+        return
+    store = RecordStore(path, codecs=get_codecs(object))
+    try:
+        for record in store.iter_records():
+            yield store.values(record)
+    finally:
+        store.close()
+
+
+def iter_chunks(items, size: int = RESHARD_CHUNK_SIZE):
+    """Функция по одному возвращает списки из size подряд идущих объектов."""
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def reshard(
+        source_paths: list[str],
+        target_paths: list[str],
+        record_format: str = 'text'
+        ) -> dict[FileForObject, int]:
+    """Функция принимает три параметра:
+    - source_paths: исходные каталоги;
+    - target_paths: новые каталоги шардов;
+    - record_format: формат файлов с записями в новых шардах.
+    Функция под блокировками записи исходных каталогов переносит
+    модели, автомобили и неудаленные продажи в новые шарды
+    и возвращает, сколько объектов каждого типа перенесено.
+    Либо вызывает исключение ValueError, если каталог шарда
+    уже содержит записи или совпадает с исходным.
+    """
+    if set(map(os.path.abspath, source_paths)) & set(map(os.path.abspath, target_paths)):
+        raise ValueError('Каталоги шардов должны отличаться от исходных')
+    for path in target_paths:
+        for object in (FileForObject.model, FileForObject.car, FileForObject.sale):
+            if os.path.exists(path + object):
+                raise ValueError(f'Каталог шарда {path} уже содержит записи')
+    # открытие CarService применяет операции из журнала
+    # и завершает прерванное уплотнение исходного каталога
+    for path in source_paths:
+        CarService(path, use_wal=os.path.exists(path + WAL_FILE)).close()
+    moved = {object: 0 for object in (FileForObject.model, FileForObject.car, FileForObject.sale)}
+    target = ShardedCarService(target_paths, record_format=record_format, trusted_reads=True)
+    try:
+        with ExitStack() as stack:
+            for path in source_paths:
+                stack.enter_context(LockManager(path).locked(write=LOCK_ORDER))
+            # исходные шарды хранят одни и те же модели, поэтому
+            # модели, уже добавленные из другого каталога, пропускаются
+            for path in source_paths:
+                models = (
+                    construct(Model, id=model_info[0], name=model_info[1], brand=model_info[2])
+                    for model_info in iter_values(path + FileForObject.model, FileForObject.model)
+                    )
+                for chunk in iter_chunks(models):
+                    moved[FileForObject.model] += sum(
+                        model is not None for model in target.add_models(chunk))
+            for path in source_paths:
+                cars = (
+                    construct(Car, vin=car_info[0], model=car_info[1], price=car_info[2],
+                              date_start=car_info[3], status=car_info[4])
+                    for car_info in iter_values(path + FileForObject.car, FileForObject.car)
+                    )
+                for chunk in iter_chunks(cars):
+                    moved[FileForObject.car] += sum(car is not None for car in target.add_cars(chunk))
+            for path in source_paths:
+                sales = (
+                    construct(Sale, sales_number=sale_info[0], car_vin=sale_info[1],
+                              sales_date=sale_info[2], cost=sale_info[3])
+                    for sale_info in iter_values(path + FileForObject.sale, FileForObject.sale)
+                    if sale_info[4] == 0
+                    )
+                # продажи уже уникальны, поэтому вставляются
+                # в шарды напрямую, без поиска по всем шардам
+                for chunk in iter_chunks(sales):
+                    sales_by_shard = {}
+                    for sale in chunk:
+                        sales_by_shard.setdefault(target.shard_for(sale.car_vin), []).append(sale)
+                    for service, shard_sales in sales_by_shard.items():
+                        moved[FileForObject.sale] += sum(
+                            sale is not None for sale in service.sell_cars(shard_sales))
+    finally:
+        target.close()
+    return moved
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Перенос БД в другое количество шардов')
+    parser.add_argument('source_paths', nargs='+', help='исходные каталоги БД или шардов')
+    parser.add_argument('--target', nargs='+', required=True, dest='target_paths', help='новые каталоги шардов')
+    parser.add_argument('--format', choices=sorted(FORMAT_VERSIONS), default='text', dest='record_format')
+    args = parser.parse_args(argv)
+    moved = reshard(args.source_paths, args.target_paths, args.record_format)
+    for object, count in moved.items():
+        print(f'{object.lstrip("/")}: перенесено {count}')
+
+
+if __name__ == '__main__':
+    main()
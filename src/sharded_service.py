@@ -0,0 +1,489 @@
+"""Модуль для горизонтального разделения БД на несколько каталогов.
+
+ShardedCarService делит автомобили и продажи между N каталогами
+(шардами), например на разных дисках: автомобиль и все его продажи
+хранятся в шарде номер crc32(vin) % N, поэтому хэш одинаков во всех
+процессах и при каждом запуске. Небольшой справочник моделей копируется
+во все шарды, чтобы каждый шард сам находил модели своих автомобилей.
+
+Каждый шард - обычный каталог CarService. Запросы к одному автомобилю
+или продаже выполняются в одном шарде, а запросы по всем автомобилям
+(get_cars, find_cars, top_models_by_sales) выполняются во всех шардах
+параллельно в пуле потоков, после чего результаты объединяются.
+
+Автомобиль не переезжает между шардами при смене vin: если новый vin
+относится к другому шарду, автомобиль и его продажа остаются на месте,
+а в файл 'routes.json' первого шарда записывается, в каком шарде искать
+новый vin. Перенос в новые каталоги (reshard.py) раскладывает автомобили
+по хэшам их текущих vin, и таблица маршрутов снова становится пустой.
+
+В каждом каталоге хранится файл 'shard.json' с номером шарда
+и количеством шардов: открыть каталоги с другим количеством шардов
+или в другом порядке нельзя. Чтобы изменить количество шардов,
+данные переносятся в новые каталоги модулем reshard.py.
+"""
+import heapq
+import json
+import os
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from decimal import Decimal
+from operator import attrgetter
+from typing import Callable, Iterable, Union
+
+from bibip_car_service import RANGE_ORDERS, TOP_MODELS_ORDERS, CarService, rank_models
+from models import Car, CarFullInfo, CarRecord, CarStatus, Model, ModelSaleStats, Sale
+
+SHARD_FILE = '/shard.json'
+# vin автомобилей, переименованных в vin другого шарда -> шард автомобиля
+ROUTES_FILE = '/routes.json'
+
+
+def shard_of(vin: str, shards_count: int) -> int:
+    """Функция принимает два параметра:
+    - vin: идентификатор автомобиля;
+    - shards_count: количество шардов.
+    Функция возвращает номер шарда, в котором хранятся автомобиль
+    и его продажи.
+    """
+    return zlib.crc32(vin.encode()) % shards_count
+
+
+def check_shard_directory(root_directory_path: str, shard: int, shards_count: int):
+    """Функция принимает три параметра:
+    - root_directory_path: каталог шарда;
+    - shard: номер шарда;
+    - shards_count: количество шардов.
+    Функция создает каталог и файл 'shard.json', если их еще нет.
+    Либо вызывает исключение ValueError, если каталог уже размечен
+    как другой шард или шард с другим количеством шардов.
+    """
+    os.makedirs(root_directory_path, exist_ok=True)
+    path = root_directory_path + SHARD_FILE
+    expected = {'shard': shard, 'shards': shards_count}
+    if os.path.exists(path):
+        with open(path, 'r') as file_shard:
+            actual = json.load(file_shard)
+        if actual != expected:
+            raise ValueError(
+                f'Каталог {root_directory_path} - шард {actual["shard"]} из {actual["shards"]}, '
+                f'а не {shard} из {shards_count}'
+                )
+        return
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as file_shard:
+        json.dump(expected, file_shard)
+    os.replace(tmp_path, path)
+
+
+class ShardedCarService:
+    """БД, разделенная по vin автомобилей между несколькими каталогами.
+
+    Параметры service_options передаются CarService каждого шарда.
+    """
+
+    def __init__(
+            self,
+            root_directory_paths: Iterable[str],
+            max_workers: Union[int, None] = None,
+            **service_options
+            ) -> None:
+        root_directory_paths = list(root_directory_paths)
+        if not root_directory_paths:
+            raise ValueError('Нужен хотя бы один каталог шарда')
+        for shard, path in enumerate(root_directory_paths):
+            check_shard_directory(path, shard, len(root_directory_paths))
+        self.root_directory_paths = root_directory_paths
+        self.shards = [CarService(path, **service_options) for path in root_directory_paths]
+        self.trusted_reads = service_options.get('trusted_reads', False)
+        # таблица маршрутов и отметка (inode, время изменения, размер)
+        # ее файла, по которой видны изменения из других процессов
+        self._routes: dict[str, int] = {}
+        self._routes_stamp = None
+        self._routes_lock = threading.Lock()
+        # пул потоков для параллельных запросов ко всем шардам
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers or len(self.shards),
+            thread_name_prefix='bibip-shard'
+            )
+
+    def __len__(self) -> int:
+        """Функция возвращает количество шардов."""
+        return len(self.shards)
+
+    def _load_routes(self) -> dict[str, int]:
+        """Функция принимает один параметр:
+        - self: экземпляр класса ShardedCarService.
+        Функция возвращает таблицу маршрутов vin -> номер шарда,
+        перечитывая файл, только если он изменился.
+        """
+        path = self.root_directory_paths[0] + ROUTES_FILE
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            stamp = None
+        else:
+            stamp = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if stamp != self._routes_stamp:
+            routes = {}
+            if stamp is not None:
+                with open(path, 'r') as file_routes:
+                    routes = json.load(file_routes)
+            self._routes, self._routes_stamp = routes, stamp
+        return self._routes
+
+    def _save_routes(self, routes: dict[str, int]):
+        """Функция принимает два параметра:
+        - self: экземпляр класса ShardedCarService;
+        - routes: новая таблица маршрутов.
+        Функция атомарно заменяет файл с таблицей маршрутов.
+        """
+        path = self.root_directory_paths[0] + ROUTES_FILE
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as file_routes:
+            json.dump(routes, file_routes)
+        os.replace(tmp_path, path)
+        self._load_routes()
+
+    def _shard_of(self, vin: str, routes: dict[str, int]) -> int:
+        """Функция принимает три параметра:
+        - self: экземпляр класса ShardedCarService;
+        - vin: идентификатор автомобиля;
+        - routes: таблица маршрутов.
+        Функция возвращает номер шарда, в котором хранится автомобиль vin.
+        """
+        shard = routes.get(vin)
+        return shard_of(vin, len(self.shards)) if shard is None else shard
+
+    def shard_for(self, vin: str) -> CarService:
+        """Функция возвращает шард, в котором хранится автомобиль vin."""
+        return self.shards[self._shard_of(vin, self._load_routes())]
+
+    def _group_by_shard(self, items: list, get_vin: Callable) -> dict[int, list[int]]:
+        """Функция принимает три параметра:
+        - self: экземпляр класса ShardedCarService;
+        - items: объекты, которые нужно разделить между шардами;
+        - get_vin: функция, возвращающая vin автомобиля объекта.
+        Функция возвращает словарь номер шарда -> позиции объектов
+        этого шарда в items.
+        """
+        routes = self._load_routes()
+        positions_by_shard: dict[int, list[int]] = {}
+        for position, item in enumerate(items):
+            shard = self._shard_of(get_vin(item), routes)
+            positions_by_shard.setdefault(shard, []).append(position)
+        return positions_by_shard
+
+    def _scatter(self, call: Callable, shards: Union[Iterable[int], None] = None) -> list:
+        """Функция принимает три параметра:
+        - self: экземпляр класса ShardedCarService;
+        - call: функция call(номер шарда, шард);
+        - shards: номера шардов (None - все шарды).
+        Функция выполняет call для шардов параллельно и возвращает
+        результаты в порядке номеров шардов.
+        """
+        shards = range(len(self.shards)) if shards is None else list(shards)
+        if len(shards) == 1:
+            return [call(shards[0], self.shards[shards[0]])]
+        futures = [self._executor.submit(call, shard, self.shards[shard]) for shard in shards]
+        return [future.result() for future in futures]
+
+    def _routed(self, items: list, get_vin: Callable, call: Callable) -> list:
+        """Функция принимает четыре параметра:
+        - self: экземпляр класса ShardedCarService;
+        - items: объекты, которые нужно разделить между шардами;
+        - get_vin: функция, возвращающая vin автомобиля объекта;
+        - call: функция call(шард, объекты шарда), возвращающая
+          список результатов той же длины.
+        Функция выполняет call в шардах объектов параллельно и возвращает
+        результаты в порядке объектов в items.
+        """
+        positions_by_shard = self._group_by_shard(items, get_vin)
+        shard_results = self._scatter(
+            lambda shard, service: call(service, [items[i] for i in positions_by_shard[shard]]),
+            sorted(positions_by_shard)
+            )
+        result = [None] * len(items)
+        for shard, results in zip(sorted(positions_by_shard), shard_results):
+            for position, item_result in zip(positions_by_shard[shard], results):
+                result[position] = item_result
+        return result
+
+    def add_model(self, model: Model) -> Union[Model, None]:
+        """Функция принимает два параметра:
+        - self: экземпляр класса ShardedCarService;
+        - model: экземпляр класса Model.
+        Функция добавляет модель во все шарды.
+        Либо возвращает None, если модель уже есть во всех шардах.
+        """
+        return self.add_models([model])[0]
+
+    def add_models(self, models: Iterable[Model]) -> list[Union[Model, None]]:
+        """Функция принимает два параметра:
+        - self: экземпляр класса ShardedCarService;
+        - models: набор экземпляров класса Model.
+        Функция параллельно добавляет новые модели во все шарды.
+        Возвращает список той же длины, что и models: модель, если она
+        добавлена хотя бы в один шард (так восстанавливается копия,
+        не дописанная в часть шардов), или None.
+        """
+        models = list(models)
+        shard_results = self._scatter(lambda shard, service: service.add_models(models))
+        return [
+            next((model for model in results if model is not None), None)
+            for results in zip(*shard_results)
+            ]
+
+    def add_car(self, car: Car) -> Union[Car, None]:
+        """Функция принимает два параметра:
+        - self: экземпляр класса ShardedCarService;
+        - car: экземпляр класса Car.
+        Функция добавляет автомобиль в его шард.
+        Либо возвращает None, если такой авто уже существует в БД.
+        """
+        return self.shard_for(car.vin).add_car(car)
+
+    def add_cars(self, cars: Iterable[Car]) -> list[Union[Car, None]]:
+        """Функция принимает два параметра:
+        - self: экземпляр класса ShardedCarService;
+        - cars: набор экземпляров класса Car.
+        Функция параллельно добавляет автомобили в их шарды
+        (см. CarService.add_cars).
+        """
+        return self._routed(list(cars), attrgetter('vin'), CarService.add_cars)
+
+    def sell_car(self, sale: Sale):
+        """Функция принимает два параметра:
+        - self: экземпляр класса ShardedCarService;
+        - sale: экземпляр класса Sale.
+        Функция сохраняет продажу в шарде проданного автомобиля.
+        """
+        self.sell_cars([sale])
+        return None
+
+    def sell_cars(self, sales: Iterable[Sale]) -> list[Union[Sale, None]]:
+        """Функция принимает два параметра:
+        - self: экземпляр класса ShardedCarService;
+        - sales: набор экземпляров класса Sale.
+        Функция параллельно сохраняет продажи в шардах проданных
+        автомобилей (см. CarService.sell_cars). Продажи, идентификаторы
+        которых уже есть в каком-либо шарде или уже встречались в sales,
+        не сохраняются.
+        Уникальность идентификаторов продаж между шардами проверяется
+        до записи, поэтому одну продажу не нужно одновременно сохранять
+        из нескольких процессов.
+        """
+        sales = list(sales)
+        existing = self._find_sales([sale.sales_number for sale in sales])
+        result = [None] * len(sales)
+        # продажи с одним идентификатором могут относиться к разным
+        # шардам, поэтому повторы отбрасываются до разделения по шардам
+        seen_numbers = set(existing)
+        new_positions = []
+        for position, sale in enumerate(sales):
+            if sale.sales_number not in seen_numbers:
+                seen_numbers.add(sale.sales_number)
+                new_positions.append(position)
+        added = self._routed(
+            [sales[i] for i in new_positions], attrgetter('car_vin'), CarService.sell_cars)
+        for position, sale in zip(new_positions, added):
+            result[position] = sale
+        return result
+
+    def _find_sales(self, sales_numbers: list[str]) -> dict[str, int]:
+        """Функция принимает два параметра:
+        - self: экземпляр класса ShardedCarService;
+        - sales_numbers: идентификаторы продаж.
+        Функция параллельно ищет продажи во всех шардах и возвращает
+        словарь идентификатор продажи -> номер шарда для найденных продаж.
+        """
+        if not sales_numbers:
+            return {}
+        found = {}
+        for shard, sale_vins in enumerate(
+                self._scatter(lambda shard, service: service.get_sale_vins(sales_numbers))):
+            for sales_number in sale_vins:
+                found.setdefault(sales_number, shard)
+        return found
+
+    def update_vin(self, vin: str, new_vin: str):
+        """Функция принимает три параметра:
+        - self: экземпляр класса ShardedCarService;
+        - vin: идентификатор автомобиля, который нужно заменить;
+        - new_vin: новый идентификатор автомобиля.
+        Функция меняет идентификатор автомобиля в его шарде. Если new_vin
+        относится к другому шарду, автомобиль остается на месте, а в таблицу
+        маршрутов записывается его шард.
+        Либо возвращает None, если автомобиль не найден.
+        Таблицу маршрутов меняет один процесс, поэтому переименовывать
+        автомобили одновременно из нескольких процессов не нужно.
+        """
+        with self._routes_lock:
+            routes = self._load_routes()
+            shard = self._shard_of(vin, routes)
+            service = self.shards[shard]
+            if service.get_car_info(vin) is None:
+                return None
+            # маршрут нового vin записывается до переименования, а прежнего
+            # удаляется после: при сбое между ними оба vin ведут в шард
+            # автомобиля, где его найдет только один из них
+            new_routes = dict(routes)
+            if shard_of(new_vin, len(self.shards)) == shard:
+                new_routes.pop(new_vin, None)
+            else:
+                new_routes[new_vin] = shard
+            if new_routes != routes:
+                self._save_routes(new_routes)
+            result = service.update_vin(vin, new_vin)
+            if vin != new_vin and vin in new_routes:
+                del new_routes[vin]
+                self._save_routes(new_routes)
+            return result
+
+    def revert_sale(self, sales_number: str):
+        """Функция принимает два параметра:
+        - self: экземпляр класса ShardedCarService;
+        - sales_number: идентификатор продажи, которую нужно удалить.
+        Функция находит шард с продажей и удаляет ее там
+        (см. CarService.revert_sale).
+        Либо возвращает None, если продажа не найдена.
+        """
+        shard = self._find_sales([sales_number]).get(sales_number)
+        if shard is None:
+            return None
+        return self.shards[shard].revert_sale(sales_number)
+
+    def get_cars(self, status: CarStatus) -> list[Car]:
+        """Функция принимает два параметра:
+        - self: экземпляр класса ShardedCarService;
+        - status: статус автомобиля.
+        Функция параллельно выбирает автомобили со статусом status
+        во всех шардах и возвращает их по порядку шардов, внутри шарда -
+        в порядке расположения в файле.
+        """
+        return [
+            car for cars in self._scatter(lambda shard, service: service.get_cars(status))
+            for car in cars
+            ]
+
+    def get_car_records(self, status: CarStatus) -> list[CarRecord]:
+        """Функция возвращает те же автомобили, что и get_cars,
+        в виде записей CarRecord (см. CarService.get_car_records).
+        """
+        return [
+            record for records in self._scatter(lambda shard, service: service.get_car_records(status))
+            for record in records
+            ]
+
+    def get_car_info(self, vin: str) -> Union[CarFullInfo, None]:
+        """Функция принимает два параметра:
+        - self: экземпляр класса ShardedCarService;
+        - vin: идентификатор автомобиля.
+        Функция возвращает информацию об автомобиле из его шарда.
+        Либо возвращает None, если автомобиль не найден.
+        """
+        return self.shard_for(vin).get_car_info(vin)
+
+    def get_car_infos(self, vins: Iterable[str]) -> dict[str, Union[CarFullInfo, None]]:
+        """Функция принимает два параметра:
+        - self: экземпляр класса ShardedCarService;
+        - vins: идентификаторы автомобилей.
+        Функция параллельно ищет автомобили в их шардах и возвращает
+        словарь vin -> CarFullInfo или None в порядке первого появления
+        vin в vins.
+        """
+        vins = list(dict.fromkeys(vins))
+        infos = self._routed(
+            vins, str,
+            lambda service, shard_vins: list(service.get_car_infos(shard_vins).values())
+            )
+        return dict(zip(vins, infos))
+
+    def find_cars(
+            self,
+            status: Union[CarStatus, None] = None,
+            date_from: Union[datetime, None] = None,
+            date_to: Union[datetime, None] = None,
+            price_min: Union[Decimal, None] = None,
+            price_max: Union[Decimal, None] = None,
+            order_by: Union[str, None] = None,
+            limit: Union[int, None] = None
+            ) -> list[Car]:
+        """Функция принимает те же параметры, что и CarService.find_cars.
+        Функция параллельно ищет до limit автомобилей в каждом шарде
+        и слиянием упорядоченных результатов выбирает первые limit.
+        Либо вызывает исключение ValueError, если order_by неизвестен.
+        """
+        if order_by is None:
+            order_by = ('price' if date_from is None and date_to is None
+                        and (price_min is not None or price_max is not None)
+                        else 'date_start')
+        if order_by not in RANGE_ORDERS:
+            raise ValueError(f'Нельзя упорядочить автомобили по {order_by!r}')
+        shard_cars = self._scatter(lambda shard, service: service.find_cars(
+            status, date_from, date_to, price_min, price_max, order_by, limit))
+        cars = heapq.merge(*shard_cars, key=attrgetter(order_by))
+        return list(cars if limit is None else (car for _, car in zip(range(limit), cars)))
+
+    def get_sales_stats(
+            self,
+            since: Union[datetime, None] = None,
+            until: Union[datetime, None] = None
+            ) -> dict:
+        """Функция принимает три параметра:
+        - self: экземпляр класса ShardedCarService;
+        - since: начало периода включительно (None - без границы);
+        - until: конец периода не включительно (None - без границы).
+        Функция параллельно получает агрегаты продаж за период во всех
+        шардах и складывает их по id модели (см. CarService.get_sales_stats).
+        """
+        sales_stats = {}
+        for shard_stats in self._scatter(
+                lambda shard, service: service.get_sales_stats(since, until)):
+            for model_id, stats in shard_stats.items():
+                if model_id not in sales_stats:
+                    sales_stats[model_id] = stats
+                    continue
+                sales_stats[model_id][0] += stats[0]
+                sales_stats[model_id][1] += stats[1]
+        return sales_stats
+
+    def top_models_by_sales(self) -> list[ModelSaleStats]:
+        """Функция принимает один параметр:
+        - self: экземпляр класса ShardedCarService.
+        Функция по агрегатам продаж всех шардов выбирает три модели,
+        которые продавались чаще всего (см. CarService.top_models_by_sales).
+        """
+        return rank_models(self.get_sales_stats(), 3, 'count', with_revenue=False, trusted=self.trusted_reads)
+
+    def top_models(
+            self,
+            n: int = 3,
+            since: Union[datetime, None] = None,
+            until: Union[datetime, None] = None,
+            by: str = 'count'
+            ) -> list[ModelSaleStats]:
+        """Функция принимает те же параметры, что и CarService.top_models,
+        и возвращает n самых продаваемых за период моделей по продажам
+        всех шардов.
+        Либо вызывает исключение ValueError, если by неизвестен.
+        """
+        if by not in TOP_MODELS_ORDERS:
+            raise ValueError(f'Нельзя упорядочить модели по {by!r}')
+        if n <= 0:
+            return []
+        return rank_models(self.get_sales_stats(since, until), n, by, trusted=self.trusted_reads)
+
+    def compact(self) -> int:
+        """Функция уплотняет файлы с продажами всех шардов
+        и возвращает общее количество освобожденных байт.
+        """
+        return sum(self._scatter(lambda shard, service: service.compact()))
+
+    def close(self):
+        """Функция закрывает шарды и останавливает пул потоков."""
+        self._executor.shutdown()
+        for service in self.shards:
+            service.close()
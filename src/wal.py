@@ -0,0 +1,273 @@
+"""Модуль для журнала упреждающей записи (write-ahead log).
+
+Перед изменением файлов CarService записывает в журнал логическую
+операцию и дожидается ее сброса на диск. Журнал очищается в контрольной
+точке, после того как изменения сброшены на диск в файлах с данными,
+поэтому после сбоя достаточно заново применить операции из журнала.
+Потоки, одновременно ожидающие сброса журнала, обслуживаются одним
+вызовом fsync (group commit).
+
+Журналом владеет один процесс: на время работы он держит на файле
+журнала исключительную блокировку flock, поэтому восстановление
+выполняется, только когда прежний владелец завершился.
+
+Если операцию не удалось сбросить на диск, она не применяется,
+а в журнал дописывается отметка ABORT_OP с ее номером: при восстановлении
+такая операция пропускается.
+
+Номер последней примененной операции хранится в файле
+'<журнал>.applied' вместе с номером последней операции, сброшенной
+на диск контрольной точкой, и идентификатором загрузки системы.
+Файлы с данными меняются через кэш страниц, поэтому после падения
+процесса (система не перезагружалась) все примененные операции уже
+в файлах и повторно не применяются. После перезагрузки доверять можно
+только номеру из контрольной точки.
+"""
+import fcntl
+import json
+import os
+import threading
+from typing import Union
+
+from instrumentation import count_write
+
+# файл с идентификатором текущей загрузки системы (Linux)
+BOOT_ID_PATH = '/proc/sys/kernel/random/boot_id'
+# запись журнала об операции, которая не была применена
+ABORT_OP = 'abort'
+
+
+def get_boot_id() -> Union[str, None]:
+    """Функция возвращает идентификатор текущей загрузки системы.
+    Либо возвращает None, если система его не сообщает.
+    """
+    try:
+        with open(BOOT_ID_PATH, 'r') as file_boot:
+            return file_boot.read().strip()
+    except OSError:
+        return None
+
+
+class WriteAheadLog:
+    """Журнал операций в формате JSON по одной записи на строку."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._synced = threading.Condition(self._lock)
+        self._file = open(path, 'ab')
+        try:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self._file.close()
+            raise RuntimeError(f'Журнал {path} уже используется другим процессом') from None
+        self._boot_id = get_boot_id()
+        self._marker_fd = os.open(path + '.applied', os.O_RDWR | os.O_CREAT, 0o644)
+        self._durable_lsn, applied_lsn, boot_id = self._read_marker()
+        # после перезагрузки системы примененные операции могли не дойти
+        # до диска, поэтому учитывается только контрольная точка
+        self._recovered_lsn = (
+            applied_lsn if boot_id is not None and boot_id == self._boot_id
+            else self._durable_lsn
+            )
+        self._last_lsn = max(self._durable_lsn, applied_lsn)
+        records, valid_size = self._read_records()
+        for record in records:
+            self._last_lsn = max(self._last_lsn, record['lsn'])
+        # недописанный при сбое хвост отрезается, иначе новые записи
+        # окажутся после него и не будут прочитаны
+        if os.fstat(self._file.fileno()).st_size > valid_size:
+            self._file.truncate(valid_size)
+            self._file.seek(valid_size)
+            os.fsync(self._file.fileno())
+        self._synced_lsn = self._last_lsn
+        self._syncing = False
+
+    def _read_marker(self) -> tuple[int, int, Union[str, None]]:
+        """Функция принимает один параметр:
+        - self: экземпляр класса WriteAheadLog.
+        Функция возвращает из файла '<журнал>.applied' номер операции
+        из контрольной точки, номер последней примененной операции
+        и идентификатор загрузки системы, в которой она применена.
+        """
+        data = os.pread(self._marker_fd, 256, 0).decode(errors='replace')
+        try:
+            durable, applied, boot_id = data.split('\n', 1)[0].split(';')
+            return int(durable), int(applied), boot_id or None
+        except ValueError:
+            return 0, 0, None
+
+    def _write_marker(self, applied_lsn: int):
+        """Функция записывает номера операций в файл '<журнал>.applied'.
+        Строка имеет постоянную длину, поэтому пишется на место прежней.
+        """
+        os.pwrite(
+            self._marker_fd,
+            f'{self._durable_lsn:020d};{applied_lsn:020d};{self._boot_id or ""}\n'.encode(),
+            0
+            )
+
+    def _read_records(self) -> tuple[list[dict], int]:
+        """Функция принимает один параметр:
+        - self: экземпляр класса WriteAheadLog.
+        Функция возвращает все записи журнала и размер их начала файла.
+        Недописанная при сбое последняя строка пропускается.
+        """
+        records = []
+        size = 0
+        try:
+            with open(self.path, 'rb') as file_log:
+                for line in file_log:
+                    if not line.endswith(b'\n'):
+                        break
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        break
+                    size += len(line)
+        except FileNotFoundError:
+            pass
+        return records, size
+
+    def operations(self) -> list[dict]:
+        """Функция принимает один параметр:
+        - self: экземпляр класса WriteAheadLog.
+        Функция возвращает записанные с последней контрольной точки
+        операции, которые нужно применить повторно (см. recovered_lsn),
+        в порядке их записи в журнал.
+        """
+        records = [
+            record for record in self._read_records()[0]
+            if record['lsn'] > self._recovered_lsn
+            ]
+        aborted = {record['lsn'] for record in records if record['op'] == ABORT_OP}
+        return [record for record in records if record['lsn'] not in aborted]
+
+    def mark_applied(self, lsn: int):
+        """Функция принимает два параметра:
+        - self: экземпляр класса WriteAheadLog;
+        - lsn: номер операции.
+        Функция запоминает, что операции до lsn включительно применены
+        к файлам с данными. Вызывается в порядке номеров операций.
+        """
+        with self._lock:
+            self._recovered_lsn = max(self._recovered_lsn, lsn)
+            self._write_marker(lsn)
+
+    def mark_durable(self, lsn: int):
+        """Функция принимает два параметра:
+        - self: экземпляр класса WriteAheadLog;
+        - lsn: номер операции.
+        Функция запоминает и сбрасывает на диск, что изменения операций
+        до lsn включительно сброшены на диск в файлах с данными.
+        """
+        with self._lock:
+            self._durable_lsn = lsn
+            self._recovered_lsn = max(self._recovered_lsn, lsn)
+            self._write_marker(self._recovered_lsn)
+            os.fsync(self._marker_fd)
+
+    def append(self, op: str, args: dict) -> int:
+        """Функция принимает три параметра:
+        - self: экземпляр класса WriteAheadLog;
+        - op: название операции;
+        - args: аргументы операции, которые можно сохранить в JSON.
+        Функция дописывает операцию в буфер журнала и возвращает
+        ее номер (lsn). Чтобы операция пережила сбой, нужно вызвать commit.
+        """
+        with self._lock:
+            self._last_lsn += 1
+            lsn = self._last_lsn
+            count_write(self._file.write(
+                json.dumps({'lsn': lsn, 'op': op, 'args': args}).encode() + b'\n'
+                ))
+        return lsn
+
+    def abort(self, lsn: int):
+        """Функция принимает два параметра:
+        - self: экземпляр класса WriteAheadLog;
+        - lsn: номер операции.
+        Функция дописывает в буфер журнала отметку, что операция lsn
+        не применена. Новый номер отметка не занимает, а на диск
+        сбрасывается вместе со следующей операцией.
+        """
+        with self._lock:
+            count_write(self._file.write(
+                json.dumps({'lsn': lsn, 'op': ABORT_OP, 'args': {}}).encode() + b'\n'
+                ))
+
+    def commit(self, lsn: int):
+        """Функция принимает два параметра:
+        - self: экземпляр класса WriteAheadLog;
+        - lsn: номер операции.
+        Функция возвращается, когда операция с номером lsn сброшена на диск.
+        Если сброс уже выполняет другой поток, функция ждет его и, если
+        нужно, выполняет следующий сброс для всех накопившихся операций.
+        """
+        with self._lock:
+            while self._synced_lsn < lsn:
+                if self._syncing:
+                    self._synced.wait()
+                    continue
+                self._syncing = True
+                target_lsn = self._last_lsn
+                self._file.flush()
+                self._lock.release()
+                try:
+                    os.fsync(self._file.fileno())
+                finally:
+                    self._lock.acquire()
+                    self._syncing = False
+                    self._synced.notify_all()
+                self._synced_lsn = max(self._synced_lsn, target_lsn)
+
+    def last_lsn(self) -> int:
+        """Функция возвращает номер последней записанной операции."""
+        with self._lock:
+            return self._last_lsn
+
+    def size(self) -> int:
+        """Функция возвращает текущий размер журнала в байтах."""
+        with self._lock:
+            return self._file.tell()
+
+    def truncate(self):
+        """Функция принимает один параметр:
+        - self: экземпляр класса WriteAheadLog.
+        Функция очищает журнал. Вызывается после того, как все изменения
+        из журнала сброшены на диск в файлах с данными.
+        """
+        with self._lock:
+            self._file.flush()
+            self._file.truncate(0)
+            self._file.seek(0)
+            os.fsync(self._file.fileno())
+            self._synced_lsn = self._last_lsn
+
+    def close(self):
+        """Функция сбрасывает буфер журнала и закрывает файлы,
+        освобождая блокировку журнала.
+        """
+        with self._lock:
+            if self._file.closed:
+                return
+            self._file.flush()
+            self._file.close()
+            os.close(self._marker_fd)
+
+
+def fsync_path(path: str) -> bool:
+    """Функция принимает один параметр:
+    - path: путь до файла или каталога.
+    Функция сбрасывает файл или каталог на диск.
+    Возвращает False, если такого пути нет.
+    """
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except FileNotFoundError:
+        return False
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+    return True
@@ -0,0 +1,80 @@
+import asyncio
+import threading
+import time
+from datetime import datetime
+from decimal import Decimal
+
+from async_service import AsyncCarService
+from bibip_car_service import CarService
+from models import Car, CarStatus, Model, Sale
+
+
+class TestAsyncCarService:
+    def _make_service(self, tmpdir: str) -> CarService:
+        service = CarService(tmpdir)
+        service.add_model(Model(id=1, name="Optima", brand="Kia"))
+        service.add_car(
+            Car(
+                vin="KNAGM4A77D5316538",
+                model=1,
+                price=Decimal("2000"),
+                date_start=datetime(2024, 2, 8),
+                status=CarStatus.available,
+            )
+        )
+        return service
+
+    def test_mirrors_car_service(self, tmpdir: str) -> None:
+        async def scenario() -> None:
+            service = AsyncCarService(self._make_service(tmpdir))
+            await service.sell_car(
+                Sale(
+                    sales_number="20240903#KNAGM4A77D5316538",
+                    car_vin="KNAGM4A77D5316538",
+                    sales_date=datetime(2024, 9, 3),
+                    cost=Decimal("2000"),
+                )
+            )
+            info = await service.get_car_info("KNAGM4A77D5316538")
+            assert info.status == CarStatus.sold
+            assert [stats.car_model_name for stats in await service.top_models_by_sales()] == ["Optima"]
+
+            await service.revert_sale("20240903#KNAGM4A77D5316538")
+            await service.update_vin("KNAGM4A77D5316538", "KNAGM4A77D5316539")
+            assert [car.vin for car in await service.get_cars(CarStatus.available)] == ["KNAGM4A77D5316539"]
+            await service.close()
+
+        asyncio.run(scenario())
+
+    def test_identical_reads_are_coalesced(self, tmpdir: str) -> None:
+        car_service = self._make_service(tmpdir)
+        get_car_info = car_service.get_car_info
+        calls = []
+
+        def slow_get_car_info(vin: str):
+            calls.append(threading.get_ident())
+            time.sleep(0.05)
+            return get_car_info(vin)
+
+        car_service.get_car_info = slow_get_car_info
+
+        async def scenario() -> None:
+            service = AsyncCarService(car_service, max_workers=8)
+            results = await asyncio.gather(*(service.get_car_info("KNAGM4A77D5316538") for _ in range(10)))
+            assert len(calls) == 1
+            assert all(result.status == CarStatus.available for result in results)
+            # каждый ожидающий получает свою копию результата
+            assert len({id(result) for result in results}) == len(results)
+            results[0].price = Decimal("1")
+            assert results[1].price != Decimal("1")
+
+            # чтение, начатое после изменения, не получает старый результат
+            first = asyncio.ensure_future(service.get_car_info("KNAGM4A77D5316538"))
+            await asyncio.sleep(0)
+            await service.update_vin("KNAGM4A77D5316538", "KNAGM4A77D5316539")
+            assert await service.get_car_info("KNAGM4A77D5316538") is None
+            await first
+            assert len(calls) == 3
+            await service.close()
+
+        asyncio.run(scenario())
@@ -0,0 +1,27 @@
+from benchmarks.compare import compare
+from benchmarks.generators import generate_cars, make_vin
+from benchmarks.run_benchmarks import run_scale
+
+
+class TestBenchmarks:
+    def test_vins_are_unique_and_valid(self) -> None:
+        vins = [make_vin(number) for number in range(10_000)]
+        assert len(set(vins)) == len(vins)
+        assert all(len(vin) == 17 and not set(vin) & set("IOQ") for vin in vins)
+        assert [car.vin for car in generate_cars(5, 3, 10)] == vins[5:8]
+
+    def test_run_scale_reports_every_operation(self, tmpdir: str) -> None:
+        results = run_scale(tmpdir + "/", scale=200, samples=20, repeats=2)
+        operations = {result["operation"]: result for result in results}
+        assert set(operations) >= {
+            "add_car", "sell_car", "get_cars", "get_car_info",
+            "update_vin", "revert_sale", "top_models_by_sales",
+        }
+        assert operations["add_car"]["ops"] == 20
+        assert operations["get_cars"]["ops"] == 2
+        assert all(result["p50_ms"] <= result["p99_ms"] for result in results)
+
+        report = {"results": results}
+        slower = {"results": [dict(result, ops_per_sec=result["ops_per_sec"] / 2) for result in results]}
+        assert compare(report, report)[1] is False
+        assert compare(report, slower)[1] is True
@@ -0,0 +1,91 @@
+from collections import defaultdict
+from decimal import Decimal
+
+import pytest
+
+from benchmarks.generators import generate_cars, generate_models, make_car, make_sale, make_vin
+from bibip_car_service import CarService
+from models import CarStatus, FileForObject
+
+np = pytest.importorskip("numpy")
+
+import columnar  # noqa: E402
+
+
+class TestColumnarSnapshot:
+    def _fill(self, service: CarService) -> list:
+        models = generate_models(7)
+        service.add_models(models)
+        service.add_cars(generate_cars(0, 300, len(models)))
+        sales = [
+            make_sale(number, make_vin(number))
+            for number in range(0, 300, 3)
+            if make_car(number, len(models)).status == CarStatus.available
+        ]
+        service.sell_cars(sales)
+        for sale in sales[:5]:
+            service.revert_sale(sale.sales_number)
+        return sales[5:]
+
+    @pytest.mark.parametrize("record_format", ["text", "binary"])
+    def test_aggregates_match_sales(self, tmpdir: str, record_format: str) -> None:
+        service = CarService(tmpdir, record_format=record_format)
+        sales = self._fill(service)
+        snapshot = service.export_columnar()
+
+        cars = {number: make_car(number, 7) for number in range(300)}
+        car_by_vin = {make_vin(number): car for number, car in cars.items()}
+        models = {model.id: model for model in generate_models(7)}
+        by_model = defaultdict(lambda: [0, Decimal(0)])
+        by_brand = defaultdict(lambda: [0, Decimal(0)])
+        by_month = defaultdict(lambda: [0, Decimal(0)])
+        days = []
+        for sale in sales:
+            car = car_by_vin[sale.car_vin]
+            for groups, key in ((by_model, car.model), (by_brand, models[car.model].brand),
+                                (by_month, f"{sale.sales_date:%Y-%m}")):
+                groups[key][0] += 1
+                groups[key][1] += sale.cost
+            days.append((sale.sales_date - car.date_start).total_seconds() / 86400)
+
+        assert len(snapshot) == 300
+        assert columnar.revenue_by_model(snapshot) == {key: tuple(value) for key, value in by_model.items()}
+        assert columnar.revenue_by_brand(snapshot) == {key: tuple(value) for key, value in by_brand.items()}
+        assert columnar.revenue_by_month(snapshot) == {key: tuple(value) for key, value in by_month.items()}
+        assert columnar.average_days_to_sale(snapshot) == pytest.approx(sum(days) / len(days))
+        assert columnar.status_counts(snapshot)[CarStatus.sold] == len(sales)
+        # столбцы отображены в память
+        assert isinstance(snapshot["cars_price"], np.memmap)
+
+    def test_snapshot_is_rebuilt_only_after_changes(self, tmpdir: str) -> None:
+        service = CarService(tmpdir)
+        sales = self._fill(service)
+        service.export_columnar()
+        assert service.stats()["export_columnar"].bytes_written > 0
+
+        service.reset_stats()
+        service.export_columnar()
+        assert service.stats()["export_columnar"].bytes_written == 0
+
+        service.revert_sale(sales[0].sales_number)
+        snapshot = service.export_columnar()
+        assert service.stats()["export_columnar"].bytes_written > 0
+        assert columnar.status_counts(snapshot)[CarStatus.sold] == len(sales) - 1
+
+    def test_empty_database(self, tmpdir: str) -> None:
+        snapshot = CarService(tmpdir).export_columnar()
+        assert len(snapshot) == 0
+        assert columnar.revenue_by_model(snapshot) == {}
+        assert columnar.revenue_by_brand(snapshot) == {}
+        assert columnar.average_days_to_sale(snapshot) is None
+
+    def test_legacy_text_values(self, tmpdir: str) -> None:
+        service = CarService(tmpdir)
+        self._fill(service)
+        car = make_car(0, 7)
+        # запись, сохраненная в текстовом формате до появления проверки цен
+        service._write_record(FileForObject.car, 0, [
+            car.vin, car.model, "1999.995", "2024-02-20T00:00:00+03:00", car.status.value])
+        snapshot = service.export_columnar()
+        assert snapshot["cars_price"][0] == 200000
+        assert snapshot["cars_date_start"][0] == np.datetime64("2024-02-19T21:00:00")
@@ -0,0 +1,25 @@
+from lru_cache import MISSING, LruCache
+
+
+class TestLruCache:
+    def test_evicts_least_recently_used(self) -> None:
+        cache = LruCache(2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        assert cache.get("a") == 1
+        cache.put("c", 3)
+        assert cache.get("b") is MISSING
+        assert cache.get("c") == 3
+        cache.pop("c")
+        assert cache.get("c") is MISSING
+
+        stats = cache.stats()
+        assert (stats.hits, stats.misses, stats.evictions, stats.size) == (2, 2, 1, 1)
+        cache.reset_stats()
+        assert cache.stats().hits == 0
+
+    def test_zero_size_stores_nothing(self) -> None:
+        cache = LruCache(0)
+        cache.put("a", 1)
+        assert cache.get("a") is MISSING
+        assert cache.stats().size == 0
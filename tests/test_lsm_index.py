@@ -0,0 +1,63 @@
+import os
+
+from disk_index import get_entry_size
+from lsm_index import LsmIndex
+from models import FileIndexForObject
+
+
+class TestLsmIndex:
+    def test_reinserted_key_is_visible(self, tmpdir: str) -> None:
+        index = LsmIndex(os.path.join(tmpdir, "cars_index.txt"), FileIndexForObject.car, memtable_limit=1)
+        index.put("A", 5)
+        index.delete("A")
+        index.put("A", 7)
+        index.put("B", 1)
+        assert list(index.iter_after()) == [("A", 7), ("B", 1)]
+        assert index.get("A") == 7
+
+    def test_runs_are_merged_by_levels(self, tmpdir: str) -> None:
+        path = os.path.join(tmpdir, "cars_index.txt")
+        index = LsmIndex(path, FileIndexForObject.car, memtable_limit=4, max_runs=3)
+        expected = {}
+        base_rewrites = 0
+        base_signature = None
+        for number in range(2000):
+            key = f"VIN{number * 7919 % 2000:014d}"
+            if number % 5 == 4:
+                index.delete(key)
+                expected.pop(key, None)
+            else:
+                index.put(key, number + 1)
+                expected[key] = number + 1
+            if os.path.exists(path) and os.stat(path).st_ino != base_signature:
+                base_signature = os.stat(path).st_ino
+                base_rewrites += 1
+            # файлов не больше (max_runs - 1) на уровень
+            assert len(index.paths()) - 3 <= 2 * 6
+
+        # основной файл переписывается все реже по мере роста индекса,
+        # а не после каждых max_runs сброшенных таблиц
+        assert base_rewrites <= 20
+        assert dict(index.iter_after()) == expected
+        assert all(index.get(key) == line_number for key, line_number in expected.items())
+        index.merge()
+        assert index.paths()[3:] == []
+        assert dict(index.iter_after()) == expected
+
+    def test_files_are_replaced_not_rewritten(self, tmpdir: str) -> None:
+        path = os.path.join(tmpdir, "cars_index.txt")
+        index = LsmIndex(path, FileIndexForObject.car, memtable_limit=2)
+        index.put("A", 1)
+        with open(path + ".memtable", "rb") as old_memtable:
+            index.put("B", 2)
+            # сброшенный журнал заменен пустым, открытый файл не изменился
+            assert os.path.getsize(path + ".memtable") == 0
+            assert len(old_memtable.read()) == 2 * get_entry_size(FileIndexForObject.car)
+
+        # запись, недописанная при сбое, не читается и отрезается
+        with open(path + ".memtable", "ab") as memtable:
+            memtable.write(b"C" * 10)
+        assert LsmIndex(path, FileIndexForObject.car).get("C") is None
+        index.put("D", 4)
+        assert os.path.getsize(path + ".memtable") % get_entry_size(FileIndexForObject.car) == 0
+        assert dict(LsmIndex(path, FileIndexForObject.car).iter_after()) == {"A": 1, "B": 2, "D": 4}
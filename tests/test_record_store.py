@@ -0,0 +1,63 @@
+import os
+from datetime import datetime
+from decimal import Decimal
+
+import pytest
+
+from models import CarStatus, FileForObject
+from record_format import BINARY_VERSION, get_codecs
+from record_store import RECORD_SIZE, RecordStore, decode_record, encode_record
+
+
+class TestRecordStore:
+    def test_read_write_append(self, tmpdir: str) -> None:
+        store = RecordStore(os.path.join(tmpdir, "cars.txt"))
+
+        with pytest.raises(FileNotFoundError):
+            store.read(0)
+        assert len(store) == 0
+
+        assert store.append(encode_record(["A", 1]) + encode_record(["B", 2])) == 0
+        assert store.append(encode_record(["C", 3])) == 2
+        assert len(store) == 3
+
+        record = store.read(1)
+        assert isinstance(record, memoryview)
+        assert decode_record(record) == ["B", "2"]
+
+        store.write(1, encode_record(["B", 20]))
+        with open(os.path.join(tmpdir, "cars.txt"), "rb") as file_cars:
+            file_cars.seek(RECORD_SIZE)
+            assert file_cars.read(RECORD_SIZE).rstrip() == b"B;20"
+
+        assert [decode_record(record)[0] for record in store.iter_records(1)] == ["B", "C"]
+        store.close()
+
+    def test_multibyte_fields_keep_record_size(self) -> None:
+        record = encode_record([1, "Гранта", "Лада"])
+
+        assert len(record) == RECORD_SIZE
+        assert decode_record(record) == ["1", "Гранта", "Лада"]
+
+        with pytest.raises(ValueError):
+            encode_record(["x" * RECORD_SIZE])
+
+    def test_binary_records_with_header(self, tmpdir: str) -> None:
+        path = os.path.join(tmpdir, "cars.txt")
+        store = RecordStore(path, codecs=get_codecs(FileForObject.car), new_version=BINARY_VERSION)
+        fields = ["KNAGM4A77D5316538", 1, Decimal("2276.65"), datetime(2024, 5, 17), CarStatus.reserve]
+
+        store.append(store.encode(fields))
+        assert store.record_size == 49
+        assert os.path.getsize(path) == len(store.header) + 49
+        assert store.values(store.read(0)) == fields
+        assert store.decode(store.read(0)) == ["KNAGM4A77D5316538", "1", "2276.65", "2024-05-17 00:00:00", "reserve"]
+        with pytest.raises(ValueError):
+            store.encode(["KNAGM4A77D5316538", 1, Decimal("0.001"), datetime(2024, 5, 17), CarStatus.reserve])
+        store.close()
+
+        # формат существующего файла определяется по заголовку
+        reopened = RecordStore(path, codecs=get_codecs(FileForObject.car))
+        assert len(reopened) == 1
+        assert reopened.codec.version == BINARY_VERSION
+        reopened.close()
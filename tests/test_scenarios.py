@@ -1,10 +1,23 @@
+import multiprocessing
+import os
+import threading
 from datetime import datetime
 from decimal import Decimal
 
 import pytest
 
 from bibip_car_service import CarService
-from models import Car, CarFullInfo, CarStatus, Model, ModelSaleStats, Sale
+from instrumentation import ProfileHook
+from migrate_records import migrate_directory
+from models import Car, CarFullInfo, CarStatus, FileForObject, FileIndexForObject, Model, ModelSaleStats, Sale
+import record_store
+
+
+def _remove_index(directory: str, name: str) -> None:
+    """Удаляет файл индекса вместе с файлами его LSM-дерева."""
+    for file_name in os.listdir(directory):
+        if file_name == name or file_name.startswith(name + "."):
+            os.remove(os.path.join(directory, file_name))
 
 
 @pytest.fixture
@@ -290,3 +303,930 @@ class TestCarServiceScenarios:
             ModelSaleStats(car_model_name="Pathfinder", brand="Nissan", sales_number=1),
         ]
         assert service.top_models_by_sales() == top_3_models
+
+    def test_index_lookup_uses_cache(self, tmpdir: str, car_data: list[Car], model_data: list[Model], monkeypatch):
+        import bibip_car_service
+
+        service = CarService(tmpdir)
+
+        self._fill_initial_data(service, car_data, model_data)
+
+        opened_files = []
+
+        def tracking_open(path, *args, **kwargs):
+            opened_files.append(path)
+            return open(path, *args, **kwargs)
+
+        monkeypatch.setattr(bibip_car_service, "open", tracking_open, raising=False)
+
+        assert service.get_car_info("KNAGM4A77D5316538") is not None
+        assert not [path for path in opened_files if path.endswith("_index.txt")]
+
+    def test_index_cache_sees_other_writer(self, tmpdir: str, car_data: list[Car], model_data: list[Model]):
+        service = CarService(tmpdir)
+        other_service = CarService(tmpdir)
+
+        self._fill_initial_data(service, car_data[:-1], model_data)
+
+        assert service.get_car_info(car_data[-1].vin) is None
+
+        other_service.add_car(car_data[-1])
+
+        res = service.get_car_info(car_data[-1].vin)
+        assert res is not None
+        assert res.status == CarStatus.delivery
+
+    def test_bulk_ingest_reports_duplicates(self, tmpdir: str, car_data: list[Car], model_data: list[Model]):
+        service = CarService(tmpdir)
+
+        assert service.add_models(model_data + model_data[:1]) == model_data + [None]
+        assert service.add_car(car_data[0]) == car_data[0]
+        assert service.add_cars(car_data + car_data[-1:]) == [None] + car_data[1:] + [None]
+
+        sales = [
+            Sale(
+                sales_number="20240903#KNAGM4A77D5316538",
+                car_vin="KNAGM4A77D5316538",
+                sales_date=datetime(2024, 9, 3),
+                cost=Decimal("1999.09"),
+            ),
+            Sale(
+                sales_number="20240903#KNAGH4A48A5414970",
+                car_vin="KNAGH4A48A5414970",
+                sales_date=datetime(2024, 9, 4),
+                cost=Decimal("2100"),
+            ),
+        ]
+        assert service.sell_cars(sales + sales[:1]) == sales + [None]
+
+        for car in car_data:
+            res = service.get_car_info(car.vin)
+            assert res is not None
+            if car.vin in ("KNAGM4A77D5316538", "KNAGH4A48A5414970"):
+                assert res.status == CarStatus.sold
+            else:
+                assert res.status == car.status
+
+    def test_sales_by_car_index_rebuilds_when_missing(
+            self, tmpdir: str, car_data: list[Car], model_data: list[Model]):
+        service = CarService(tmpdir)
+
+        self._fill_initial_data(service, car_data, model_data)
+
+        first_sale = Sale(
+            sales_number="20240903#KNAGM4A77D5316538",
+            car_vin="KNAGM4A77D5316538",
+            sales_date=datetime(2024, 9, 3),
+            cost=Decimal("2999.99"),
+        )
+        second_sale = Sale(
+            sales_number="20240910#KNAGM4A77D5316538",
+            car_vin="KNAGM4A77D5316538",
+            sales_date=datetime(2024, 9, 10),
+            cost=Decimal("3100"),
+        )
+        service.sell_car(first_sale)
+        service.revert_sale(first_sale.sales_number)
+        service.sell_car(second_sale)
+
+        _remove_index(tmpdir, "sales_car_index.txt")
+
+        res = CarService(tmpdir).get_car_info("KNAGM4A77D5316538")
+        assert res is not None
+        assert res.sales_date == second_sale.sales_date
+        assert res.sales_cost == second_sale.cost
+        assert os.path.exists(os.path.join(tmpdir, "sales_car_index.txt"))
+
+        service.revert_sale(second_sale.sales_number)
+
+        res = service.get_car_info("KNAGM4A77D5316538")
+        assert res is not None
+        assert res.sales_date is None
+        assert res.sales_cost is None
+
+    def test_sales_aggregates_follow_revert_and_rebuild(
+            self, tmpdir: str, car_data: list[Car], model_data: list[Model]):
+        service = CarService(tmpdir)
+
+        self._fill_initial_data(service, car_data, model_data)
+
+        service.sell_cars([
+            Sale(
+                sales_number="20240903#KNAGM4A77D5316538",
+                car_vin="KNAGM4A77D5316538",
+                sales_date=datetime(2024, 9, 3),
+                cost=Decimal("1999.09"),
+            ),
+            Sale(
+                sales_number="20240904#JM1BL1M58C1614725",
+                car_vin="JM1BL1M58C1614725",
+                sales_date=datetime(2024, 9, 4),
+                cost=Decimal("2334"),
+            ),
+            Sale(
+                sales_number="20240905#JM1BL1L83C1660152",
+                car_vin="JM1BL1L83C1660152",
+                sales_date=datetime(2024, 9, 5),
+                cost=Decimal("451"),
+            ),
+        ])
+        service.revert_sale("20240904#JM1BL1M58C1614725")
+
+        expected = [
+            ModelSaleStats(car_model_name="Optima", brand="Kia", sales_number=1),
+            ModelSaleStats(car_model_name="3", brand="Mazda", sales_number=1),
+        ]
+        assert service.top_models_by_sales() == expected
+
+        os.remove(os.path.join(tmpdir, "sales_stats.txt"))
+        rebuilt = CarService(tmpdir)
+        assert rebuilt.top_models_by_sales() == expected
+        assert rebuilt.rebuild_sales_aggregates()[3][:2] == [1, Decimal("451")]
+
+    def test_revert_sale_after_update_vin(
+            self, tmpdir: str, car_data: list[Car], model_data: list[Model]) -> None:
+        service = CarService(tmpdir)
+        self._fill_initial_data(service, car_data, model_data)
+        service.sell_car(Sale(sales_number="S1", car_vin="KNAGM4A77D5316538",
+                              sales_date=datetime(2024, 9, 1), cost=Decimal("1000")))
+        service.update_vin("KNAGM4A77D5316538", "KNAGM4A77D5316539")
+        assert service.get_car_info("KNAGM4A77D5316539").sales_date == datetime(2024, 9, 1)
+
+        service.revert_sale("S1")
+        assert service.get_car_info("KNAGM4A77D5316539").status == CarStatus.available
+        assert service.top_models_by_sales() == []
+        assert service.rebuild_sales_aggregates() == {}
+
+        # более ранняя продажа повторно проданного авто
+        for number, day in (("S2", 2), ("S3", 3)):
+            service.sell_car(Sale(sales_number=number, car_vin="KNAGM4A77D5316539",
+                                  sales_date=datetime(2024, 9, day), cost=Decimal("1000")))
+        service.update_vin("KNAGM4A77D5316539", "KNAGM4A77D5316540")
+        service.revert_sale("S2")
+        assert service.top_models_by_sales() == [
+            ModelSaleStats(car_model_name="Optima", brand="Kia", sales_number=1)]
+        assert CarService(tmpdir).rebuild_sales_aggregates()[1][:2] == [1, Decimal("1000")]
+
+    def test_on_disk_index_search(self, tmpdir: str, car_data: list[Car], model_data: list[Model]):
+        service = CarService(tmpdir, index_in_memory=False)
+
+        self._fill_initial_data(service, car_data, model_data)
+        service.merge_indexes()
+        index_stat = os.stat(os.path.join(tmpdir, "cars_index.txt"))
+
+        sale = Sale(
+            sales_number="20240903#KNAGM4A77D5316538",
+            car_vin="KNAGM4A77D5316538",
+            sales_date=datetime(2024, 9, 3),
+            cost=Decimal("2999.99"),
+        )
+        service.sell_car(sale)
+        service.update_vin("KNAGH4A48A5414970", "UPDGH4A48A5414970")
+        # изменения дописываются в LSM-дерево, основной файл не переписывается
+        after_stat = os.stat(os.path.join(tmpdir, "cars_index.txt"))
+        assert (after_stat.st_ino, after_stat.st_size, after_stat.st_mtime_ns) == (
+            index_stat.st_ino, index_stat.st_size, index_stat.st_mtime_ns)
+
+        service.merge_indexes()
+        with open(os.path.join(tmpdir, "cars_index.txt"), "rb") as file_index:
+            lines = file_index.readlines()
+        assert len({len(line) for line in lines}) == 1
+        assert [line.split(b";")[0].rstrip().decode() for line in lines] == sorted(
+            car.vin if car.vin != "KNAGH4A48A5414970" else "UPDGH4A48A5414970" for car in car_data
+        )
+
+        in_memory_service = CarService(tmpdir)
+        for car in car_data:
+            assert service.get_car_info(car.vin) == in_memory_service.get_car_info(car.vin)
+        assert service.get_car_info("KNAGM4A77D5316538").sales_cost == sale.cost
+        assert service.get_car_info("UPDGH4A48A5414970") is not None
+
+        service.revert_sale(sale.sales_number)
+        assert service.get_car_info("KNAGM4A77D5316538").status == CarStatus.available
+
+    @pytest.mark.parametrize("index_in_memory", [True, False])
+    def test_non_ascii_keys_survive_reopen(self, tmpdir: str, model_data: list[Model], index_in_memory: bool):
+        service = CarService(tmpdir, index_in_memory=index_in_memory)
+        service.add_model(model_data[0])
+        vins = ["AAA", "ЯЯ", "ZZZ"]
+        for vin in vins:
+            service.add_car(Car(vin=vin, model=model_data[0].id, price=Decimal("100"),
+                                date_start=datetime(2024, 1, 1), status=CarStatus.available))
+        service.sell_car(Sale(sales_number="№1#ЯЯ", car_vin="ЯЯ",
+                              sales_date=datetime(2024, 2, 1), cost=Decimal("90")))
+        service.close()
+
+        # ключи длиннее в байтах, чем в символах, не сдвигают записи индекса
+        for _ in range(2):
+            service = CarService(tmpdir, index_in_memory=index_in_memory)
+            assert [service.get_car_info(vin).vin for vin in vins] == vins
+            assert service.get_car_info("ЯЯ").sales_cost == Decimal("90")
+            service.merge_indexes()
+            service.close()
+        service = CarService(tmpdir, index_in_memory=index_in_memory)
+        service.revert_sale("№1#ЯЯ")
+        assert service.get_car_info("ЯЯ").status == CarStatus.available
+        service.close()
+
+    def test_legacy_index_files_are_converted(self, tmpdir: str, car_data: list[Car], model_data: list[Model]):
+        self._fill_initial_data(CarService(tmpdir), car_data, model_data)
+
+        for index_in_memory in (True, False):
+            # индекс в прежнем формате 'ключ;строка' переменной длины
+            with open(os.path.join(tmpdir, "cars_index.txt"), "w") as file_index:
+                for vin, line_number in sorted((car.vin, i) for i, car in enumerate(car_data, start=1)):
+                    file_index.write(f"{vin};{line_number}\n")
+
+            service = CarService(tmpdir, index_in_memory=index_in_memory)
+            assert service.get_car_info("KNAGM4A77D5316538") is not None
+            service.update_vin("KNAGM4A77D5316538", "UPDGM4A77D5316538")
+            assert service.get_car_info("KNAGM4A77D5316538") is None
+            assert service.get_car_info("UPDGM4A77D5316538") is not None
+            assert service.get_car_info("VF1LZL2T4BC242298") is not None
+            service.update_vin("UPDGM4A77D5316538", "KNAGM4A77D5316538")
+
+    def test_get_cars_reads_only_matching_records(
+            self, tmpdir: str, car_data: list[Car], model_data: list[Model]):
+        service = CarService(tmpdir)
+
+        self._fill_initial_data(service, car_data, model_data)
+
+        service.sell_car(
+            Sale(
+                sales_number="20240903#VF1LZL2T4BC242298",
+                car_vin="VF1LZL2T4BC242298",
+                sales_date=datetime(2024, 9, 3),
+                cost=Decimal("2280.76"),
+            )
+        )
+
+        os.remove(os.path.join(tmpdir, "cars_status_index.txt"))
+        service = CarService(tmpdir)
+        assert service.get_cars(CarStatus.delivery) == []
+
+        cars = service._get_store(FileForObject.car)
+        read_lines = []
+        original_read = cars.read
+
+        def tracking_read(number):
+            read_lines.append(number)
+            return original_read(number)
+
+        cars.read = tracking_read
+        reserved = [car for car in car_data if car.status == CarStatus.reserve]
+        assert service.get_cars(CarStatus.reserve) == reserved
+        assert len(read_lines) == len(reserved)
+        assert [car.vin for car in service.get_cars(CarStatus.sold)] == ["VF1LZL2T4BC242298"]
+
+    def test_iter_cars_and_pages(self, tmpdir: str, car_data: list[Car], model_data: list[Model]):
+        self._fill_initial_data(CarService(tmpdir), car_data, model_data)
+
+        for index_in_memory in (True, False):
+            service = CarService(tmpdir, index_in_memory=index_in_memory)
+
+            cars = service.iter_cars(CarStatus.available, chunk_size=2)
+            first_car = next(cars)
+            assert [first_car, *cars] == service.get_cars(CarStatus.available)
+            assert list(service.iter_cars()) == car_data
+
+            available_vins = sorted(car.vin for car in car_data if car.status == CarStatus.available)
+            seen_vins = []
+            cursor = None
+            while True:
+                page = service.get_cars_page(CarStatus.available, cursor=cursor, limit=3)
+                assert len(page.cars) <= 3
+                seen_vins.extend(car.vin for car in page.cars)
+                cursor = page.next_cursor
+                if cursor is None:
+                    break
+            assert seen_vins == available_vins
+
+    def _sell_and_revert(self, service: CarService) -> None:
+        for day, vin in enumerate(["KNAGM4A77D5316538", "KNAGH4A48A5414970", "JM1BL1TFXD1734246"], start=1):
+            service.sell_car(
+                Sale(
+                    sales_number=f"2024090{day}#{vin}",
+                    car_vin=vin,
+                    sales_date=datetime(2024, 9, day),
+                    cost=Decimal("2000"),
+                )
+            )
+        service.revert_sale("20240901#KNAGM4A77D5316538")
+        service.revert_sale("20240902#KNAGH4A48A5414970")
+
+    def test_compact_drops_reverted_sales(self, tmpdir: str, car_data: list[Car], model_data: list[Model]):
+        service = CarService(tmpdir)
+
+        self._fill_initial_data(service, car_data, model_data)
+        self._sell_and_revert(service)
+
+        assert service.compact() == 2 * 500
+        assert os.path.getsize(os.path.join(tmpdir, "sales.txt")) == 500
+
+        for other_service in (service, CarService(tmpdir, index_in_memory=False)):
+            res = other_service.get_car_info("JM1BL1TFXD1734246")
+            assert res.sales_date == datetime(2024, 9, 3)
+            assert other_service.get_car_info("KNAGM4A77D5316538").sales_date is None
+
+        service.revert_sale("20240903#JM1BL1TFXD1734246")
+        assert service.get_car_info("JM1BL1TFXD1734246").status == CarStatus.available
+        assert service.compact() == 500
+
+    def test_sales_reuse_free_slots(self, tmpdir: str, car_data: list[Car], model_data: list[Model]):
+        service = CarService(tmpdir, reuse_free_slots=True)
+
+        self._fill_initial_data(service, car_data, model_data)
+        self._sell_and_revert(service)
+
+        service.sell_car(
+            Sale(
+                sales_number="20240910#5N1CR2MN9EC641864",
+                car_vin="5N1CR2MN9EC641864",
+                sales_date=datetime(2024, 9, 10),
+                cost=Decimal("3100"),
+            )
+        )
+
+        assert os.path.getsize(os.path.join(tmpdir, "sales.txt")) == 3 * 500
+        assert service.get_car_info("5N1CR2MN9EC641864").sales_cost == Decimal("3100")
+        assert service.get_car_info("JM1BL1TFXD1734246").sales_cost == Decimal("2000")
+
+        # экземпляр без reuse_free_slots освободившиеся места не запоминает
+        free_path = os.path.join(tmpdir, "sales_free.txt")
+        free_size = os.path.getsize(free_path)
+        CarService(tmpdir).revert_sale("20240910#5N1CR2MN9EC641864")
+        assert os.path.getsize(free_path) == free_size
+        # занятое место и строка, недописанная при сбое, пропускаются
+        live_line = service._get_line_number_by_identifier(
+            "20240903#JM1BL1TFXD1734246", FileIndexForObject.sale) + 1
+        with open(free_path, "w") as file_free:
+            file_free.write(f"{live_line}\n1")
+        service.sell_car(
+            Sale(
+                sales_number="20240911#5N1CR2MN9EC641864",
+                car_vin="5N1CR2MN9EC641864",
+                sales_date=datetime(2024, 9, 11),
+                cost=Decimal("3200"),
+            )
+        )
+        assert os.path.getsize(os.path.join(tmpdir, "sales.txt")) == 4 * 500
+        assert os.path.getsize(free_path) == 0
+        assert service.get_car_info("5N1CR2MN9EC641864").sales_cost == Decimal("3200")
+        assert service.get_car_info("JM1BL1TFXD1734246").sales_cost == Decimal("2000")
+
+    def test_interrupted_compaction_is_finished_on_start(
+            self, tmpdir: str, car_data: list[Car], model_data: list[Model]):
+        service = CarService(tmpdir)
+
+        self._fill_initial_data(service, car_data, model_data)
+        self._sell_and_revert(service)
+
+        # сбой после отметки о готовности, но до замены файла с продажами
+        service._finish_compaction = lambda: None
+        service.compact()
+        assert os.path.exists(os.path.join(tmpdir, "compact.commit"))
+        assert os.path.getsize(os.path.join(tmpdir, "sales.txt")) == 3 * 500
+
+        restarted = CarService(tmpdir)
+        assert not os.path.exists(os.path.join(tmpdir, "compact.commit"))
+        assert os.path.getsize(os.path.join(tmpdir, "sales.txt")) == 500
+        assert restarted.get_car_info("JM1BL1TFXD1734246").sales_date == datetime(2024, 9, 3)
+
+    def test_wal_replays_operations_lost_in_crash(
+            self, tmpdir: str, car_data: list[Car], model_data: list[Model]):
+        service = CarService(tmpdir, use_wal=True)
+
+        self._fill_initial_data(service, car_data, model_data)
+        assert service.checkpoint()
+        assert os.path.getsize(os.path.join(tmpdir, "wal.log")) == 0
+        durable = {}
+        for name in os.listdir(tmpdir):
+            if name != "wal.log":
+                with open(os.path.join(tmpdir, name), "rb") as file_durable:
+                    durable[name] = file_durable.read()
+
+        self._sell_and_revert(service)
+        # процесс падает без контрольной точки
+        service._wal.close()
+
+        # сбой: из изменений после контрольной точки до диска дошли
+        # только журнал и файл с продажами
+        for name, data in durable.items():
+            if name != "sales.txt":
+                with open(os.path.join(tmpdir, name + ".crash"), "wb") as file_durable:
+                    file_durable.write(data)
+                os.replace(os.path.join(tmpdir, name + ".crash"), os.path.join(tmpdir, name))
+
+        # экземпляр без журнала операции из журнала не применяет
+        assert CarService(tmpdir).get_car_info("JM1BL1TFXD1734246").status == CarStatus.available
+        restarted = CarService(tmpdir, use_wal=True)
+        assert os.path.getsize(os.path.join(tmpdir, "wal.log")) == 0
+        assert restarted.get_car_info("JM1BL1TFXD1734246").status == CarStatus.sold
+        assert restarted.get_car_info("JM1BL1TFXD1734246").sales_date == datetime(2024, 9, 3)
+        assert restarted.get_car_info("KNAGM4A77D5316538").status == CarStatus.available
+        assert restarted.get_car_info("KNAGM4A77D5316538").sales_date is None
+        assert restarted.top_models_by_sales() == [
+            ModelSaleStats(car_model_name="3", brand="Mazda", sales_number=1),
+        ]
+        assert "JM1BL1TFXD1734246" not in {car.vin for car in restarted.get_cars(CarStatus.available)}
+
+    def test_failed_wal_sync_does_not_block_writers(
+            self, tmpdir: str, car_data: list[Car], model_data: list[Model], monkeypatch):
+        service = CarService(tmpdir, use_wal=True)
+        self._fill_initial_data(service, car_data, model_data)
+        sale = Sale(sales_number="20240903#KNAGM4A77D5316538", car_vin="KNAGM4A77D5316538",
+                    sales_date=datetime(2024, 9, 3), cost=Decimal("2999.99"))
+
+        def failing_fsync(fd):
+            raise OSError(5, "Input/output error")
+
+        with monkeypatch.context() as patch:
+            patch.setattr(os, "fsync", failing_fsync)
+            with pytest.raises(OSError):
+                service.sell_car(sale)
+
+        # следующая операция не ждет очереди операции, не сброшенной на диск
+        other = sale.model_copy(update={"sales_number": "20240903#JM1BL1TFXD1734246",
+                                        "car_vin": "JM1BL1TFXD1734246"})
+        writer = threading.Thread(target=service.sell_car, args=(other,), daemon=True)
+        writer.start()
+        writer.join(timeout=10)
+        assert not writer.is_alive()
+        assert service.get_car_info(other.car_vin).status == CarStatus.sold
+        assert service.get_car_info(sale.car_vin).status == CarStatus.available
+
+        # после перезагрузки операции повторяются с контрольной точки,
+        # а операция с ошибкой сброса пропускается
+        service._wal.close()
+        marker_path = os.path.join(tmpdir, "wal.log.applied")
+        with open(marker_path, "rb") as file_marker:
+            durable, applied, _ = file_marker.read().split(b";")
+        with open(marker_path, "wb") as file_marker:
+            file_marker.write(b";".join([durable, applied, b"other-boot\n"]))
+        restarted = CarService(tmpdir, use_wal=True)
+        assert restarted.get_car_info(sale.car_vin).status == CarStatus.available
+        assert restarted.get_car_info(other.car_vin).status == CarStatus.sold
+        restarted.close()
+
+    @staticmethod
+    def _add_and_rename_then_crash(root: str, car: Car) -> None:
+        service = CarService(root, use_wal=True)
+        service.add_car(car)
+        service.update_vin(car.vin, "RENAMED0000000001")
+        os._exit(0)
+
+    def test_wal_replay_after_crash_keeps_renamed_car(
+            self, tmpdir: str, car_data: list[Car], model_data: list[Model]) -> None:
+        service = CarService(tmpdir, use_wal=True)
+        self._fill_initial_data(service, car_data, model_data)
+        service.close()
+
+        car = car_data[0].model_copy(update={"vin": "ADDED000000000001"})
+        process = multiprocessing.get_context("fork").Process(
+            target=self._add_and_rename_then_crash, args=(tmpdir, car))
+        process.start()
+        process.join()
+        assert process.exitcode == 0
+        assert os.path.getsize(os.path.join(tmpdir, "wal.log")) > 0
+
+        restarted = CarService(tmpdir, use_wal=True)
+        vins = [car.vin for car in restarted.get_cars(CarStatus.available)]
+        assert "RENAMED0000000001" in vins
+        assert "ADDED000000000001" not in vins
+        assert os.path.getsize(os.path.join(tmpdir, "cars.txt")) == (len(car_data) + 1) * 500
+        restarted.close()
+
+    @staticmethod
+    def _add_numbered_cars(root: str, prefix: str, count: int) -> None:
+        service = CarService(root)
+        for number in range(count):
+            service.add_car(
+                Car(
+                    vin=f"{prefix}{number:05d}",
+                    model=1,
+                    price=Decimal("2000"),
+                    date_start=datetime(2024, 2, 8),
+                    status=CarStatus.available,
+                )
+            )
+        service.close()
+
+    def test_concurrent_writers_keep_all_index_entries(self, tmpdir: str) -> None:
+        service = CarService(tmpdir)
+        service.add_model(Model(id=1, name="Optima", brand="Kia"))
+
+        def add_from_thread(prefix: str) -> None:
+            for number in range(25):
+                service.add_car(
+                    Car(
+                        vin=f"{prefix}{number:05d}",
+                        model=1,
+                        price=Decimal("2000"),
+                        date_start=datetime(2024, 2, 8),
+                        status=CarStatus.available,
+                    )
+                )
+
+        threads = [threading.Thread(target=add_from_thread, args=(f"T{number}",)) for number in range(4)]
+        context = multiprocessing.get_context("fork")
+        processes = [
+            context.Process(target=self._add_numbered_cars, args=(tmpdir, f"P{number}", 25)) for number in range(2)
+        ]
+        for worker in threads + processes:
+            worker.start()
+        for worker in threads + processes:
+            worker.join()
+        assert all(process.exitcode == 0 for process in processes)
+
+        expected_vins = {f"{prefix}{number:05d}" for prefix in ("T0", "T1", "T2", "T3", "P0", "P1") for number in range(25)}
+        for other_service in (service, CarService(tmpdir), CarService(tmpdir, index_in_memory=False)):
+            assert {car.vin for car in other_service.get_cars(CarStatus.available)} == expected_vins
+            assert all(other_service.get_car_info(vin) is not None for vin in expected_vins)
+
+    def test_binary_records_and_migration(self, tmpdir: str, car_data: list[Car], model_data: list[Model]) -> None:
+        service = CarService(tmpdir)
+        self._fill_initial_data(service, car_data, model_data)
+        self._sell_and_revert(service)
+        expected_info = service.get_car_info("JM1BL1TFXD1734246")
+        expected_available = service.get_cars(CarStatus.available)
+        service.close()
+
+        assert migrate_directory(tmpdir) == [FileForObject.model, FileForObject.car, FileForObject.sale]
+        assert migrate_directory(tmpdir) == []
+        with open(os.path.join(tmpdir, "cars.txt"), "rb") as file_cars:
+            assert file_cars.read(8) == b"BIBIPREC"
+        assert os.path.getsize(os.path.join(tmpdir, "cars.txt")) < len(car_data) * 500 // 5
+
+        for migrated in (CarService(tmpdir), CarService(tmpdir, index_in_memory=False)):
+            assert migrated.get_car_info("JM1BL1TFXD1734246") == expected_info
+            assert migrated.get_cars(CarStatus.available) == expected_available
+            assert migrated.top_models_by_sales() == [
+                ModelSaleStats(car_model_name="3", brand="Mazda", sales_number=1),
+            ]
+
+        migrated.revert_sale("20240903#JM1BL1TFXD1734246")
+        migrated.update_vin("KNAGM4A77D5316538", "KNAGM4A77D5316539")
+        assert migrated.get_car_info("JM1BL1TFXD1734246").status == CarStatus.available
+        assert migrated.get_car_info("KNAGM4A77D5316539").price == Decimal("2000")
+        migrated.close()
+
+        assert migrate_directory(tmpdir, "text") == [FileForObject.model, FileForObject.car, FileForObject.sale]
+        assert os.path.getsize(os.path.join(tmpdir, "cars.txt")) == len(car_data) * 500
+        assert CarService(tmpdir).get_car_info("KNAGM4A77D5316539").vin == "KNAGM4A77D5316539"
+
+    def test_values_outside_binary_format(self, tmpdir: str, car_data: list[Car], model_data: list[Model]) -> None:
+        service = CarService(tmpdir)
+        self._fill_initial_data(service, car_data, model_data)
+
+        # текстовый формат хранит цены точнее сотых и даты с часовым поясом как есть
+        fine_car = car_data[0].model_copy(update={
+            "vin": "NEWVIN00000000001", "price": Decimal("10.005"),
+            "date_start": datetime.fromisoformat("2024-01-01T01:00:00+03:00")})
+        service.add_car(fine_car)
+        assert service.get_car_info(fine_car.vin).price == fine_car.price
+        assert service.get_car_info(fine_car.vin).date_start == fine_car.date_start
+        assert service.get_car_info(fine_car.vin).date_start.utcoffset() is not None
+        sale = Sale(sales_number="20240903#KNAGM4A77D5316538", car_vin="KNAGM4A77D5316538",
+                    sales_date=datetime.fromisoformat("2024-09-03T03:00:00+03:00"), cost=Decimal("0.001"))
+        service.sell_car(sale)
+        assert service.get_car_info(sale.car_vin).sales_cost == sale.cost
+        assert service.get_car_info(sale.car_vin).sales_date == sale.sales_date
+        service.close()
+
+        # такие записи не дают перевести файлы в двоичный формат
+        with pytest.raises(ValueError, match="cars.txt, строка 12: .*sales.txt, строка 1:"):
+            migrate_directory(tmpdir)
+        for name in ("models.txt", "cars.txt", "sales.txt"):
+            with open(os.path.join(tmpdir, name), "rb") as file_records:
+                assert file_records.read(8) != b"BIBIPREC"
+
+        # дата с часовым поясом переводится в UTC при переводе файлов
+        service = CarService(tmpdir)
+        service._write_record(FileForObject.sale, 0, [sale.sales_number, sale.car_vin,
+                                                      "2024-09-03T03:00:00+03:00", "0.01", 0])
+        service._write_record(FileForObject.car, 11, [fine_car.vin, fine_car.model, "10.01",
+                                                     "2024-01-01T01:00:00+03:00", fine_car.status.value])
+        service.close()
+        assert migrate_directory(tmpdir) == [FileForObject.model, FileForObject.car, FileForObject.sale]
+        service = CarService(tmpdir)
+        assert service.get_car_info(fine_car.vin).date_start == datetime(2023, 12, 31, 22)
+
+        # двоичный файл не принимает цену точнее сотых и не меняется
+        cars_size = os.path.getsize(os.path.join(tmpdir, "cars.txt"))
+        with pytest.raises(ValueError):
+            service.add_car(fine_car.model_copy(update={"vin": "NEWVIN00000000002"}))
+        with pytest.raises(ValueError):
+            service.sell_car(sale.model_copy(update={"sales_number": "20240904#KNAGM4A77D5316538"}))
+        assert os.path.getsize(os.path.join(tmpdir, "cars.txt")) == cars_size
+        assert service.get_car_info("NEWVIN00000000002") is None
+        service.close()
+
+    def test_new_files_in_binary_format(self, tmpdir: str, car_data: list[Car], model_data: list[Model]) -> None:
+        service = CarService(tmpdir, record_format="binary")
+        self._fill_initial_data(service, car_data, model_data)
+        self._sell_and_revert(service)
+
+        assert os.path.getsize(os.path.join(tmpdir, "sales.txt")) < 3 * 500 // 4
+        assert service.get_car_info("JM1BL1TFXD1734246").sales_cost == Decimal("2000")
+        assert service.compact() > 0
+        assert CarService(tmpdir).get_car_info("JM1BL1TFXD1734246").sales_date == datetime(2024, 9, 3)
+        assert [car.vin for car in service.get_cars(CarStatus.delivery)] == ["VF1LZL2T4BC242298"]
+
+    def test_lsm_index(self, tmpdir: str, car_data: list[Car], model_data: list[Model]) -> None:
+        service = CarService(tmpdir, lsm_index=True, memtable_limit=2, max_runs=3)
+        self._fill_initial_data(service, car_data, model_data)
+        self._sell_and_revert(service)
+        service.update_vin("KNAGR4A63D5359556", "KNAGR4A63D5359557")
+
+        runs = [name for name in os.listdir(tmpdir) if ".run." in name]
+        assert runs and len([name for name in runs if name.startswith("cars_index.txt")]) <= 2 * 2
+        all_vins = sorted({car.vin for car in car_data} - {"KNAGR4A63D5359556"} | {"KNAGR4A63D5359557"})
+
+        def check(other_service: CarService) -> None:
+            assert other_service.get_car_info("KNAGR4A63D5359556") is None
+            assert other_service.get_car_info("KNAGR4A63D5359557").price == Decimal("2376")
+            assert other_service.get_car_info("JM1BL1TFXD1734246").sales_date == datetime(2024, 9, 3)
+            assert other_service.get_car_info("KNAGM4A77D5316538").sales_date is None
+            assert [car.vin for car in other_service.get_cars_page(limit=100).cars] == all_vins
+
+        # таблицу в памяти и файлы видит и другой экземпляр
+        check(service)
+        check(CarService(tmpdir, lsm_index=True))
+
+        service.merge_indexes()
+        assert [name for name in os.listdir(tmpdir) if ".run." in name] == []
+        check(service)
+        check(CarService(tmpdir))
+        check(CarService(tmpdir, index_in_memory=False))
+
+    def test_operation_stats_and_hook(self, tmpdir: str, car_data: list[Car], model_data: list[Model]) -> None:
+        service = CarService(tmpdir, index_in_memory=False)
+        self._fill_initial_data(service, car_data, model_data)
+        service.merge_indexes()
+        service.reset_stats()
+
+        service.get_car_info("KNAGM4A77D5316538")
+        service.get_car_info("UNKNOWN")
+        stats = service.stats()
+        assert stats["get_car_info"].calls == 2
+        assert sum(stats["get_car_info"].latency_histogram) == 2
+        assert stats["get_car_info"].file_opens > 0
+        assert stats["get_car_info"].records_scanned > 0
+        assert stats["get_car_info"].bytes_written == 0
+        # вложенные вызовы учитываются отдельно и входят во внешний
+        lookups = stats["_get_line_number_by_identifier"]
+        assert lookups.calls >= 3
+        assert lookups.total_ms <= stats["get_car_info"].total_ms
+
+        calls = []
+
+        def hook(operation, call):
+            calls.append(operation)
+            return call()
+
+        service.set_operation_hook(hook)
+        service.update_vin("KNAGM4A77D5316538", "KNAGM4A77D5316539")
+        profile = ProfileHook()
+        service.set_operation_hook(profile)
+        service.get_cars(CarStatus.available)
+        service.set_operation_hook(None)
+        # обработчик получает только внешние вызовы
+        assert calls == ["update_vin"]
+        assert list(profile.profiles) == ["get_cars"]
+        assert profile.get_stats("get_cars").total_calls > 0
+        assert service.stats()["update_vin"].bytes_written > 0
+        assert service.stats()["_delete_index"].calls == 1
+
+        service.reset_stats()
+        assert service.stats() == {}
+
+    def test_trusted_reads_and_car_records(self, tmpdir: str, car_data: list[Car], model_data: list[Model]) -> None:
+        service = CarService(tmpdir)
+        self._fill_initial_data(service, car_data, model_data)
+        self._sell_and_revert(service)
+        trusted = CarService(tmpdir, trusted_reads=True)
+
+        for status in CarStatus:
+            assert trusted.get_cars(status) == service.get_cars(status)
+            records = trusted.get_car_records(status)
+            assert [record.to_car() for record in records] == service.get_cars(status)
+        assert trusted.top_models_by_sales() == service.top_models_by_sales()
+        for car in car_data:
+            assert trusted.get_car_info(car.vin) == service.get_car_info(car.vin)
+
+        record = trusted.get_car_records(CarStatus.available)[0]
+        assert isinstance(record.price, Decimal) and isinstance(record.date_start, datetime)
+        assert not hasattr(record, "__dict__")
+
+    def test_get_car_infos_matches_single_lookups(
+            self, tmpdir: str, car_data: list[Car], model_data: list[Model], monkeypatch) -> None:
+        service = CarService(tmpdir)
+        self._fill_initial_data(service, car_data, model_data)
+        self._sell_and_revert(service)
+        vins = ["UNKNOWN", *reversed([car.vin for car in car_data]), car_data[0].vin]
+
+        for other_service in (service, CarService(tmpdir, index_in_memory=False),
+                              CarService(tmpdir, lsm_index=True)):
+            infos = other_service.get_car_infos(vins)
+            assert list(infos) == list(dict.fromkeys(vins))
+            assert infos == {vin: service.get_car_info(vin) for vin in vins}
+
+        # при небольшой доле запрошенных записей индекс на диске не читается целиком
+        monkeypatch.setattr("bibip_car_service.BATCH_SCAN_RATIO", 0)
+        disk_service = CarService(tmpdir, index_in_memory=False)
+        assert disk_service.get_car_infos(vins) == service.get_car_infos(vins)
+        assert disk_service.stats()["_get_line_number_by_identifier"].calls > 0
+
+    def test_caches_are_invalidated_by_writes(
+            self, tmpdir: str, car_data: list[Car], model_data: list[Model]) -> None:
+        service = CarService(tmpdir, car_info_cache_size=4)
+        self._fill_initial_data(service, car_data, model_data)
+        vin = "KNAGM4A77D5316538"
+
+        assert service.get_car_info(vin).status == CarStatus.available
+        info = service.get_car_info(vin)
+        # изменение возвращенного объекта не портит кэш
+        info.price = Decimal("1")
+        assert service.get_car_info(vin).price == Decimal("2000")
+        assert service.cache_stats()["car_infos"].hits == 2
+
+        sale = Sale(sales_number="20240903#KNAGM4A77D5316538", car_vin=vin,
+                    sales_date=datetime(2024, 9, 3), cost=Decimal("2999.99"))
+        service.sell_car(sale)
+        assert service.get_car_info(vin).sales_cost == Decimal("2999.99")
+        assert service.get_car_infos([vin])[vin].status == CarStatus.sold
+        service.revert_sale(sale.sales_number)
+        assert service.get_car_info(vin).sales_date is None
+        service.update_vin(vin, "KNAGM4A77D5316539")
+        assert service.get_car_info(vin) is None
+        assert service.get_car_info("KNAGM4A77D5316539").status == CarStatus.available
+
+        # в кэше не больше 4 автомобилей, а модели читаются один раз
+        service.get_car_infos([car.vin for car in car_data])
+        stats = service.cache_stats()
+        assert stats["car_infos"].size == 4
+        assert stats["car_infos"].evictions > 0
+        assert stats["models"].size == len({car.model for car in car_data})
+        assert stats["models"].hits > 0
+
+    def test_find_cars_by_date_and_price(
+            self, tmpdir: str, car_data: list[Car], model_data: list[Model]) -> None:
+        service = CarService(tmpdir)
+        self._fill_initial_data(service, car_data, model_data)
+        self._sell_and_revert(service)
+        service.update_vin("KNAGM4A77D5316538", "KNAGM4A77D5316539")
+        # автомобили в порядке строк файла: при равных значениях
+        # результат упорядочен по строке
+        all_cars = []
+        for car in car_data:
+            vin = "KNAGM4A77D5316539" if car.vin == "KNAGM4A77D5316538" else car.vin
+            status = CarStatus.sold if vin == "JM1BL1TFXD1734246" else car.status
+            all_cars.append(car.model_copy(update={"vin": vin, "status": status}))
+
+        def expected(status=None, date_from=None, date_to=None, price_min=None, price_max=None, order_by="date_start"):
+            cars = [
+                car for car in all_cars
+                if (status is None or car.status == status)
+                and (date_from is None or car.date_start >= date_from)
+                and (date_to is None or car.date_start <= date_to)
+                and (price_min is None or car.price >= price_min)
+                and (price_max is None or car.price <= price_max)
+            ]
+            return sorted(cars, key=lambda car: getattr(car, order_by))
+
+        queries = [
+            {},
+            {"date_from": datetime(2024, 2, 20), "date_to": datetime(2024, 6, 1)},
+            {"status": CarStatus.available, "date_to": datetime(2024, 5, 17)},
+            {"status": CarStatus.sold},
+            {"price_min": Decimal("2100"), "price_max": Decimal("2300")},
+            {"price_min": Decimal("2100.001"), "order_by": "date_start"},
+            {"status": CarStatus.available, "date_from": datetime(2024, 3, 1), "order_by": "price"},
+        ]
+        for other_service in (service, CarService(tmpdir, index_in_memory=False),
+                              CarService(tmpdir, lsm_index=True)):
+            for query in queries:
+                order_by = query.get("order_by", "price" if "price_min" in query and len(query) == 2 else "date_start")
+                assert other_service.find_cars(**query) == expected(**{**query, "order_by": order_by})
+            assert other_service.find_cars(limit=2) == expected()[:2]
+
+        with pytest.raises(ValueError):
+            service.find_cars(order_by="vin")
+
+        # БД, созданная до появления индексов по дате и цене
+        for name in ("cars_date_index.txt", "cars_price_index.txt"):
+            _remove_index(tmpdir, name)
+        assert CarService(tmpdir).find_cars(order_by="price") == expected(order_by="price")
+        assert os.path.exists(os.path.join(tmpdir, "cars_price_index.txt"))
+
+    @pytest.mark.parametrize("record_format", ["text", "binary"])
+    def test_parallel_scan_matches_serial(
+            self, tmpdir: str, car_data: list[Car], model_data: list[Model], record_format: str) -> None:
+        service = CarService(tmpdir, record_format=record_format)
+        self._fill_initial_data(service, car_data, model_data)
+        self._sell_and_revert(service)
+        serial = {status: service.get_cars(status) for status in CarStatus}
+        top_models = service.top_models_by_sales()
+
+        parallel = CarService(tmpdir, scan_workers=2, parallel_scan_threshold=1)
+        # процессы пула не наследуют потоки и блокировки через fork
+        assert parallel._scanner._mp_context.get_start_method() != "fork"
+        try:
+            for status in CarStatus:
+                assert parallel.get_cars(status) == serial[status]
+                assert [record.to_car() for record in parallel.get_car_records(status)] == serial[status]
+            assert parallel.rebuild_sales_aggregates() == service.rebuild_sales_aggregates()
+            # индексы продаж по vin и статусов строятся заново параллельным обходом
+            _remove_index(tmpdir, "sales_car_index.txt")
+            os.remove(os.path.join(tmpdir, "cars_status_index.txt"))
+            parallel.rebuild_indexes()
+            assert parallel.get_car_info("JM1BL1TFXD1734246").sales_date == datetime(2024, 9, 3)
+            assert parallel.get_car_info("KNAGM4A77D5316538").sales_date is None
+            assert parallel.get_cars(CarStatus.sold) == serial[CarStatus.sold]
+            assert parallel.top_models_by_sales() == top_models
+            assert parallel.stats()["get_cars"].records_scanned > 0
+        finally:
+            parallel.close()
+
+    def test_top_models_for_period(
+            self, tmpdir: str, car_data: list[Car], model_data: list[Model]) -> None:
+        service = CarService(tmpdir, reuse_free_slots=True)
+        self._fill_initial_data(service, car_data, model_data)
+        for vin, day, cost in [
+            ("KNAGM4A77D5316538", datetime(2024, 9, 1), "1000"),
+            ("KNAGH4A48A5414970", datetime(2024, 9, 10), "1000"),
+            ("JM1BL1TFXD1734246", datetime(2024, 9, 10), "5000"),
+            ("5N1CR2MN9EC641864", datetime(2024, 9, 20), "1500"),
+            ("5N1CR2TS0HW037674", datetime(2024, 10, 1), "1500"),
+            ("KNAGR4A63D5359556", datetime(2024, 10, 5), "900"),
+        ]:
+            service.sell_car(Sale(sales_number=f"{day:%Y%m%d}#{vin}", car_vin=vin,
+                                  sales_date=day, cost=Decimal(cost)))
+        service.revert_sale("20241005#KNAGR4A63D5359556")
+
+        def names(stats: list[ModelSaleStats]) -> list[tuple]:
+            return [(stat.car_model_name, stat.sales_number, stat.revenue) for stat in stats]
+
+        def check(other_service: CarService) -> None:
+            assert names(other_service.top_models()) == [
+                ("Pathfinder", 2, Decimal("3000")), ("Optima", 2, Decimal("2000")), ("3", 1, Decimal("5000"))]
+            assert names(other_service.top_models(1, by="revenue")) == [("3", 1, Decimal("5000"))]
+            period = other_service.top_models(since=datetime(2024, 9, 10), until=datetime(2024, 10, 1))
+            assert names(period) == [
+                ("3", 1, Decimal("5000")), ("Pathfinder", 1, Decimal("1500")), ("Optima", 1, Decimal("1000"))]
+            assert names(other_service.top_models(10, since=datetime(2024, 10, 1))) == [
+                ("Pathfinder", 1, Decimal("1500"))]
+            assert other_service.top_models(until=datetime(2024, 9, 1)) == []
+
+        for other_service in (service, CarService(tmpdir, index_in_memory=False),
+                              CarService(tmpdir, lsm_index=True)):
+            check(other_service)
+        with pytest.raises(ValueError):
+            service.top_models(by="price")
+
+        # продажа на освободившемся месте и уплотнение файла с продажами
+        service.sell_car(Sale(sales_number="20241006#KNAGR4A63D5359556", car_vin="KNAGR4A63D5359556",
+                              sales_date=datetime(2024, 10, 6), cost=Decimal("900")))
+        service.revert_sale("20241006#KNAGR4A63D5359556")
+        service.revert_sale("20240901#KNAGM4A77D5316538")
+        service.sell_car(Sale(sales_number="20240901#KNAGM4A77D5316538", car_vin="KNAGM4A77D5316538",
+                              sales_date=datetime(2024, 9, 1), cost=Decimal("1000")))
+        service.compact()
+        check(service)
+
+        # БД, созданная до появления индекса продаж по дате
+        _remove_index(tmpdir, "sales_date_index.txt")
+        check(CarService(tmpdir))
+
+    @pytest.mark.parametrize("record_format", ["text", "binary"])
+    def test_read_snapshot_is_isolated_from_writes(
+            self, tmpdir: str, car_data: list[Car], model_data: list[Model], record_format: str) -> None:
+        service = CarService(tmpdir, record_format=record_format)
+        self._fill_initial_data(service, car_data, model_data)
+        service.sell_car(Sale(sales_number="20240901#KNAGM4A77D5316538", car_vin="KNAGM4A77D5316538",
+                              sales_date=datetime(2024, 9, 1), cost=Decimal("1000")))
+        available = service.get_cars(CarStatus.available)
+        top = service.top_models_by_sales()
+
+        with service.read_snapshot() as snapshot:
+            assert len(snapshot) == len(car_data)
+            service.sell_car(Sale(sales_number="20240902#JM1BL1TFXD1734246", car_vin="JM1BL1TFXD1734246",
+                                  sales_date=datetime(2024, 9, 2), cost=Decimal("5000")))
+            service.update_vin("5N1CR2MN9EC641864", "5N1CR2MN9EC641865")
+            service.revert_sale("20240901#KNAGM4A77D5316538")
+            CarService(tmpdir).add_car(car_data[0].model_copy(update={"vin": "NEWVIN00000000001"}))
+
+            assert snapshot.get_cars(CarStatus.available) == available
+            assert [car.vin for car in snapshot.get_car_records(CarStatus.available)] == [
+                car.vin for car in available]
+            assert len(list(snapshot.iter_cars())) == len(car_data)
+            assert snapshot.top_models_by_sales() == top
+            assert [stat.revenue for stat in snapshot.top_models(1)] == [Decimal("1000")]
+
+            # новые запросы видят изменения
+            after = service.get_cars(CarStatus.available)
+            assert "5N1CR2MN9EC641865" in {car.vin for car in after}
+            assert "JM1BL1TFXD1734246" not in {car.vin for car in after}
+            assert service.top_models_by_sales() != top
+
+        assert not record_store._open_views
@@ -0,0 +1,155 @@
+import os
+from decimal import Decimal
+
+import pytest
+
+from benchmarks.generators import generate_cars, generate_models, make_car, make_sale, make_vin
+from bibip_car_service import CarService
+from models import CarStatus
+from reshard import reshard
+from sharded_service import ShardedCarService, shard_of
+
+
+def _fill(service) -> list:
+    models = generate_models(7)
+    service.add_models(models)
+    service.add_cars(generate_cars(0, 200, len(models)))
+    sales = [
+        make_sale(number, make_vin(number))
+        for number in range(0, 200, 3)
+        if make_car(number, len(models)).status == CarStatus.available
+    ]
+    service.sell_cars(sales)
+    for sale in sales[:4]:
+        service.revert_sale(sale.sales_number)
+    return sales
+
+
+def _check_same(sharded: ShardedCarService, single: CarService) -> None:
+    for status in CarStatus:
+        assert sorted(sharded.get_cars(status), key=lambda car: car.vin) == sorted(
+            single.get_cars(status), key=lambda car: car.vin)
+    assert sharded.top_models_by_sales() == single.top_models_by_sales()
+    assert sharded.top_models(5, by="revenue") == single.top_models(5, by="revenue")
+    cheapest = sharded.find_cars(status=CarStatus.available, price_min=Decimal(0), limit=10)
+    assert [car.price for car in cheapest] == [
+        car.price for car in single.find_cars(status=CarStatus.available, price_min=Decimal(0), limit=10)]
+    vins = [make_vin(number) for number in range(0, 200, 7)] + ["UNKNOWNVIN0000000"]
+    assert sharded.get_car_infos(vins) == single.get_car_infos(vins)
+
+
+class TestShardedCarService:
+    def test_matches_single_directory(self, tmpdir: str) -> None:
+        paths = [os.path.join(tmpdir, f"shard{i}") for i in range(3)]
+        sharded = ShardedCarService(paths)
+        single = CarService(tmpdir)
+        sales = _fill(sharded)
+        _fill(single)
+
+        # автомобили и продажи разделены по шардам, модели скопированы
+        for shard, service in enumerate(sharded.shards):
+            cars = [car for status in CarStatus for car in service.get_cars(status)]
+            assert cars and all(shard_of(car.vin, 3) == shard for car in cars)
+            assert service.get_car_info(cars[0].vin).car_model_name
+        _check_same(sharded, single)
+
+        # идентификатор продажи уникален во всех шардах
+        sale = sales[-1]
+        other_vin = next(make_vin(number) for number in range(200)
+                         if shard_of(make_vin(number), 3) != shard_of(sale.car_vin, 3))
+        duplicate = make_sale(0, other_vin).model_copy(update={"sales_number": sale.sales_number})
+        assert sharded.sell_cars([duplicate]) == [None]
+        assert sharded.revert_sale("unknown") is None
+        sharded.revert_sale(sale.sales_number)
+        single.revert_sale(sale.sales_number)
+        _check_same(sharded, single)
+
+        # при смене vin автомобиль остается в своем шарде
+        vin = make_vin(5)
+        same_shard_vin = next(f"NEWVIN{number:011d}" for number in range(100)
+                              if shard_of(f"NEWVIN{number:011d}", 3) == shard_of(vin, 3))
+        other_shard_vin = next(f"NEWVIN{number:011d}" for number in range(100)
+                               if shard_of(f"NEWVIN{number:011d}", 3) != shard_of(vin, 3))
+        sharded.update_vin(vin, same_shard_vin)
+        assert sharded.get_car_info(vin) is None
+        assert sharded.get_car_info(same_shard_vin).vin == same_shard_vin
+        sharded.update_vin(same_shard_vin, other_shard_vin)
+        assert sharded.get_car_info(same_shard_vin) is None
+        assert sharded.get_car_info(other_shard_vin).vin == other_shard_vin
+        assert sharded.shard_for(other_shard_vin) is sharded.shards[shard_of(vin, 3)]
+        assert sharded.add_car(make_car(5, 7).model_copy(update={"vin": other_shard_vin})) is None
+        assert sharded.update_vin("UNKNOWNVIN0000000", other_shard_vin) is None
+
+        # проданный автомобиль переименовывается вместе с продажей
+        sold = next(sale for sale in sales[4:-1]
+                    if shard_of(sale.car_vin, 3) == shard_of(other_shard_vin, 3))
+        sold_vin = next(f"SOLDVIN{number:010d}" for number in range(100)
+                        if shard_of(f"SOLDVIN{number:010d}", 3) != shard_of(sold.car_vin, 3))
+        sharded.update_vin(sold.car_vin, sold_vin)
+        single.update_vin(sold.car_vin, sold_vin)
+        assert sharded.get_car_info(sold_vin).sales_cost == sold.cost
+        sharded.revert_sale(sold.sales_number)
+        single.revert_sale(sold.sales_number)
+        assert sharded.get_car_info(sold_vin).status == CarStatus.available
+        resold = make_sale(201, sold_vin)
+        assert sharded.sell_cars([resold]) == [resold]
+        single.sell_cars([resold])
+
+        # другой экземпляр видит маршруты, а возврат vin в свой шард их удаляет
+        other = ShardedCarService(paths)
+        assert other.get_car_info(other_shard_vin).vin == other_shard_vin
+        assert other.get_car_info(sold_vin).sales_date == resold.sales_date
+        other.update_vin(other_shard_vin, vin)
+        assert sharded.get_car_info(vin).vin == vin
+        assert sharded.get_car_info(other_shard_vin) is None
+        other.close()
+        _check_same(sharded, single)
+
+        with pytest.raises(ValueError):
+            ShardedCarService(paths[:2])
+        sharded.close()
+
+        # перенос раскладывает переименованные автомобили по хэшам vin
+        two = [os.path.join(tmpdir, f"two{i}") for i in range(2)]
+        reshard(paths, two)
+        resharded = ShardedCarService(two)
+        assert not os.path.exists(os.path.join(two[0], "routes.json"))
+        _check_same(resharded, single)
+        resharded.close()
+
+    def test_repeated_sales_number_in_batch(self, tmpdir: str) -> None:
+        sharded = ShardedCarService([os.path.join(tmpdir, f"shard{i}") for i in range(3)])
+        models = generate_models(7)
+        sharded.add_models(models)
+        sharded.add_cars(generate_cars(0, 20, len(models)))
+        first_vin = make_vin(0)
+        second_vin = next(make_vin(number) for number in range(1, 20)
+                          if shard_of(make_vin(number), 3) != shard_of(first_vin, 3))
+
+        # продажи с одним идентификатором относятся к разным шардам
+        batch = [make_sale(0, vin).model_copy(update={"sales_number": "BATCH#1"})
+                 for vin in (first_vin, second_vin)]
+        assert sharded.sell_cars(batch) == [batch[0], None]
+        assert sharded.get_car_info(first_vin).sales_date is not None
+        assert sharded.get_car_info(second_vin).sales_date is None
+        sharded.close()
+
+    def test_reshard(self, tmpdir: str) -> None:
+        source = os.path.join(tmpdir, "source")
+        os.makedirs(source)
+        single = CarService(source)
+        sales = _fill(single)
+        single.close()
+
+        three = [os.path.join(tmpdir, f"three{i}") for i in range(3)]
+        moved = reshard([source], three)
+        # отмененные продажи не переносятся
+        assert list(moved.values()) == [7, 200, len(sales) - 4]
+        two = [os.path.join(tmpdir, f"two{i}") for i in range(2)]
+        reshard(three, two, record_format="binary")
+
+        sharded = ShardedCarService(two, trusted_reads=True)
+        _check_same(sharded, CarService(source))
+        sharded.close()
+        with pytest.raises(ValueError):
+            reshard([source], two)
@@ -0,0 +1,93 @@
+import os
+import threading
+import time
+
+import pytest
+
+import wal
+from wal import WriteAheadLog
+
+
+class TestWriteAheadLog:
+    def test_append_commit_truncate(self, tmpdir: str) -> None:
+        path = os.path.join(tmpdir, "wal.log")
+        log = WriteAheadLog(path)
+
+        first = log.append("revert_sale", {"sales_number": "1"})
+        second = log.append("update_vin", {"vin": "A", "new_vin": "B"})
+        log.commit(second)
+        assert second == first + 1
+
+        # журналом владеет один экземпляр
+        with pytest.raises(RuntimeError):
+            WriteAheadLog(path)
+        log.close()
+
+        # недописанная при сбое строка пропускается и отрезается
+        with open(path, "ab") as file_log:
+            file_log.write(b'{"lsn": 3, "op"')
+        log = WriteAheadLog(path)
+        assert [record["op"] for record in log.operations()] == ["revert_sale", "update_vin"]
+        log.commit(log.append("revert_sale", {"sales_number": "3"}))
+        assert [record["lsn"] for record in log.operations()] == [first, second, second + 1]
+
+        log.truncate()
+        assert log.operations() == []
+        assert log.append("revert_sale", {"sales_number": "2"}) == second + 2
+        log.close()
+
+    def test_torn_only_record_is_cut_off(self, tmpdir: str) -> None:
+        path = os.path.join(tmpdir, "wal.log")
+        with open(path, "wb") as file_log:
+            file_log.write(b'{"lsn": 1, "op": "add_c')
+        log = WriteAheadLog(path)
+        assert log.operations() == []
+        log.commit(log.append("add_cars", {"cars": []}))
+        log.close()
+        assert [record["op"] for record in WriteAheadLog(path).operations()] == ["add_cars"]
+
+    def test_applied_operations_are_not_returned(self, tmpdir: str) -> None:
+        path = os.path.join(tmpdir, "wal.log")
+        log = WriteAheadLog(path)
+        first = log.append("revert_sale", {"sales_number": "1"})
+        second = log.append("revert_sale", {"sales_number": "2"})
+        log.commit(second)
+        log.mark_applied(first)
+        log.close()
+
+        log = WriteAheadLog(path)
+        assert [record["lsn"] for record in log.operations()] == [second]
+        log.mark_durable(second)
+        log.truncate()
+        log.close()
+        # номера операций продолжаются после очистки журнала
+        log = WriteAheadLog(path)
+        assert log.append("revert_sale", {"sales_number": "3"}) == second + 1
+        log.close()
+
+    def test_concurrent_commits_share_fsync(self, tmpdir: str, monkeypatch) -> None:
+        log = WriteAheadLog(os.path.join(tmpdir, "wal.log"))
+        fsync = os.fsync
+        fsync_calls = []
+
+        def slow_fsync(fd: int) -> None:
+            fsync_calls.append(fd)
+            time.sleep(0.05)
+            fsync(fd)
+
+        monkeypatch.setattr(wal.os, "fsync", slow_fsync)
+        barrier = threading.Barrier(8)
+
+        def write(number: int) -> None:
+            barrier.wait()
+            log.commit(log.append("revert_sale", {"sales_number": str(number)}))
+
+        threads = [threading.Thread(target=write, args=(number,)) for number in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert len(log.operations()) == 8
+        assert len(fsync_calls) < 8
+        log.close()